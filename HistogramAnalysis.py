@@ -1,13 +1,27 @@
-import numpy as np
-import matplotlib.pyplot as plt
+'''
+Histogram and log-normal statistics of the pipeline's county distributions: census population,
+tweet tallies (Resources/Tally/*.json), and color values (Resources/Color/*.csv).
+
+Statistics and histograms are computed with numpy for every time block at once. Rendering is
+optional and draws on matplotlib Figure objects directly (never through pyplot), so it runs
+headless, e.g. for batch QA of the color scaling on a machine without a display.
+'''
+
 import json
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+mplfigure = lazyModule('matplotlib.figure')
+font_manager = lazyModule('matplotlib.font_manager')
+
+##### ------------------------------------- DATA ------------------------------------- #####
 
-def getPopData():
+def getPopData(censusdatafile='Resources/censusdata.json'):
     '''
     USAGE: Get population data and put it in a dataframe.
-    RETURN: cd_df - census dataframe with 'POP', 'GEONAME', and 'CountyCode' columns 
+    RETURN: cd_df - census dataframe with 'POP', 'GEONAME', and 'CountyCode' columns
     '''
-    censusdatafile = 'Resources/censusdata.json'
     with open(censusdatafile, 'r') as cdf:
         censusdata = json.load(cdf)
 
@@ -19,22 +33,29 @@ def getPopData():
 
     return cd_df
 
-def histPop(histlist, scale, bins, name=None):
+def loadTally(timetallyfile):
     '''
-    USAGE: Plot and export population histogram.
+    USAGE: Load a tally file written by TweetDF.timeTally() into an array.
+    RETURNS: codes - list of county codes; tally - (counties x blocks) array of tallies
     '''
-    plt.xlabel('Population', size = 14)
-    plt.ylabel('# of Counties', size = 14)
-    plt.title('Population: Lognormal Distribution', size = 20)
-    plt.xlim(scale)
-    
-    n, bins, patches = plt.hist(histlist, color='lightgray', bins=bins)
-    
-    if name:
-        plt.savefig(name, dpi=200)
-        
-    plt.show()
-    
+    with open(timetallyfile, 'r') as f:
+        county_tally = json.load(f)
+    return list(county_tally), np.array(list(county_tally.values()), dtype=float)
+
+def loadColor(countycolorfile):
+    '''
+    USAGE: Load a color file written by TweetDF.tally2value() into arrays.
+    RETURNS: codes - list of county codes; tally, value - (counties x blocks) arrays; pop - array of populations
+    '''
+    # Files written on Windows are cp1252/latin-1 encoded (county names like "Doña Ana")
+    cc_df = pd.read_csv(countycolorfile, dtype={'CountyCode': str}, encoding='latin-1')
+    tally = np.array([json.loads(t) for t in cc_df['Tally']], dtype=float)
+    value = np.array([json.loads(v) for v in cc_df['Value']], dtype=float)
+    pop = pd.to_numeric(cc_df['Population'], errors='coerce').values
+    return list(cc_df['CountyCode']), tally, value, pop
+
+##### ---------------------------------- STATISTICS ---------------------------------- #####
+
 def getStats(histlist):
     '''
     USAGE: Calculate mean and standard deviation of list.
@@ -43,81 +64,241 @@ def getStats(histlist):
     mu = np.mean(histlist)
     sigma = np.std(histlist)
     return [mu, sigma]
-    
-def plotStatLines(histlist):
+
+def logNormStats(data, axis=None):
+    '''
+    USAGE:
+    Fit a log-normal distribution to the positive entries of an array (zeros, e.g. counties with
+    no tweets, are ignored), optionally separately along each row or column.
+
+    ARGUMENTS:
+    data - array of values (e.g. (counties x blocks) tallies)
+    axis - None to fit all entries together, 0 to fit each block (column) separately
+
+    RETURNS:
+    mu, sigma - mean and standard deviation of log(data) (arrays if axis is given)
+    count - number of positive entries used in each fit
+    '''
+    data = np.asarray(data, dtype=float)
+    positive = data > 0
+    logdata = np.where(positive, np.log(np.where(positive, data, 1)), np.nan)
+    count = positive.sum(axis=axis)
+    with np.errstate(invalid='ignore'):
+        mu = np.nanmean(logdata, axis=axis) if count.any() else np.nan
+        sigma = np.nanstd(logdata, axis=axis) if count.any() else np.nan
+    return mu, sigma, count
+
+def colorValues(tally, pop):
+    '''
+    USAGE:
+    Vectorized form of the color scaling in TweetDF.tally2value(): log(tally/pop) over all counties
+    and blocks, mean-normalized and feature-scaled. Entries with no tally or population (or with
+    log(tally/pop) exactly 0, as in the original loop) are set to the minimum color value.
+
+    ARGUMENTS:
+    tally - (counties x blocks) array of tallies
+    pop - array of county populations
+
+    RETURNS:
+    value - (counties x blocks) array of color values
+    stats - dictionary of "mu", "sigma", and "mincolor"
+    '''
+    tally = np.asarray(tally, dtype=float)
+    pop = np.asarray(pop, dtype=float)[:, None]
+    ok = (tally != 0) & (pop != 0) & np.isfinite(tally) & np.isfinite(pop)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.where(ok, np.log(np.where(ok, tally / pop, 1)), 0)
+    ok = v != 0
+
+    mu, sigma = v[ok].mean(), v[ok].std()
+    scaled = (v - mu) / sigma
+    mincolor = scaled[ok].min()
+    return np.where(ok, scaled, mincolor), {'mu': mu, 'sigma': sigma, 'mincolor': mincolor}
+
+def binnedHistograms(data, bins, scale):
+    '''
+    USAGE:
+    Histogram every column of a (counties x blocks) array at once, with shared bins. Entries are
+    mapped to (block, bin) cells and counted with a single np.bincount.
+
+    ARGUMENTS:
+    data - 1D array, or (counties x blocks) array of values
+    bins - number of histogram bins
+    scale - [min, max] range of the bins (values outside it are not counted)
+
+    RETURNS:
+    counts - array of counts (blocks x bins), or (bins,) for 1D data
+    edges - array of bin edges (bins + 1)
+    '''
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        return np.histogram(data, bins=bins, range=scale)
+
+    edges = np.linspace(scale[0], scale[1], bins + 1)
+    blocks = data.shape[1]
+    idx = np.floor((data - scale[0]) / (scale[1] - scale[0]) * bins).astype(np.int64)
+    idx[data == scale[1]] = bins - 1    # include the right edge, like np.histogram
+    valid = (idx >= 0) & (idx < bins) & np.isfinite(data)
+    flat = (np.arange(blocks)[None, :] * bins + idx)[valid]
+    counts = np.bincount(flat, minlength=blocks * bins).reshape(blocks, bins)
+    return counts, edges
+
+def colorQA(countycolorfile, bins=80, scale=(-3, 3)):
+    '''
+    USAGE:
+    Summarize the color scaling of a color file: recompute the color values from its tallies and
+    populations, compare them to the stored values, and histogram the values of every block.
+
+    RETURNS:
+    qa - dictionary of "mu", "sigma", "mincolor", "maxdiff" (largest difference between stored and
+        recomputed values), "inrange" (fraction of non-minimum values within [-2, 2], per block),
+        "counts" and "edges" (histograms of values per block)
+    '''
+    codes, tally, value, pop = loadColor(countycolorfile)
+    recomputed, qa = colorValues(tally, pop)
+    qa['maxdiff'] = np.abs(recomputed - value).max()
+    colored = value != qa['mincolor']
+    with np.errstate(invalid='ignore'):
+        qa['inrange'] = ((np.abs(value) <= 2) & colored).sum(axis=0) / colored.sum(axis=0)
+    qa['counts'], qa['edges'] = binnedHistograms(value, bins, scale)
+    return qa
+
+##### ---------------------------------- RENDERING ---------------------------------- #####
+
+def newFigure():
+    '''
+    USAGE: Create a headless matplotlib figure (no pyplot, so no display is needed).
+    RETURNS: fig, ax - Figure and its single Axes
+    '''
+    fig = mplfigure.Figure(figsize=(8, 6))
+    ax = fig.add_subplot(1, 1, 1)
+    if 'Open Sans' in set(f.name for f in font_manager.fontManager.ttflist):
+        for item in [ax.title, ax.xaxis.label, ax.yaxis.label]:
+            item.set_family('Open Sans')
+    return fig, ax
+
+def plotHistogram(ax, counts, edges):
+    '''
+    USAGE: Draw precomputed histogram counts.
+    '''
+    ax.stairs(counts, edges, fill=True, color='lightgray')
+
+def plotStatLines(ax, mu, sigma):
     '''
     USAGE: Plot mean and 2 standard deviation lines on histogram
-    RETURNS: [mu, sigma] - mean and standard deviation of histlist
     '''
-    [mu, sigma] = getStats(histlist)
-    
-    plt.axvline(mu, color = 'darkred')
-    plt.axvline(mu + sigma, color = 'darkblue', ls = '--')
-    plt.axvline(mu - sigma, color = 'darkblue', ls = '--')
-    plt.axvline(mu + 2*sigma, color = 'darkgreen', ls = '--')
-    plt.axvline(mu - 2*sigma, color = 'darkgreen', ls = '--')
-    
-    return [mu, sigma]
+    ax.axvline(mu, color = 'darkred')
+    ax.axvline(mu + sigma, color = 'darkblue', ls = '--')
+    ax.axvline(mu - sigma, color = 'darkblue', ls = '--')
+    ax.axvline(mu + 2*sigma, color = 'darkgreen', ls = '--')
+    ax.axvline(mu - 2*sigma, color = 'darkgreen', ls = '--')
 
-def plotMuSig(mu, sigma):
+def plotMuSig(ax, mu, sigma):
     '''
     USAGE: Plot mu and sigma labels.
     '''
-    plt.text(mu + 0.1, 100, r'$\mu$ = %s' % str(np.round(mu,1)), size = 13)
-    plt.text(mu + sigma + 0.2, 80, r'$\sigma$ = %s' % str(np.round(sigma,1)), size = 13)
+    ax.text(mu + 0.1, 100, r'$\mu$ = %s' % str(np.round(mu,1)), size = 13)
+    ax.text(mu + sigma + 0.2, 80, r'$\sigma$ = %s' % str(np.round(sigma,1)), size = 13)
 
-def normPopLabels():
+def setLabels(ax, xlabel, title, ylabel='# of Counties'):
     '''
-    USAGE: Plot x, y, and title labels for log(pop) plot.
+    USAGE: Plot x, y, and title labels.
     '''
-    plt.xlabel('log(Population)', size = 14)
-    plt.ylabel('# of Counties', size = 14)
-    plt.title('log(Pop): Normal Distribution', size = 20)
+    ax.set_xlabel(xlabel, size = 14)
+    ax.set_ylabel(ylabel, size = 14)
+    ax.set_title(title, size = 20)
 
-def featScaledLabels():
+def saveFigure(fig, name):
     '''
-    USAGE: Plot x, y, and title labels for feature-scaled and mean-normalized log(pop) plot.
+    USAGE: Save figure to disk (if a name is given) and return it.
     '''
-    plt.xlabel('Standard Deviations from Mean', size = 14)
-    plt.ylabel('# of Counties', size = 14)
-    plt.title('log(Pop): Scaled, Mean-Normalized', size = 20)
-    
+    if name:
+        fig.savefig(name, dpi=200)
+        print('Histogram saved to "%s".' % name)
+    return fig
+
+def histPop(histlist, scale, bins, name=None):
+    '''
+    USAGE: Plot and export population histogram.
+    '''
+    counts, edges = binnedHistograms(histlist, bins, scale)
+    fig, ax = newFigure()
+    plotHistogram(ax, counts, edges)
+    setLabels(ax, 'Population', 'Population: Lognormal Distribution')
+    ax.set_xlim(scale)
+    return saveFigure(fig, name)
+
 def histNorm(histlist, scale, bins, featscaled=None, name=None):
     '''
-    USAGE: 
+    USAGE:
     Generate a labeled histogram of normally distributed data.
-    
-    ARGUMENTS: 
+
+    ARGUMENTS:
     histlist - list or array of data
     scale - specify bounds of x-axis [min, max]
     bins - number of histogram bins
+    featscaled - if set, label the plot as feature-scaled and mean-normalized data
+    name - optional: file name to save the plot to
     '''
-    
-    [mu, sigma] = plotStatLines(histlist)
-        
-    plotMuSig(mu, sigma)
-    plt.rcParams["font.family"] = "Open Sans"
-    plt.xlim(scale)
+    [mu, sigma] = getStats(histlist)
+    counts, edges = binnedHistograms(histlist, bins, scale)
+
+    fig, ax = newFigure()
+    plotHistogram(ax, counts, edges)
+    plotStatLines(ax, mu, sigma)
+    plotMuSig(ax, mu, sigma)
+    ax.set_xlim(scale)
     if not featscaled:
-        normPopLabels()
+        setLabels(ax, 'log(Population)', 'log(Pop): Normal Distribution')
     else:
-        featScaledLabels()
-    
-    n, bins, patches = plt.hist(histlist, color='lightgray', bins=bins)
-    
-    if name:
-        plt.savefig(name, dpi=200)
-    
-    plt.show()
+        setLabels(ax, 'Standard Deviations from Mean', 'log(Pop): Scaled, Mean-Normalized')
+    return saveFigure(fig, name)
+
+def histBlocks(counts, edges, title, name=None, xlabel='Color Value'):
+    '''
+    USAGE: Plot the histograms of all time blocks (rows of counts) as overlaid outlines.
+    '''
+    fig, ax = newFigure()
+    for row in counts:
+        ax.stairs(row, edges, color='gray', alpha=0.3)
+    ax.stairs(counts.sum(axis=0) / len(counts), edges, color='darkred')
+    setLabels(ax, xlabel, title)
+    return saveFigure(fig, name)
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main(argv=None):
+    import argparse, glob, os
+    parser = argparse.ArgumentParser(description='Population, tally, and color value histograms.')
+    parser.add_argument('--plot', action='store_true', help='also render histograms to Images/')
+    args = parser.parse_args(argv)
+
+    cd_df = getPopData()
+    poparray = np.array(list(pd.to_numeric(cd_df['POP'])))
+    logpop = np.log(poparray)
+    [mu, sigma] = getStats(logpop)
+    print('Population: log-normal mu = %f, sigma = %f' % (mu, sigma))
+
+    if args.plot:
+        histPop(poparray, scale = [0, 250000], bins = 2000, name = 'Images/HistogramPopulation.png')
+        histNorm(logpop, scale = [6,15], bins = 80, name = 'Images/HistogramLogPop.png')
+        scaled = (logpop - mu) / sigma
+        histNorm(scaled, featscaled='y', scale = [-3,3], bins = 80, name = 'Images/HistogramScaled')
 
+    for timetallyfile in sorted(glob.glob('Resources/Tally/*.json')):
+        codes, tally = loadTally(timetallyfile)
+        mu, sigma, count = logNormStats(tally, axis=0)
+        print('%s: %d blocks, log-normal mu = %.2f..%.2f, sigma = %.2f..%.2f' % (os.path.basename(timetallyfile),
+              tally.shape[1], np.nanmin(mu), np.nanmax(mu), np.nanmin(sigma), np.nanmax(sigma)))
 
-cd_df = getPopData()
-poparray = np.array(list(pd.to_numeric(cd_df['POP'])))
-logpop = np.log(poparray)
-    
-histPop(poparray, scale = [0, 250000], bins = 2000, name = 'Images/HistogramPopulation.png')
-histNorm(logpop, scale = [6,15], bins = 80, name = 'Images/HistogramLogPop.png')
+    for countycolorfile in sorted(glob.glob('Resources/Color/*.csv')):
+        qa = colorQA(countycolorfile)
+        print('%s: mu = %f, sigma = %f, min color = %f, max |stored - recomputed| = %.2e, in [-2, 2]: %.1f%%'
+              % (os.path.basename(countycolorfile), qa['mu'], qa['sigma'], qa['mincolor'], qa['maxdiff'],
+                 100 * np.nanmean(qa['inrange'])))
+        if args.plot:
+            name = 'Images/Histogram' + os.path.basename(countycolorfile).split('.')[0] + '.png'
+            histBlocks(qa['counts'], qa['edges'], 'Color Values per Time Block', name)
 
-[mu, sigma] = getStats(logpop)
-scaled = (logpop - mu) / sigma
-histNorm(scaled, featscaled='y', scale = [-3,3], bins = 80, name = 'Images/HistogramScaled')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
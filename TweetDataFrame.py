@@ -1,37 +1,53 @@
-print('Importing libraries...')
-
 import re                                  # for parsing through data files
 import os                                  # for checking to see if files already exist on disk
-import numpy as np                         # for numerical analysis
 import json                                # for JSON processing
-import pandas as pd                        # for dataframe processing
-import requests                            # for API interactions
+import tempfile                            # for temporary out-of-core tally files
 from datetime import datetime, timedelta   # for analysis of temporal data features
-from tqdm import tqdm                      # for monitoring progress of time-consuming for-loops
-
-print('Libraries imported.')
+from lazyImports import lazyModule         # for deferring heavy imports until they are needed
+import pathFeatures                        # for relating tweet locations to the path of totality
+import countyGeometry                      # for county geometry and the list of all counties
+import recordReader                        # for streaming JSON tweet records from capture files
+import tweetStore                          # for saving/loading the processed tweet dataframe
+import tweetIndex                          # for time/location/county queries over the tweet dataframe
+import countyRaster                        # for fast approximate location-to-county lookup
+import shadowDetect                        # for detecting anomalous county activity in tally data
+import tallyEngine                         # for vectorized tallying of tweets per county and time block
+import textClassify                        # for keyword classification of tweet text
+import tweetDedupe                         # for suppressing retweets and duplicate tweets
+import geocodeCache                        # for geocoding each unique location only once
+
+# Heavy libraries are only imported the first time they are used, so that importing this module
+# (e.g. in a worker process that only runs one stage) stays cheap. See lazyImports.py.
+np = lazyModule('numpy')                   # for numerical analysis
+pd = lazyModule('pandas')                  # for dataframe processing
+requests = lazyModule('requests')          # for API interactions
+tqdm = lazyModule('tqdm')                  # for monitoring progress of time-consuming for-loops
 
 class TweetDF():
     '''
     Tweet Dataframe class for creating and manipulating a pandas-dataframe of geo-tagged Twitter data.
     '''
     
-    df = pd.DataFrame([])                                   # Initialize empty dataframe for Twitter data
-    tallyframe = pd.DataFrame([])                           # Initialize empty dataframe for county tallies 
-    no_code = []                                            # Initialize List of tweet indices for which no county code could be found
     mincolor = 0                                            # Initialize minimum color value
-    county_tally = {}                                       # Initialize dictionary of tallies/county/time
     time_params = ''                                        # Initialize time parameter string for file-labeling
     
     state_file = 'Resources/state_table.csv'                # Location from where to retrieve state name/code info
     
     revgeofile = 'Resources/revgeodata.json'                # Location for storing reverse geocoding data
+    geocachefile = 'Resources/geocache.json'                # Location for storing reverse geocoding data per unique location
     timetallyroot = 'Resources/Tally/timetallydata.json'    # Location for storing list of arrays of tweet tallies
     countytallyfile = 'Resources/countytallydata.json'      # Location for storing list of tweet county codes
     censusdatafile = 'Resources/censusdata.json'            # Location for storing census data for each county
     countycolorroot = 'Resources/Color/countycolordata.csv' # Location for storing numerical tweet data per county
     topoJSONfile = 'Resources/USTopoJSON.json'              # Location for storing US TopoJSON data from d3js.org
     tweetGeoJSONfile = 'Resources/tweetGeoJSON.json'        # Location for storing GeoJSON encoding of tweet events
+    totalityfile = 'Resources/2017_08_21_NASAEclipsePath.txt'  # Location from where to retrieve NASA eclipse path data
+    countyarrivalfile = 'Resources/countyarrivaldata.csv'   # Location for storing local eclipse times per county
+    countyuniversefile = 'Resources/countyuniverse.json'    # Location for storing the fixed list of all county codes
+    processedfile = 'Resources/processedtweets.parquet'     # Location for storing the fully processed tweet dataframe
+    countyrasterfile = 'Resources/countyraster.npy'         # Location for storing the rasterized county index grid
+    countypeakroot = 'Resources/Shadow/countypeakdata.csv'  # Location for storing peak-activity times per county
+    shadowfrontroot = 'Resources/Shadow/shadowfrontdata.csv'   # Location for storing the Twitter shadow front per block
     
     def __init__(self, datafilepath):
         '''
@@ -40,24 +56,27 @@ class TweetDF():
         
         self.datafilepath = datafilepath                    # Location from where to retrieve JSON tweet data
         
+        self.df = pd.DataFrame([])                          # Initialize empty dataframe for Twitter data
+        self.tallyframe = pd.DataFrame([])                  # Initialize empty dataframe for county tallies 
+        self.no_code = []                                   # Initialize List of tweet indices for which no county code could be found
+        self.county_tally = {}                              # Initialize dictionary of tallies/county/time
+        self.tallymatrix = None                             # Initialize memory-mapped tally matrix (engine='memmap' only)
+        self.county_universe = []                           # Initialize fixed list of all county codes
+        self.index = None                                   # Initialize query index over the tweet dataframe
+        
     def tweetfile2df(self):
         '''
         USAGE: 
-        Creates a pandas dataframe of tweet data from a tweet data file
+        Creates a pandas dataframe of tweet data from a tweet data file. Records are decoded one at a
+        time from a sliding buffer (see recordReader.py), and corrupt records are skipped and counted.
         '''
         
         if self.df.empty:
             
-            tweet_list = []
-            
             print('Adding Twitter data to dataframe...')
-            with open(self.datafilepath, 'r') as f:
-                text = f.read()
-                
-            tweets = re.findall(r'({"USER".*?]]]})', text) # Creates a list of tweet data strings
-            
-            for tweet in tweets:
-                tweet_list.append(json.loads(tweet))       # Loads JSON from each tweet data string
+            stats = recordReader.RecordStats()
+            tweet_list = list(recordReader.iterRecords(self.datafilepath, stats=stats)) # Decodes each tweet record
+            print('Read "%s": %s.' % (self.datafilepath, stats))
             
             self.df = pd.DataFrame(tweet_list)
             self.df.rename(columns={'PLACE': 'Place', 'USER': 'User', 'TEXT': 'Text'}, inplace=True)
@@ -142,7 +161,7 @@ class TweetDF():
             self.stateNoState()
         
         # Careful: Twitter gives coordinates in [LON, LAT] (opposite the ISO 6709 convention!)
-        if not (('LON' and 'LAT') or ('listLATLON')) in self.df.keys():
+        if not ('listLATLON' in self.df.keys() or ('LON' in self.df.keys() and 'LAT' in self.df.keys())):
             
             coords = [(x[-1]) for x in self.df['Place'].tolist()]
             avgcoords = np.array([np.ndarray.flatten(np.mean(np.array(coords[idx]),1)) for idx in range(len(coords))])
@@ -166,7 +185,7 @@ class TweetDF():
         
         if 'listLATLON' not in self.df.keys():
             
-            if not ('LON' and 'LAT') in self.df.keys():
+            if not ('LON' in self.df.keys() and 'LAT' in self.df.keys()):
                 self.avgLONLAT()
             
             self.df['listLATLON'] = self.df[['LAT','LON']].values.tolist()
@@ -176,13 +195,21 @@ class TweetDF():
         else:
             print('No action: "[LAT, LON]" lists already in dataframe.')
        
-    def revGeocodePOST(self):
+    def revGeocodePOST(self, digits=4, maxsize=1000000):
         '''
         USAGE: 
         Retrieves political region info on coordinates using the "Coordinates to Politics" API from 
         datasciencetoolkit.org/coordinates2politics. Uses a series of POST requests (rather than GET 
         requests) to expedite the retrieval process, then saves the results in a JSON file. If the 
         file already exists, this method performs no action.
+        
+        Requests go through a geocode cache (see geocodeCache.py, saved to "geocachefile"), so each 
+        unique location (coordinates rounded to "digits" decimals) is only sent to the API once, 
+        across runs as well.
+        
+        ARGUMENTS:
+        digits - decimals kept when rounding coordinates into cache keys
+        maxsize - maximum number of locations kept in the cache
         '''
         # For some reason, if the length of my JSON list exceeds exactly 576, I receive the following error message:
         #  >>> JSONDecodeError: Expecting value: line 1 column 1 (char 0)
@@ -194,27 +221,22 @@ class TweetDF():
                 self.listLATLON()
             
             limit = 500
-            size = len(self.df['listLATLON'])
-            start = 0
-            response = []
+            url = 'http://www.datasciencetoolkit.org/coordinates2politics'
+            cache = geocodeCache.GeocodeCache(maxsize, digits, self.geocachefile)
+            
+            def geocoder(coords):
+                print("Processing %d locations..." % len(coords))
+                return requests.post(url, data=json.dumps(coords)).json()
 
             tic = datetime.now()
-
-            while start < size:
-                stop = start + limit
-                if stop >= size:
-                    stop = size    
-
-                coords = list(self.df['listLATLON'][start:stop])
-                coords_json = json.dumps(coords)
-                url = 'http://www.datasciencetoolkit.org/coordinates2politics'
-                print("Processing tweets %d - %d..." % (start, stop))
-                response += requests.post(url, data=coords_json).json()
-                start += limit
+            
+            response = cache.lookup(list(self.df['listLATLON']), geocoder, limit)
 
             print("Done! Data on %s coordinates were retrieved." % len(response))
+            print("Geocode cache: %s." % cache)
             toc = datetime.now()
             print("Total processing time: %s" % str(toc-tic))
+            cache.save()
             print("Now saving to file...")
 
             with open(self.revgeofile, 'w') as rf:
@@ -241,6 +263,69 @@ class TweetDF():
 
         print('Census data saved to "%s".' % self.censusdatafile)
     
+    def getCountyUniverse(self):
+        '''
+        USAGE:
+        Returns the fixed, sorted list of every county code accounted for by either the TopoJSON file 
+        or the US Census Bureau data. Every tally array uses this list as its row order. The list is 
+        built once (see countyGeometry.countyUniverse) and cached in "countyuniversefile".
+        
+        RETURNS:
+        county_universe - sorted list of 5-digit county code strings
+        '''
+        
+        if not self.county_universe:
+            if os.path.exists(self.countyuniversefile):
+                with open(self.countyuniversefile, 'r') as cuf:
+                    self.county_universe = json.load(cuf)
+            
+            else:
+                if not os.path.exists(self.censusdatafile):
+                    self.getCensusData()
+                if not os.path.exists(self.topoJSONfile):
+                    self.getTopoJSON()
+                
+                print('Building list of all county codes...')
+                self.county_universe = countyGeometry.countyUniverse(self.topoJSONfile, self.censusdatafile)
+                with open(self.countyuniversefile, 'w') as cuf:
+                    json.dump(self.county_universe, cuf)
+                print('List of all county codes saved to "%s".' % self.countyuniversefile)
+        
+        return self.county_universe
+    
+    def getCountyRaster(self, resolution=1.0):
+        '''
+        USAGE:
+        Returns the county raster (see countyRaster.py): a memory-mapped grid of county indices
+        for approximate location-to-county lookup and frame coloring by array indexing. The grid 
+        is rasterized from the TopoJSON file and cached in "countyrasterfile"; it is rebuilt when 
+        requested with another resolution or after the county universe changes.
+        
+        ARGUMENTS:
+        resolution - grid cells per TopoJSON pixel
+        
+        RETURNS:
+        raster - CountyRaster object, indexed by position in the county universe
+        '''
+        
+        if not os.path.exists(self.topoJSONfile):
+            self.getTopoJSON()
+        return countyRaster.loadRaster(self.countyrasterfile, self.topoJSONfile, self.getCountyUniverse(), resolution)
+    
+    def getTopoJSON(self):
+        '''
+        USAGE: GETs US county TopoJSON data from d3js.org and saves it to a file on disk.
+        '''
+        
+        topoJSONurl = 'https://d3js.org/us-10m.v1.json'
+        
+        print('Getting US TopoJSON data...')
+        topoJSONdata = requests.get(topoJSONurl).json()
+        with open(self.topoJSONfile, 'w') as tjf:
+            json.dump(topoJSONdata, tjf)
+        
+        print('TopoJSON file saved to disk from "%s".' % topoJSONurl)
+    
     def countyExtract(self):
         '''
         USAGE:
@@ -260,8 +345,10 @@ class TweetDF():
         County B normally has population of 70, County A receives 3/10 of a tally and County B receives 
         7/10 of a tally.
         
-        If the tweet location has only state-level precision, codes for every county in the state are 
-        retrieved from "state_file". If the tweet location has point-precision, this method extracts 
+        If the tweet location has only state-level precision, the tweet is given one tally under its 
+        2-digit state code; timeTally() spreads state tallies over every county in the state by 
+        population with a single sparse matrix product (see tallyEngine.py), instead of storing one 
+        entry per county for every such tweet. If the tweet location has point-precision, this method extracts 
         the corresponding county code from the revgeodata file when possible. If the county code is not 
         available, the value None is given. If multiple county codes are found in the "revgeodata" file 
         for a tweet (due to a nearness of the considered coordinate to a county border), all codes are 
@@ -293,6 +380,9 @@ class TweetDF():
                     RETURNS: codetallydict - dictionary of {"code": tally} pairs
                     '''
 
+                    if tuple(codes) in tallycache: # many tweets share the same codes
+                        return dict(tallycache[tuple(codes)])
+                    
                     codetallydict = {}
 
                     if codes and codes not in [[None],[]]:
@@ -308,7 +398,8 @@ class TweetDF():
                     else:
                         codetallydict = {None: 0}
 
-                    return codetallydict
+                    tallycache[tuple(codes)] = codetallydict
+                    return dict(codetallydict)
                 
                 ##### ---------------------------------- Control Flow ---------------------------------- #####
                 
@@ -332,6 +423,7 @@ class TweetDF():
                 del rgddf['location']
 
                 counties = []
+                tallycache = {} # {tuple of codes: codetallydict}, see calculateTallies()
                 printer = False # Set to True for feedback on the presence or absence of codes during extraction.
                 
                 if 'State' not in self.df.keys():
@@ -341,7 +433,7 @@ class TweetDF():
                 
                 print('Extracting county codes and calculating tally distributions...')
                 
-                for idx in tqdm(range(len(rgddf['politics']))):
+                for idx in tqdm.tqdm(range(len(rgddf['politics']))):
                     
                     timestamp = str(self.df['Datetime'][idx])
                     
@@ -354,12 +446,11 @@ class TweetDF():
                             if not codes:
                                 codes = [None]
 
-                        else:
-                            state_code = state[idx]
-                            fips = cd_df[cd_df['state'] == state_code]['fips']
-                            codes = list(fips)
+                            codetallydict = calculateTallies(codes)
+
+                        else: # one tally for the whole state, spread over its counties when tallying
+                            codetallydict = {state[idx]: 1}
 
-                        codetallydict = calculateTallies(codes)
                         counties.append({timestamp: codetallydict})
 
                     except:
@@ -379,7 +470,7 @@ class TweetDF():
             self.df['CountyCode'] = counties
             print('County codes and tally distributions added to tweet dataframe.')
 
-    def timeTally(self, increment, block_length, t0=False):
+    def timeTally(self, increment, block_length, t0=False, engine='sparse', category=None, keep_matrix=False):
         '''
         USAGE: 
         Create a dictionary and dataframe of tally counts per county such that tweets tallies
@@ -387,14 +478,32 @@ class TweetDF():
         increments forward in time. This generates a time-averaged movie of Twitter activity,
         where each frame of the movie represents tally data from a single time block.
         
+        By default, all blocks are tallied at once by the vectorized engine in tallyEngine.py.
+        The original block-by-block loop is kept as engine='loop' for reference and comparison.
+        
         ARGUMENTS:
         increment - length of time between consecutive time blocks (in minutes)
         block_length - length (>= dt) of time block (in minutes)
         t0 - optional: desired datetime-formatted start-time of initial time block
+        engine - "sparse" (vectorized, default), "loop" (original block-by-block tally), or
+            "memmap" (out-of-core: streams "countytallyfile" from disk in chunks and accumulates
+            the tallies in a memory-mapped file; see tallyEngine.tallyMemmap). The memmap engine 
+            neither loads the county tally records into the tweet dataframe nor builds 
+            "county_tally": the matrix is kept as "tallymatrix", and the "Tally" column of the 
+            tally dataframe holds its rows, which are only read from disk when used.
+        category - optional: only tally tweets of this text category (see classifyText); the 
+            category is added to the file labels
+        keep_matrix - memmap engine only: if True, the raw matrix file (float64 values, column-major)
+            is kept as a ".dat" file next to the tally file; otherwise it is a temporary file, 
+            removed as soon as the operating system allows (on Windows it is left in the temporary
+            directory while mapped)
+        
+        If the tweet dataframe has a "Weight" column (see dedupe) with any weight other than 1, each 
+        tweet's tallies are multiplied by its weight, and "_dedupe" is added to the file labels.
 
         RETURNS:
         county_tally - master tally dictionary containing {"CountyCode": 
-            np.array([Tally, ... , Tally])} pairs
+            np.array([Tally, ... , Tally])} pairs (empty for the memmap engine)
 
         '''
 
@@ -448,7 +557,10 @@ class TweetDF():
             for i in range(len(timeblock)):
                 codetallydict = timeblock.iloc[i].Codes
                 for code in codetallydict:
-                    if code != 'null':
+                    if code in state_counties: # state-level tally: spread over the state's counties
+                        for county, share in state_counties[code].items():
+                            block_tally[county] += codetallydict[code] * share
+                    elif code != 'null':
                         block_tally[code] += codetallydict[code]
 
             return block_tally
@@ -480,73 +592,159 @@ class TweetDF():
                 self.county_tally[c] = self.county_tally[c] + [block_tally[c]]
 
 
+        def memmapTally():
+            '''
+            USAGE:
+            Out-of-core tally: streams the tally records from "countytallyfile" into a memory-
+            mapped tally matrix, and writes the tally file from it county by county. Tweets outside 
+            the requested category get a tally weight of 0 (keeping the time blocks of all 
+            categories the same, as in the other engines).
+            
+            RETURNS:
+            cd_list - list of county codes (rows of the tally matrix)
+            tally - (counties x blocks) read-only np.memmap of tallies
+            '''
+            
+            if not os.path.exists(self.countytallyfile):
+                self.countyExtract()
+            cd_list = self.getCountyUniverse()
+            if not os.path.exists(self.censusdatafile):
+                self.getCensusData()
+            states, state_weights = tallyEngine.stateWeights(self.censusdatafile, cd_list)
+            
+            weights = self.df['Weight'].values if weighted else None
+            if category:
+                if 'Category' not in self.df.keys():
+                    self.classifyText()
+                mask = (self.df['Category'] == category).values
+                weights = mask if weights is None else weights * mask
+            
+            if keep_matrix:
+                tallyfile = os.path.splitext(filename)[0] + '.dat'
+            else:
+                fd, tallyfile = tempfile.mkstemp(prefix='timetally_', suffix='.dat')
+                os.close(fd)
+            print('Calculating block tallies out of core in "%s"...' % tallyfile)
+            records = tallyEngine.iterTallyRecords(self.countytallyfile)
+            tally = tallyEngine.tallyMemmap(records, cd_list, states, state_weights, increment, block_length, 
+                                            tallyfile, t0, weights)
+            print("Tallies in all %d time blocks calculated." % tally.shape[1])
+            
+            print("Writing tally data to file...")
+            tallyEngine.saveTally(filename, cd_list, tally)
+            print('Tally data written to "%s"' % filename)
+            
+            return cd_list, tally
+
         ##### ------------------------------ Control Flow ------------------------------ #####
 
         if not self.tallyframe.empty:
             print('No action: Tally dataframe already populated.')
             return
 
-        if 'CountyCode' not in self.df.keys():
-            self.countyExtract()
-        
         self.time_params = '_d%s_delta%s' % (str(increment), str(block_length))
+        if category:
+            self.time_params += '_' + textClassify.categoryLabel(category)
+        weighted = 'Weight' in self.df.keys() and bool((self.df['Weight'].values != 1).any())
+        if weighted:
+            self.time_params += '_dedupe'
         filename = self.timetallyroot.split('.')[0] + self.time_params + '.json'
         
         print('Loading tally data from "%s"...' % filename)
         if os.path.exists(filename): # just load tally data from file
             with open(filename, 'r') as f:
                 self.county_tally = json.load(f)
+        
+        elif engine == 'memmap': # calculate tally data out of core
+            cd_list, self.tallymatrix = memmapTally()
+            self.tallyframe = pd.DataFrame({'CountyCode': cd_list, 'Tally': list(self.tallymatrix)})
+            print('Tally dataframe created with "CountyCode" and "Tally" columns (rows of "%s").' % self.tallymatrix.filename)
+            if not keep_matrix:
+                try:
+                    os.remove(self.tallymatrix.filename)    # the mapping stays valid until it is closed
+                except OSError:
+                    pass
+            return
             
         else: # calculate tally data if there is not already a file
+            if 'CountyCode' not in self.df.keys():
+                self.countyExtract()
             
-            if not os.path.exists(self.censusdatafile):
-                self.getCensusData()
-
-            # Load census data to get county code list
-            with open(self.censusdatafile, 'r') as cdf:
-                censusdata = json.load(cdf)
-            cd_df = pd.DataFrame(censusdata[1:])
-            cd_df.columns = censusdata[0]
-            cd_df['fips'] = cd_df['state'] + cd_df['county']
-            cd_list = list(cd_df['fips'])
+            
+            # Get fixed county code list (row order of all tally arrays)
+            cd_list = self.getCountyUniverse()
 
             # Load all tally data
             with open(self.countytallyfile) as ccf:
                 codetallydata = json.load(ccf)
-
-            # Load tally data list into dataframe
-            k, v = [], []
-            for x in codetallydata:
-                key = list(x.keys())[0]
-                value = list(x.values())[0]
-                k.append(str2date(key))
-                v.append(value)
-            df = pd.DataFrame(np.array([k,v]).transpose(), columns = ['Datetime', 'Codes'])
-
-            # Initialize all county code tallies at []
-            self.county_tally = dict.fromkeys(cd_list,[])
-
-            # Format dt and deltaT as timedelta objects
-            dt = timedelta(0, increment*60)
-            deltaT = timedelta(0, block_length*60)
-
-            # Get start-time
-            if t0 == False:
-                t = df['Datetime'][0]
-            else:
-                t = t0
             
-            print("Calculating block tallies...")
-            block_num = 0
-            while t + deltaT < df.Datetime.iloc[-1] or block_num < 1:
-                print(t)
-                timeblock = getBlock(t)
-                block_tally = blockTally(timeblock)
-                blockCombine(block_tally)
-                t += dt
-                block_num += 1
-
-            print("Tallies in all time blocks calculated.")
+            # Empty the tallies of tweets outside the requested category (tally records are in tweet 
+            # dataframe order), keeping their times so all categories share the same time blocks
+            if category:
+                if 'Category' not in self.df.keys():
+                    self.classifyText()
+                if len(codetallydata) != len(self.df):
+                    raise ValueError('"%s" does not match the tweet dataframe.' % self.countytallyfile)
+                codetallydata = [x if c == category else dict.fromkeys(x, {}) 
+                                 for x, c in zip(codetallydata, self.df['Category'])]
+            
+            # Tally weights of repeated tweets (see dedupe)
+            weights = None
+            if weighted:
+                if len(codetallydata) != len(self.df):
+                    raise ValueError('"%s" does not match the tweet dataframe.' % self.countytallyfile)
+                weights = self.df['Weight'].values
+            
+            # Population weights for spreading state-level tallies over counties
+            if not os.path.exists(self.censusdatafile):
+                self.getCensusData()
+            states, state_weights = tallyEngine.stateWeights(self.censusdatafile, cd_list)
+            
+            if engine != 'loop':
+                print("Calculating block tallies...")
+                tally = tallyEngine.tallyMatrix(codetallydata, cd_list, states, state_weights, increment, block_length, t0, weights)
+                self.county_tally = dict(zip(cd_list, tally.tolist()))
+                print("Tallies in all %d time blocks calculated." % tally.shape[1])
+            
+            else:
+                state_counties = tallyEngine.stateCounties(states, state_weights, cd_list)
+                if weights is not None:
+                    codetallydata = [{stamp: {code: share * w for code, share in codetallydict.items()} 
+                                      for stamp, codetallydict in x.items()} for x, w in zip(codetallydata, weights)]
+                
+                # Load tally data list into dataframe
+                k, v = [], []
+                for x in codetallydata:
+                    key = list(x.keys())[0]
+                    value = list(x.values())[0]
+                    k.append(str2date(key))
+                    v.append(value)
+                df = pd.DataFrame(np.array([k,v]).transpose(), columns = ['Datetime', 'Codes'])
+
+                # Initialize all county code tallies at []
+                self.county_tally = dict.fromkeys(cd_list,[])
+
+                # Format dt and deltaT as timedelta objects
+                dt = timedelta(0, increment*60)
+                deltaT = timedelta(0, block_length*60)
+
+                # Get start-time
+                if t0 == False:
+                    t = df['Datetime'][0]
+                else:
+                    t = t0
+                
+                print("Calculating block tallies...")
+                block_num = 0
+                while t + deltaT < df.Datetime.iloc[-1] or block_num < 1:
+                    print(t)
+                    timeblock = getBlock(t)
+                    block_tally = blockTally(timeblock)
+                    blockCombine(block_tally)
+                    t += dt
+                    block_num += 1
+
+                print("Tallies in all time blocks calculated.")
 
             print("Writing tally data to file...")
             with open(filename, 'w') as f:
@@ -618,6 +816,125 @@ class TweetDF():
         
         mergeCountyPop()
         
+    def getCountyArrival(self):
+        '''
+        USAGE:
+        Adds local eclipse circumstances for each county to the tally dataframe: "Obscuration" (the
+        approximate maximum fraction of the Sun covered), "MaxEclipse" (the UTC time of maximum 
+        eclipse), and "PathDistance" (km from the county centroid to the central line of totality).
+        
+        The county table is computed once from the county geometries in "topoJSONfile" and the 
+        interpolated path of totality in "totalityfile" (see pathFeatures.countyArrival), then 
+        cached in "countyarrivalfile"; later runs just load and join it. The table covers the whole
+        county universe, so counties without geometry (those of Puerto Rico) get explicit NaN/NaT 
+        values rather than being left out.
+        '''
+        
+        if 'MaxEclipse' in self.tallyframe.keys():
+            print('No action: County eclipse times already added to tally dataframe.')
+            return
+        
+        if os.path.exists(self.countyarrivalfile):
+            print('Loading county eclipse times from "%s"...' % self.countyarrivalfile)
+            arrival = pd.read_csv(self.countyarrivalfile, dtype={'CountyCode': str}, parse_dates=['MaxEclipse'])
+            arrival = pathFeatures.arrivalUniverse(arrival, self.getCountyUniverse())
+        
+        else:
+            print('Calculating county eclipse times...')
+            arrival = pathFeatures.countyArrival(self.topoJSONfile, self.totalityfile, self.getCountyUniverse())
+            arrival.to_csv(self.countyarrivalfile, index=False)
+            print('County eclipse times saved to "%s".' % self.countyarrivalfile)
+        
+        if self.tallyframe.empty:
+            self.timeTally(0.5, 60)
+        
+        arrival = arrival[['CountyCode', 'Obscuration', 'MaxEclipse', 'PathDistance']]
+        self.tallyframe = pd.merge(self.tallyframe, arrival, how='left', on=['CountyCode'])
+        print('County eclipse times added to tally dataframe.')
+    
+    def arrivalLag(self, t0, increment, block_length):
+        '''
+        USAGE:
+        Calculates, for every county and time block at once, how long after the local maximum 
+        eclipse each time block is centered (negative: the block is centered before the eclipse).
+        
+        ARGUMENTS:
+        t0 - datetime-formatted start-time of the initial time block (as in timeTally)
+        increment - length of time between consecutive time blocks (in minutes)
+        block_length - length of time block (in minutes)
+        
+        RETURNS:
+        lag - (counties x blocks) array of lags (in minutes), in tally dataframe row order (NaN for 
+            counties without an eclipse time)
+        '''
+        
+        if 'MaxEclipse' not in self.tallyframe.keys():
+            self.getCountyArrival()
+        
+        blocks = len(self.tallyframe['Tally'].dropna().iloc[0])
+        centers = np.datetime64(t0, 'ms') + ((np.arange(blocks) * increment + block_length / 2) * 60000).astype('timedelta64[ms]')
+        maxeclipse = pd.to_datetime(self.tallyframe['MaxEclipse']).values.astype('datetime64[ms]')
+        lag = (centers[None, :] - maxeclipse[:, None]).astype('float64') / 60000
+        lag[np.isnat(maxeclipse)] = np.nan  # NaT casts to a huge negative number, not NaN
+        return lag
+    
+    def detectShadow(self, t0, increment, block_length, window=3, threshold=3, mintally=10):
+        '''
+        USAGE:
+        Looks for the "Twitter shadow" in the tally data (see shadowDetect.py). Each county's share 
+        of the tweets in every time block is compared to that county's own baseline with rolling 
+        z-scores; the block where a county's z-score peaks gives its peak-activity time, and the 
+        anomalous counties of each block trace the shadow front. Results are saved to 
+        "countypeakroot" and "shadowfrontroot" (labeled with the tally time parameters).
+        
+        ARGUMENTS:
+        t0 - datetime-formatted start-time of the initial time block (as in timeTally)
+        increment - length of time between consecutive time blocks (in minutes)
+        block_length - length of time block (in minutes)
+        window - number of blocks in the rolling window
+        threshold - z-score above which a county counts as anomalous
+        mintally - minimum total tally for a county's peak to count as detected
+        
+        RETURNS:
+        peaks - dataframe of "CountyCode", "PeakBlock", "PeakZ", "Total", "Detected", "PeakTime", 
+            and "PeakLag" (minutes from local maximum eclipse to peak activity)
+        front - dataframe of "Block", "Time" (center of block), "Anomalous", "LON", "LAT", 
+            "Peaking", "PeakLON", and "PeakLAT" (see shadowDetect.shadowFront)
+        '''
+        
+        if self.tallyframe.empty:
+            self.timeTally(increment, block_length, t0)
+        if 'MaxEclipse' not in self.tallyframe.keys():
+            self.getCountyArrival()
+        
+        print('Detecting anomalous Twitter activity...')
+        arrival = pd.read_csv(self.countyarrivalfile, dtype={'CountyCode': str}).set_index('CountyCode')
+        coords = arrival.reindex(self.tallyframe['CountyCode'])
+        tally = np.array(list(self.tallyframe['Tally']), dtype=float)
+        peaks, front = shadowDetect.detect(tally, coords['LON'].values, coords['LAT'].values, window, None, threshold, mintally)
+        
+        def blockTime(block):
+            minutes = block * increment + block_length / 2
+            return np.datetime64(t0, 'ms') + np.rint(minutes * 60000).astype('int64').astype('timedelta64[ms]')
+        
+        peaks.insert(0, 'CountyCode', self.tallyframe['CountyCode'].values)
+        peaks['PeakTime'] = blockTime(peaks['PeakBlock'].values)
+        maxeclipse = pd.to_datetime(self.tallyframe['MaxEclipse']).values.astype('datetime64[ms]')
+        peaks['PeakLag'] = (peaks['PeakTime'].values.astype('datetime64[ms]') - maxeclipse).astype('float64') / 60000
+        peaks.loc[np.isnat(maxeclipse), 'PeakLag'] = np.nan   # NaT casts to a huge negative number, not NaN
+        front.insert(1, 'Time', blockTime(front['Block'].values.astype(float)))
+        
+        print('%d counties with a detected activity peak (z-score >= %g).' % (peaks['Detected'].sum(), threshold))
+        
+        countypeakfile = self.countypeakroot.split('.')[0] + self.time_params + '.csv'
+        shadowfrontfile = self.shadowfrontroot.split('.')[0] + self.time_params + '.csv'
+        os.makedirs(os.path.dirname(countypeakfile), exist_ok=True)
+        peaks.to_csv(countypeakfile, index=False)
+        front.to_csv(shadowfrontfile, index=False)
+        print('County peak times saved to "%s"; shadow front saved to "%s".' % (countypeakfile, shadowfrontfile))
+        
+        return peaks, front
+    
     def tally2value(self):
         '''
         USAGE: 
@@ -693,7 +1010,7 @@ class TweetDF():
                             v_array[i][j] = minimum
                 values = []        
                 for i in range(shape[0]):
-                    values.append(list(v_array[i]))
+                    values.append(v_array[i].tolist())
                 
                 return values, minimum
             
@@ -701,65 +1018,41 @@ class TweetDF():
             values, self.mincolor = normScale(value_array)
             self.tallyframe['Value'] = values
         
-        def getTopoJSONCounties():
-            '''
-            USAGE: 
-            Creates a set of all county IDs accounted for by a TopoJSON file. This set will 
-            be used to populate the tally dataframe with any counties accounted for by the 
-            TopoJSON file which are not already present in the tally dataframe.
-
-            RETURNS:
-            countyids - set of all county IDs in topoJSONfile
-            '''
-            
-            topoJSONurl = 'https://d3js.org/us-10m.v1.json'
-            topoJSONfile = self.topoJSONfile
-
-            if not os.path.exists(topoJSONfile):
-                print('Getting US TopoJSON data...')
-                topoJSONdata = requests.get(topoJSONurl).json()
-                with open(topoJSONfile, 'w') as tjf:
-                    json.dump(topoJSONdata, tjf)
-
-                print('TopoJSON file saved to disk from "%s".' % topoJSONurl)
-            
-            print('Loading TopoJSON data from "%s"...' % topoJSONfile)
-            with open(topoJSONfile) as tjf:
-                topojson = json.load(tjf)
-
-            tj_df = pd.DataFrame(topojson['objects']['counties']['geometries'])
-            countyids = set(tj_df['id'])
-            print('Full set of county codes obtained from "%s".' % topoJSONfile)
-            return countyids
-        
         def fillTallyframe():
             '''
             USAGE:
-            Fills tally dataframe with any missing counties which are encoded for by the TopoJSON 
-            file but not listed by the US Census Bureau. Assigns tally value of [0, ... , 0], 
-            population value of None, and the minimum color value (multiples by an np array of 
-            ones) to each such county. 
+            Puts the tally dataframe into the fixed county order of getCountyUniverse(), filling any
+            counties which are encoded for by the TopoJSON file but not listed by the US Census 
+            Bureau (or which have no tallies) in one vectorized step. Each such county gets a tally 
+            value of [0, ... , 0], population value of None, and the minimum color value (multiplied 
+            by an np array of ones).
             '''
             
-            countyTopoCodes = getTopoCounties()
-            countyCensusCodes = set(list(self.tallyframe['CountyCode']))
-            blocks = len(self.tallyframe.Tally[0])
-            
-            if countyTopoCodes != countyCensusCodes:
-                diff = countyTopoCodes.difference(countyCensusCodes)
-                for code in list(diff):
-                    idx = len(self.tallyframe)
-                    # Remember: ['CountyCode', 'Tally', 'Population', 'Geoname', 'Value']
-                    self.tallyframe.loc[idx] = [code, np.zeros(blocks), None, None, 
-                                                self.mincolor * np.ones(blocks)]
+            universe = self.getCountyUniverse()
+            tf = self.tallyframe.drop_duplicates('CountyCode').set_index('CountyCode').reindex(universe)
+            present = tf['Tally'].notna().values
+            blocks = len(tf['Tally'][present].iloc[0])
+            
+            if not present.all():
+                tally = np.zeros((len(universe), blocks))
+                value = self.mincolor * np.ones((len(universe), blocks))
+                tally[present] = np.array(list(tf['Tally'][present]), dtype=float)
+                value[present] = np.array(list(tf['Value'][present]), dtype=float)
+                tf['Tally'] = tally.tolist()
+                tf['Value'] = value.tolist()
+                print('%d missing counties added to tally dataframe.' % (~present).sum())
+            
+            self.tallyframe = tf.reset_index()
                             
         ##### ------------------------------ Control Flow ------------------------------ ##### 
         
         print('Converting tally counts to color values...')
         processValues()
-        getTopoJSONCounties()
+        fillTallyframe()
         countycolorfile = self.countycolorroot.split('.')[0] + self.time_params + '.csv'
-        self.tallyframe.to_csv(countycolorfile, index=False)
+        # Rows of a memory-mapped tally matrix (see timeTally) are read and written one county at a time
+        tallies = [t.tolist() if isinstance(t, np.ndarray) else t for t in self.tallyframe['Tally']]
+        self.tallyframe.assign(Tally=tallies).to_csv(countycolorfile, index=False)
         print('County color data saved to "%s".' % countycolorfile)
     
     def df2GeoJSON(self):
@@ -787,7 +1080,7 @@ class TweetDF():
             df = df.reset_index(drop=True)
             
             # Note: GeoJSON encodes coordinates in [LON, LAT] like Twitter, not [LAT, LON]!
-            for idx in tqdm(range(len(df))):
+            for idx in tqdm.tqdm(range(len(df))):
                 item = {
                     "type": "Feature",
                     "geometry": {
@@ -811,12 +1104,175 @@ class TweetDF():
 
             print('Tweet GeoJSON data saved to "%s".' % self.tweetGeoJSONfile)
                         
-    def analyze(self):
+    def addPathFeatures(self, cell=0.5):
+        '''
+        USAGE:
+        Relates every tweet to the path of totality described by "totalityfile", adding the columns
+        "PathDistance" (km from the tweet location to the central line), "InTotality" (whether the 
+        tweet location is inside the region of totality), "TotalityTime" (UTC time at which the 
+        shadow axis passed closest to the tweet location), and "TotalityOffset" (seconds from local 
+        totality to the tweet; negative if the tweet was sent before totality) to the tweet dataframe.
+        
+        All tweets are processed at once against a precomputed spatial index of the central line
+        (see pathFeatures.py). Tweets with only state-level precision are located at the center of 
+        their state, so their features are left empty (NaN, NaT, and False).
+        
+        ARGUMENTS:
+        cell - size (degrees) of the grid cells of the central line index (see pathFeatures.PathIndex)
+        '''
+        
+        if 'PathDistance' in self.df.keys():
+            print('No action: Path of totality features already in dataframe.')
+            return
+        
+        if 'Datetime' not in self.df.keys():
+            self.mkDatetime()
+        if not ('listLATLON' in self.df.keys() or ('LON' in self.df.keys() and 'LAT' in self.df.keys())):
+            self.avgLONLAT()
+        
+        print('Calculating tweet distances and time offsets from the path of totality...')
+        if 'listLATLON' in self.df.keys():
+            latlon = np.array(list(self.df['listLATLON']), dtype=float).reshape(-1, 2)
+            lat, lon = latlon[:,0], latlon[:,1]
+        else:
+            lon, lat = self.df['LON'].values, self.df['LAT'].values
+        
+        index = pathFeatures.PathIndex(self.totalityfile, cell=cell)
+        features = index.features(lon, lat, pd.to_datetime(self.df['Datetime']).values)
+        
+        point = (self.df['State'] == False).values if 'State' in self.df.keys() else np.ones(len(lon), bool)
+        self.df['PathDistance'] = np.where(point, features['PathDistance'], np.nan)
+        self.df['InTotality'] = point & features['InTotality']
+        self.df['TotalityTime'] = np.where(point, features['TotalityTime'], np.datetime64('NaT'))
+        self.df['TotalityOffset'] = np.where(point, features['TotalityOffset'], np.nan)
+        print('Path of totality features added to tweet dataframe.')
+                        
+    def classifyText(self):
+        '''
+        USAGE:
+        Sorts tweets into categories by keywords in their text (see textClassify.py), e.g. "totality", 
+        "partial", "glasses/weather", or "other", and adds them to the tweet dataframe as the column 
+        "Category". timeTally() can then tally a single category.
+        '''
+        
+        if 'Category' in self.df.keys():
+            print('No action: Text categories already in dataframe.')
+            return
+        
+        print('Classifying tweet text...')
+        self.df['Category'] = textClassify.classify(self.df['Text'])
+        counts = self.df['Category'].value_counts()
+        print('Text categories added to tweet dataframe (%s).' % ', '.join('%s: %d' % x for x in counts.items()))
+    
+    def dedupe(self, mode='weight', bucket_minutes=10):
+        '''
+        USAGE:
+        Finds retweets of earlier tweets (by any user) and near-duplicate tweets posted by the same 
+        user within one or two time buckets of each other (see tweetDedupe.py), and adds a tally weight for every tweet to the 
+        tweet dataframe as the column "Weight", which timeTally() applies. Rows are never removed, 
+        so the dataframe stays aligned with "revgeofile" and "countytallyfile".
+        
+        ARGUMENTS:
+        mode - "drop" (repeats get weight 0) or "weight" (the k-th repeat gets weight 1/(k+1))
+        bucket_minutes - length of the time buckets (in minutes)
+        '''
+        
+        if 'Weight' in self.df.keys():
+            print('No action: Tweet weights already in dataframe.')
+            return
+        
+        if 'Datetime' not in self.df.keys():
+            self.mkDatetime()
+        
+        print('Finding repeated tweets...')
+        self.df['Weight'], dedupe = tweetDedupe.dedupeFrame(self.df, mode, bucket_minutes)
+        print('Tweet weights added to tweet dataframe (%s).' % dedupe)
+    
+    def saveProcessed(self):
+        '''
+        USAGE:
+        Saves the processed tweet dataframe to the columnar file "processedfile" (see tweetStore.py),
+        so later runs over the same raw capture (datafilepath) can reload it with loadProcessed()
+        instead of rebuilding it.
+        '''
+        
+        print('Saving processed tweet dataframe to "%s"...' % self.processedfile)
+        tweetStore.saveFrame(self.df, self.processedfile, source=self.datafilepath)
+        print('Processed tweet dataframe saved to "%s".' % self.processedfile)
+    
+    def loadProcessed(self, columns=None, start=None, end=None):
+        '''
+        USAGE:
+        Loads the processed tweet dataframe from "processedfile". Only the requested columns are read,
+        and only the row groups which may hold tweets inside the requested time range are decoded.
+        
+        ARGUMENTS:
+        columns - optional: list of columns to load (default: all)
+        start - optional: datetime-formatted start of time range (inclusive)
+        end - optional: datetime-formatted end of time range (exclusive)
+        '''
+        
+        print('Loading processed tweet dataframe from "%s"...' % self.processedfile)
+        self.df = tweetStore.loadFrame(self.processedfile, columns, start, end)
+        print('Processed tweet dataframe loaded (%d tweets, columns: %s).' % (len(self.df), ', '.join(self.df.keys())))
+    
+    def buildIndex(self, cell=0.5):
+        '''
+        USAGE:
+        Builds the query index (see tweetIndex.py) over the current tweet dataframe: a sorted time
+        index, a uniform LON/LAT grid of cell size "cell" (degrees), and, on first use, a county index.
+        '''
+        
+        if 'Datetime' not in self.df.keys():
+            self.mkDatetime()
+        if not ('listLATLON' in self.df.keys() or ('LON' in self.df.keys() and 'LAT' in self.df.keys())):
+            self.avgLONLAT()
+        
+        print('Building query index over tweet dataframe...')
+        self.index = tweetIndex.TweetIndex(self.df, cell)
+        print('Query index built (%d tweets, %d x %d grid cells).' % ((len(self.df),) + self.index.shape))
+    
+    def query(self, start=None, end=None, bbox=None, county=None, chunk=10000):
+        '''
+        USAGE:
+        Iterates over the tweets sent between "start" and "end" inside a bounding box and/or county,
+        in time order, without scanning the whole dataframe. The index is (re)built when needed.
+        
+        ARGUMENTS:
+        start - optional: datetime-formatted start of time range (inclusive)
+        end - optional: datetime-formatted end of time range (exclusive)
+        bbox - optional: (west, south, east, north) bounding box (degrees)
+        county - optional: 5-digit county code string, or list of codes (uses the "CountyCode" column)
+        chunk - maximum number of tweets per yielded dataframe slice
+        
+        RETURNS:
+        generator of dataframe slices of self.df
+        
+        EXAMPLE:
+        for tweets in tweetdf.query('2017-08-21 17:00', '2017-08-21 18:00', bbox=(-125, 42, -116, 46)):
+            ...
+        '''
+        
+        if self.index is None or self.index.df is not self.df:
+            self.buildIndex()
+        return self.index.query(start, end, bbox, county, chunk)
+    
+    def analyze(self, dedupe=False):
         '''
         USAGE:
         This method fully processes and analyzes the TweetDF object.
+        
+        ARGUMENTS:
+        dedupe - if True, tallies of retweets and repeated tweets are weighted down (see dedupe), and
+            the tally and color files get the "_dedupe" label
         '''
         
+        processed = os.path.exists(self.processedfile) and tweetStore.frameInfo(self.processedfile)['source'] == self.datafilepath
+        if self.df.empty and processed:
+            self.loadProcessed()   # reloads self.df as saved by a previous run over datafilepath, skipping the stages below
+            if not dedupe and 'Weight' in self.df.keys():
+                self.df = self.df.drop(columns='Weight')
+        
         self.tweetfile2df()     # generates tweet dataframe "self.df" from data in datafilepath
         self.mkDatetime()       # changes "CREATED AT" info into datetime-formatted info and places in "Datetime" column
         self.stateNoState()     # determines whether a tweet only has state-level location precision
@@ -824,6 +1280,12 @@ class TweetDF():
         self.listLATLON()       # generates [LAT, LON] pairs and adds the pair lists to self.df 
         self.revGeocodePOST()   # submits POST requests to retrieve politics data on coordinates in self.df
         self.countyExtract()    # adds county codes and tally distributions to self.df
+        self.addPathFeatures()  # adds distance and time offset from the path of totality to self.df
+        self.classifyText()     # adds keyword category of tweet text to self.df
+        if dedupe:
+            self.dedupe()       # adds tally weights suppressing retweets and duplicate tweets to self.df
+        if not processed:
+            self.saveProcessed()    # saves processed self.df for later runs
         
         self.timeTally(0.5, 60) # tallies up time series of tweets/county; adds "CountyCode" and "Tally" to self.tallyframe
         self.getCountyPop()     # gets county population info from US Census Bureau and adds it to self.df
@@ -834,10 +1296,21 @@ class TweetDF():
         
 ##### -------------------------------------------- MAIN -------------------------------------------- ##### 
 
-def main():
-    datafilepath = "Twitter Data/eclipsefile1.json" 
-    tweets = TweetDF(datafilepath)  # initialize TweetDF object as "tweets"
-    tweets.analyze()
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Process a file of geo-tagged eclipse tweets.')
+    parser.add_argument('datafilepath', nargs='?', default="Twitter Data/eclipsefile1.json")
+    parser.add_argument('--stage', action='append', dest='stages', metavar='METHOD',
+                        help='run only the named TweetDF method (repeatable; default: full analysis)')
+    parser.add_argument('--dedupe', action='store_true', help='weight down retweets and repeated tweets in the full analysis')
+    args = parser.parse_args(argv)
+    
+    tweets = TweetDF(args.datafilepath)  # initialize TweetDF object as "tweets"
+    if args.stages:
+        for stage in args.stages:
+            getattr(tweets, stage)()
+    else:
+        tweets.analyze(args.dedupe)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
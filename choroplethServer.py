@@ -0,0 +1,367 @@
+'''
+Local HTTP server for the choropleth pages. Instead of whole static files, it serves the county
+color data of Resources/Color/*.csv (see TweetDF.tally2value) one time block, one block range, or
+one county at a time, together with the static Resources files the pages draw (TopoJSON,
+GeoJSON). Nothing is fetched from the network, so the server and the pages also work offline.
+
+Endpoints (all GET or HEAD):
+    /colors                                 names of the color files (e.g. "d10_delta60")
+    /colors/<name>                          county codes, populations, county names, and time block parameters
+    /colors/<name>/frames/<block>           one time block: one entry per county, in the order of /colors/<name>
+    /colors/<name>/frames/<first>-<last>    time blocks first..last (inclusive): one row per block
+    /colors/<name>/counties/<code>          one county's time series
+    /resources/<file>                       a static file from the resource directory
+
+Frame and county requests take "?field=Value" (default) or "?field=Tally", and "?format=json"
+(default) or "?format=bin". The binary format is a raw little-endian float32 array, with its shape
+in the "X-Array-Shape" header. Responses carry ETag, Last-Modified, and Cache-Control headers.
+Conditional requests are answered with 304, and responses are gzipped when the client accepts it.
+
+    python choroplethServer.py --port 8000
+    curl --compressed http://localhost:8000/colors/d10_delta60/frames/12
+'''
+
+import os
+import re
+import json
+import gzip
+import glob
+import hashlib
+import threading
+import functools
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from lazyImports import lazyModule
+import HistogramAnalysis
+import frameRenderer
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+
+COLOR_PREFIX = 'countycolordata_'   # file name prefix of color files (the rest of the name, minus ".csv", is the color name)
+FIELDS = ('Value', 'Tally')         # color file columns which can be served
+DIGITS = 6                          # decimals kept in JSON numbers
+MAX_AGE = 3600                      # Cache-Control max-age (s); clients revalidate with the ETag after that
+MIN_GZIP = 512                      # smallest response (bytes) worth compressing
+CONTENT_TYPES = {'.json': 'application/json', '.csv': 'text/csv', '.txt': 'text/plain',
+                 '.html': 'text/html', '.png': 'image/png', '.gif': 'image/gif', '.pdf': 'application/pdf'}
+COMPRESSIBLE = ('application/json', 'application/octet-stream', 'text/csv', 'text/plain', 'text/html')
+
+class RequestError(Exception):
+    '''
+    A request which cannot be answered, with its HTTP status code.
+    '''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def jsonArray(a):
+    '''
+    USAGE: Converts an array to nested lists for JSON, rounded to DIGITS decimals, with NaN as null.
+    '''
+
+    a = np.round(np.asarray(a, dtype=float), DIGITS)
+    if np.isfinite(a).all():
+        return a.tolist()
+    return np.where(np.isfinite(a), a, None).tolist()
+
+def jsonBody(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+@functools.lru_cache(maxsize=128)
+def compress(body):
+    '''
+    USAGE: Gzips a response body (recently compressed bodies are cached, since the pages request the same frames repeatedly).
+    '''
+
+    return gzip.compress(body, 6)
+
+class ColorData():
+    '''
+    One color file loaded into arrays (see HistogramAnalysis.loadColor).
+    '''
+
+    def __init__(self, countycolorfile):
+        '''
+        Initialize ColorData object.
+
+        ARGUMENTS:
+        countycolorfile - color file written by TweetDF.tally2value()
+        '''
+
+        self.countycolorfile = countycolorfile                  # Location of the color file
+        self.mtime = os.stat(countycolorfile).st_mtime          # Modification time of the loaded file
+        self.codes, self.tally, self.value, self.pop = HistogramAnalysis.loadColor(countycolorfile)
+        self.row = {code: i for i, code in enumerate(self.codes)}   # Row of each county code
+        self.geonames = list(pd.read_csv(countycolorfile, usecols=['Geoname'], encoding='latin-1')['Geoname'].fillna(''))  # County names
+        self.params = frameRenderer.timeParams(countycolorfile)     # (increment, block_length) or None
+
+    def frames(self):
+        '''
+        USAGE: Returns the number of time blocks.
+        '''
+
+        return self.value.shape[1]
+
+    def field(self, name):
+        '''
+        USAGE: Returns the (counties x blocks) array of a color file column ("Value" or "Tally").
+        '''
+
+        if name not in FIELDS:
+            raise RequestError(400, 'Unknown field "%s" (use %s).' % (name, ' or '.join(FIELDS)))
+        return self.value if name == 'Value' else self.tally
+
+class ChoroplethStore():
+    '''
+    Answers the server's requests from the color files and the resource directory.
+    '''
+
+    def __init__(self, colordir='Resources/Color', resourcedir='Resources'):
+        '''
+        Initialize ChoroplethStore object.
+
+        ARGUMENTS:
+        colordir - directory of the color files written by TweetDF.tally2value()
+        resourcedir - directory of the static files served under /resources/
+        '''
+
+        self.colordir = colordir                            # Directory of color files
+        self.resourcedir = os.path.realpath(resourcedir)    # Directory of static files
+        self.colors = {}                                    # {color name: ColorData}, loaded on first request
+        self.lock = threading.Lock()                        # Guards self.colors between request threads
+
+    def colorNames(self):
+        '''
+        USAGE: Lists the names of the available color files.
+        '''
+
+        files = glob.glob(os.path.join(self.colordir, COLOR_PREFIX + '*.csv'))
+        return sorted(os.path.basename(f)[len(COLOR_PREFIX):-len('.csv')] for f in files)
+
+    def colorData(self, name):
+        '''
+        USAGE: Returns the loaded color file of a color name, (re)loading it if it is new or changed on disk.
+        '''
+
+        countycolorfile = os.path.join(self.colordir, COLOR_PREFIX + name + '.csv')
+        if not re.fullmatch(r'[\w.-]+', name) or not os.path.isfile(countycolorfile):
+            raise RequestError(404, 'No color file "%s" (available: %s).' % (name, ', '.join(self.colorNames())))
+
+        with self.lock:
+            data = self.colors.get(name)
+            if data is None or data.mtime != os.stat(countycolorfile).st_mtime:
+                data = self.colors[name] = ColorData(countycolorfile)
+        return data
+
+    def request(self, path, query):
+        '''
+        USAGE:
+        Answers one request (see module docstring for the endpoints).
+
+        ARGUMENTS:
+        path - URL path, unquoted
+        query - {parameter: value} of the URL query
+
+        RETURNS:
+        body - response body (bytes)
+        ctype - content type
+        mtime - modification time of the underlying file (None for listings)
+        headers - {header: value} of additional headers
+        '''
+
+        parts = [p for p in path.split('/') if p]
+        if parts[:1] == ['resources'] and len(parts) > 1:
+            return self.resource('/'.join(parts[1:]))
+        if parts == ['colors']:
+            return jsonBody(self.colorNames()), 'application/json', None, {}
+        if parts[:1] != ['colors'] or len(parts) not in (2, 4):
+            raise RequestError(404, 'Unknown path "%s".' % path)
+
+        data = self.colorData(parts[1])
+        if len(parts) == 2:
+            meta = {'name': parts[1], 'frames': data.frames(), 'CountyCode': data.codes,
+                    'Population': jsonArray(data.pop), 'Geoname': data.geonames, 'increment': None, 'block_length': None}
+            if data.params:
+                meta['increment'], meta['block_length'] = data.params
+            return jsonBody(meta), 'application/json', data.mtime, {}
+
+        fieldname = query.get('field', 'Value')
+        field = data.field(fieldname)
+        if parts[2] == 'frames':
+            first, last = self.blockRange(parts[3], data.frames())
+            array = field[:, first:last + 1].T if '-' in parts[3] else field[:, first]
+            payload = {'first': first, 'last': last, 'field': fieldname}
+        elif parts[2] == 'counties':
+            if parts[3] not in data.row:
+                raise RequestError(404, 'No county "%s" in "%s".' % (parts[3], parts[1]))
+            array = field[data.row[parts[3]]]
+            payload = {'CountyCode': parts[3], 'Population': jsonArray(data.pop[data.row[parts[3]]]), 'field': fieldname}
+        else:
+            raise RequestError(404, 'Unknown path "%s".' % path)
+
+        body, ctype = self.arrayBody(array, payload, query.get('format', 'json'))
+        return body, ctype, data.mtime, {'X-Array-Shape': ','.join(str(n) for n in array.shape)}
+
+    def blockRange(self, spec, frames):
+        '''
+        USAGE: Parses "<block>" or "<first>-<last>" into first and last block indices, checked against the number of blocks.
+        '''
+
+        match = re.fullmatch(r'(\d+)(?:-(\d+))?', spec)
+        if not match:
+            raise RequestError(400, 'Bad block range "%s" (use "<block>" or "<first>-<last>").' % spec)
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else first
+        if first > last or last >= frames:
+            raise RequestError(404, 'Block range "%s" outside 0-%d.' % (spec, frames - 1))
+        return first, last
+
+    def arrayBody(self, array, payload, form):
+        '''
+        USAGE: Encodes an array as raw float32 ("bin") or, within the JSON payload, as nested lists ("json").
+        RETURNS: body, ctype
+        '''
+
+        if form == 'bin':
+            return np.ascontiguousarray(array, dtype='<f4').tobytes(), 'application/octet-stream'
+        if form == 'json':
+            payload['data'] = jsonArray(array)
+            return jsonBody(payload), 'application/json'
+        raise RequestError(400, 'Unknown format "%s" (use json or bin).' % form)
+
+    def resource(self, relpath):
+        '''
+        USAGE: Reads a static file from the resource directory (paths outside it are refused).
+        RETURNS: body, ctype, mtime, headers
+        '''
+
+        filepath = os.path.realpath(os.path.join(self.resourcedir, relpath))
+        if os.path.commonpath([filepath, self.resourcedir]) != self.resourcedir or not os.path.isfile(filepath):
+            raise RequestError(404, 'No resource "%s".' % relpath)
+
+        with open(filepath, 'rb') as f:
+            body = f.read()
+        ctype = CONTENT_TYPES.get(os.path.splitext(filepath)[1].lower(), 'application/octet-stream')
+        return body, ctype, os.stat(filepath).st_mtime, {}
+
+class ChoroplethHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler: adds caching headers, conditional responses, and gzip to ChoroplethStore answers.
+    '''
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, send_body):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        try:
+            body, ctype, mtime, headers = self.server.store.request(unquote(url.path), query)
+        except RequestError as error:
+            return self.sendBody(error.status, jsonBody({'error': str(error)}), 'application/json',
+                                 {'Cache-Control': 'no-store'}, send_body)
+
+        # The ETag identifies the content and its encoding, so it can be checked before compressing
+        gz = ctype in COMPRESSIBLE and len(body) >= MIN_GZIP and 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = '"%s%s"' % (hashlib.blake2b(body, digest_size=12).hexdigest(), '-gz' if gz else '')
+        headers.update({'ETag': etag, 'Cache-Control': 'public, max-age=%d' % self.server.max_age,
+                        'Vary': 'Accept-Encoding'})
+        if mtime is not None:
+            headers['Last-Modified'] = formatdate(mtime, usegmt=True)
+
+        if self.notModified(etag, mtime):
+            return self.sendBody(304, b'', None, headers, False)
+
+        if gz:
+            body = compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.sendBody(200, body, ctype, headers, send_body)
+
+    def notModified(self, etag, mtime):
+        '''
+        USAGE: Checks the conditional request headers (If-None-Match takes precedence over If-Modified-Since).
+        '''
+
+        match = self.headers.get('If-None-Match')
+        if match is not None:
+            return match.strip() == '*' or etag in [m.strip() for m in match.split(',')]
+
+        since = self.headers.get('If-Modified-Since')
+        if since is None or mtime is None:
+            return False
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    def sendBody(self, status, body, ctype, headers, send_body):
+        self.send_response(status)
+        if ctype:
+            self.send_header('Content-Type', ctype)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, X-Array-Shape')
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def makeServer(host='127.0.0.1', port=8000, colordir='Resources/Color', resourcedir='Resources', max_age=MAX_AGE, quiet=False):
+    '''
+    USAGE:
+    Creates the server (one thread per request); start it with serve_forever() and stop it with shutdown().
+
+    ARGUMENTS:
+    host, port - address to listen on (port 0 picks a free port; see server.server_address)
+    colordir - directory of the color files
+    resourcedir - directory of the static files served under /resources/
+    max_age - Cache-Control max-age (s)
+    quiet - if True, requests are not logged
+
+    RETURNS:
+    server - ThreadingHTTPServer
+    '''
+
+    server = ThreadingHTTPServer((host, port), ChoroplethHandler)
+    server.store = ChoroplethStore(colordir, resourcedir)
+    server.max_age = max_age
+    server.quiet = quiet
+    return server
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve choropleth frames, frame ranges, and county series over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--colordir', default='Resources/Color', help='directory of color files')
+    parser.add_argument('--resourcedir', default='Resources', help='directory of static files served under /resources/')
+    parser.add_argument('--max-age', type=int, default=MAX_AGE, help='Cache-Control max-age (s)')
+    parser.add_argument('--quiet', action='store_true', help='do not log requests')
+    args = parser.parse_args(argv)
+
+    server = makeServer(args.host, args.port, args.colordir, args.resourcedir, args.max_age, args.quiet)
+    print('Serving "%s" on http://%s:%d/ (Ctrl-C to stop)...' % (args.colordir, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
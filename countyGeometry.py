@@ -0,0 +1,257 @@
+'''
+County geometry from the US TopoJSON file (https://d3js.org/us-10m.v1.json).
+
+That file is already projected: its coordinates are screen pixels of d3.geoAlbersUsa() with
+scale 1280 and translate [480, 300] (the same projection the choropleth pages use for tweets and
+the eclipse path). This module decodes its arcs into county polygon rings, and provides a numpy
+version of the Albers USA projection (and its inverse) to move between longitude/latitude and
+the TopoJSON pixel space.
+'''
+
+import json
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+
+ALBERS_SCALE = 1280             # d3.geoAlbersUsa() scale used to project USTopoJSON.json
+ALBERS_TRANSLATE = (480, 300)   # d3.geoAlbersUsa() translate used to project USTopoJSON.json
+
+def loadTopoJSON(topoJSONfile):
+    '''
+    USAGE: Loads a TopoJSON file from disk.
+    '''
+
+    with open(topoJSONfile) as tjf:
+        return json.load(tjf)
+
+def decodeArcs(topojson):
+    '''
+    USAGE:
+    Decodes the quantized, delta-encoded arcs of a TopoJSON topology into absolute coordinates.
+    All arcs are decoded together: one cumulative sum over the concatenated deltas, corrected at
+    the start of each arc.
+
+    RETURNS:
+    arcs - list of (n, 2) arrays of coordinates, one per arc
+    '''
+
+    lengths = np.array([len(arc) for arc in topojson['arcs']])
+    deltas = np.concatenate([np.array(arc, dtype=float)[:, :2] for arc in topojson['arcs']])
+
+    if 'transform' in topojson:
+        total = np.cumsum(deltas, axis=0)
+        starts = np.cumsum(lengths) - lengths
+        offset = np.repeat(total[starts] - deltas[starts], lengths, axis=0)
+        coords = (total - offset) * topojson['transform']['scale'] + topojson['transform']['translate']
+    else:
+        coords = deltas
+
+    return np.split(coords, np.cumsum(lengths)[:-1])
+
+def geometryRings(topojson, objectname='counties'):
+    '''
+    USAGE:
+    Assembles the polygon rings of every geometry in a TopoJSON object.
+
+    ARGUMENTS:
+    topojson - TopoJSON topology (e.g. from loadTopoJSON)
+    objectname - name of the object whose geometries are assembled ("counties", "states", ...)
+
+    RETURNS:
+    rings - dictionary of {"id": [ring, ... , ring]} pairs, each ring an (n, 2) array
+    '''
+
+    arcs = decodeArcs(topojson)
+
+    def ring(indices):
+        # Negative arc indices (~i) refer to arc i, reversed; consecutive arcs share an endpoint
+        parts = [arcs[i] if i >= 0 else arcs[~i][::-1] for i in indices]
+        return np.concatenate([parts[0]] + [p[1:] for p in parts[1:]])
+
+    rings = {}
+    for geometry in topojson['objects'][objectname]['geometries']:
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['arcs']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['arcs']
+        else:
+            continue
+        rings[geometry['id']] = [ring(r) for polygon in polygons for r in polygon]
+
+    return rings
+
+def ringCentroids(rings):
+    '''
+    USAGE:
+    Calculates the area-weighted centroid of each geometry from its rings (holes, which wind the
+    other way, are subtracted automatically by the signed shoelace formula).
+
+    ARGUMENTS:
+    rings - dictionary of {"id": [ring, ... , ring]} pairs (see geometryRings)
+
+    RETURNS:
+    ids - list of geometry ids
+    x, y - arrays of centroid coordinates
+    area - array of absolute geometry areas (in the squared units of the rings)
+    '''
+
+    ids = list(rings)
+    x, y, area = np.zeros(len(ids)), np.zeros(len(ids)), np.zeros(len(ids))
+
+    for n, key in enumerate(ids):
+        A = cx = cy = 0
+        for r in rings[key]:
+            x0, y0, x1, y1 = r[:-1, 0], r[:-1, 1], r[1:, 0], r[1:, 1]
+            cross = x0 * y1 - x1 * y0
+            A += cross.sum() / 2
+            cx += ((x0 + x1) * cross).sum() / 6
+            cy += ((y0 + y1) * cross).sum() / 6
+        if A:
+            x[n], y[n], area[n] = cx / A, cy / A, abs(A)
+        else:   # degenerate geometry: fall back to the mean of its vertices
+            x[n], y[n] = np.concatenate(rings[key]).mean(axis=0)
+
+    return ids, x, y, area
+
+##### ------------------------------ Albers USA projection ------------------------------ #####
+
+class ConicEqualArea():
+    '''
+    Numpy port of d3.geoConicEqualArea() with d3's rotate/center/scale/translate conventions.
+    '''
+
+    def __init__(self, parallels, rotate, center, scale, translate):
+        '''
+        Initialize ConicEqualArea object (angles in degrees, as passed to d3).
+        '''
+
+        sy0 = np.sin(np.radians(parallels[0]))
+        self.n = (sy0 + np.sin(np.radians(parallels[1]))) / 2
+        self.c = 1 + sy0 * (2 * self.n - sy0)
+        self.r0 = np.sqrt(self.c) / self.n
+        self.rotate = rotate
+        self.scale = scale
+        self.translate = translate
+        self.center = self.raw(np.radians(center[0]), np.radians(center[1]))
+
+    def raw(self, lam, phi):
+        r = np.sqrt(self.c - 2 * self.n * np.sin(phi)) / self.n
+        return r * np.sin(lam * self.n), self.r0 - r * np.cos(lam * self.n)
+
+    def rawInvert(self, x, y):
+        r0y = self.r0 - y
+        lam = np.arctan2(x, np.abs(r0y)) * np.sign(r0y)
+        lam = np.where(r0y * self.n < 0, lam - np.pi * np.sign(x) * np.sign(r0y), lam)
+        phi = np.arcsin(np.clip((self.c - (x**2 + r0y**2) * self.n**2) / (2 * self.n), -1, 1))
+        return lam / self.n, phi
+
+    def project(self, lon, lat):
+        lam = np.radians((np.asarray(lon, dtype=float) + self.rotate + 180) % 360 - 180)
+        px, py = self.raw(lam, np.radians(np.asarray(lat, dtype=float)))
+        return (self.translate[0] + self.scale * (px - self.center[0]),
+                self.translate[1] - self.scale * (py - self.center[1]))
+
+    def invert(self, x, y):
+        px = (np.asarray(x, dtype=float) - self.translate[0]) / self.scale + self.center[0]
+        py = -(np.asarray(y, dtype=float) - self.translate[1]) / self.scale + self.center[1]
+        lam, phi = self.rawInvert(px, py)
+        return (np.degrees(lam) - self.rotate + 180) % 360 - 180, np.degrees(phi)
+
+def albersUsaParts(scale=ALBERS_SCALE, translate=ALBERS_TRANSLATE):
+    '''
+    USAGE:
+    Builds the three conic projections making up d3.geoAlbersUsa(), each with the screen extent
+    (in units of scale, relative to translate) inside which it is used.
+
+    RETURNS:
+    parts - list of (projection, [xmin, ymin, xmax, ymax]) pairs for lower 48, Alaska, and Hawaii
+    '''
+
+    k, (x, y) = scale, translate
+    lower48 = ConicEqualArea((29.5, 45.5), 96, (-0.6, 38.7), k, (x, y))
+    alaska = ConicEqualArea((55, 65), 154, (-2, 58.5), 0.35 * k, (x - 0.307 * k, y + 0.201 * k))
+    hawaii = ConicEqualArea((8, 18), 157, (-3, 19.9), k, (x - 0.205 * k, y + 0.212 * k))
+    return [(lower48, [-0.455, -0.238, 0.455, 0.238]),
+            (alaska, [-0.425, 0.120, -0.214, 0.234]),
+            (hawaii, [-0.214, 0.166, -0.115, 0.234])]
+
+def albersUsa(lon, lat, scale=ALBERS_SCALE, translate=ALBERS_TRANSLATE):
+    '''
+    USAGE:
+    Projects arrays of longitude/latitude (degrees) to screen coordinates like d3.geoAlbersUsa():
+    each point is projected by the lower 48 projection if it lands inside the lower 48 extent,
+    otherwise by Alaska's, then Hawaii's. Points outside all three extents become NaN.
+
+    RETURNS:
+    x, y - arrays of screen coordinates (TopoJSON pixel space with the default arguments)
+    '''
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    x, y = np.full(lon.shape, np.nan), np.full(lon.shape, np.nan)
+    todo = np.ones(lon.shape, dtype=bool)
+
+    for projection, (x0, y0, x1, y1) in albersUsaParts(scale, translate):
+        px, py = projection.project(lon, lat)
+        u, v = (px - translate[0]) / scale, (py - translate[1]) / scale
+        hit = todo & (u >= x0) & (u <= x1) & (v >= y0) & (v <= y1)
+        x[hit], y[hit] = px[hit], py[hit]
+        todo &= ~hit
+
+    return x, y
+
+def albersUsaInvert(x, y, scale=ALBERS_SCALE, translate=ALBERS_TRANSLATE):
+    '''
+    USAGE: Inverts albersUsa(): screen coordinates to longitude/latitude arrays (degrees), choosing
+    the Alaska or Hawaii inset by screen position like d3.geoAlbersUsa().invert().
+    '''
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    u, v = (x - translate[0]) / scale, (y - translate[1]) / scale
+    (lower48, _), (alaska, _), (hawaii, _) = albersUsaParts(scale, translate)
+
+    inAlaska = (v >= 0.120) & (v < 0.234) & (u >= -0.425) & (u < -0.214)
+    inHawaii = ~inAlaska & (v >= 0.166) & (v < 0.234) & (u >= -0.214) & (u < -0.115)
+
+    lon, lat = lower48.invert(x, y)
+    for projection, mask in [(alaska, inAlaska), (hawaii, inHawaii)]:
+        plon, plat = projection.invert(x, y)
+        lon, lat = np.where(mask, plon, lon), np.where(mask, plat, lat)
+
+    return lon, lat
+
+def countyCentroids(topoJSONfile):
+    '''
+    USAGE: Calculates the longitude/latitude of the centroid of every county in a TopoJSON file.
+    RETURNS: ids - list of county codes; lon, lat - arrays of centroid coordinates (degrees)
+    '''
+
+    ids, x, y, _ = ringCentroids(geometryRings(loadTopoJSON(topoJSONfile), 'counties'))
+    lon, lat = albersUsaInvert(x, y)
+    return ids, lon, lat
+
+def countyUniverse(topoJSONfile, censusdatafile):
+    '''
+    USAGE:
+    Builds the full, fixed list of county codes used for the rows of every tally array: the union
+    of the counties drawn by the TopoJSON file and the counties listed by the US Census Bureau,
+    in sorted order.
+
+    ARGUMENTS:
+    topoJSONfile - US county TopoJSON file
+    censusdatafile - census data file written by TweetDF.getCensusData()
+
+    RETURNS:
+    universe - sorted list of 5-digit county code strings
+    '''
+
+    topojson = loadTopoJSON(topoJSONfile)
+    codes = set(g['id'] for g in topojson['objects']['counties']['geometries'])
+
+    with open(censusdatafile, 'r') as cdf:
+        censusdata = json.load(cdf)
+    state, county = censusdata[0].index('state'), censusdata[0].index('county')
+    codes.update(row[state] + row[county] for row in censusdata[1:])
+
+    return sorted(codes)
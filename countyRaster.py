@@ -0,0 +1,164 @@
+'''
+Precomputed county raster: the county polygons of USTopoJSON.json rasterized once into a grid of
+uint16 county indices (position in the county universe + 1; 0 where there is no county), saved as
+a .npy file and memory-mapped on load. The resolution and county universe the grid was built with
+are saved next to it (.json), and a grid built with others is rebuilt rather than reused.
+
+Mapping points to counties, or a per-county color vector to an image, is then a single array
+gather instead of a polygon test per point or a polygon fill per county. Results are approximate
+at the scale of one grid cell near county borders; use exact polygon tests where that matters.
+'''
+
+import os
+import json
+import hashlib
+from lazyImports import lazyModule
+import countyGeometry
+
+np = lazyModule('numpy')
+Image = lazyModule('PIL.Image')
+ImageDraw = lazyModule('PIL.ImageDraw')
+
+MAP_SIZE = (960, 600)   # size of the TopoJSON pixel space
+
+def countyRings(topoJSONfile):
+    '''
+    USAGE:
+    Lists the outer rings of every county, largest first, so that drawing them in order paints
+    counties enclosed by another county on top of it (holes are dropped).
+
+    RETURNS:
+    rings - list of (county code, ring) pairs, each ring an (n, 2) array in TopoJSON pixel space
+    '''
+
+    rings = []
+    for code, county in countyGeometry.geometryRings(countyGeometry.loadTopoJSON(topoJSONfile), 'counties').items():
+        area = [np.sum(r[:-1, 0] * r[1:, 1] - r[1:, 0] * r[:-1, 1]) / 2 for r in county]
+        outer = np.sign(area[int(np.argmax(np.abs(area)))])
+        rings += [(abs(a), code, r) for r, a in zip(county, area) if np.sign(a) == outer]
+
+    rings.sort(key=lambda r: -r[0])
+    return [(code, r) for _, code, r in rings]
+
+def rasterParams(universe, resolution):
+    '''
+    USAGE: Describes what a county raster is built with (resolution, number and hash of the universe county codes).
+    '''
+
+    digest = hashlib.blake2b('\n'.join(universe).encode('utf-8'), digest_size=16).hexdigest()
+    return {'resolution': float(resolution), 'counties': len(universe), 'universe': digest}
+
+def paramsFile(rasterfile):
+    return os.path.splitext(rasterfile)[0] + '.json'
+
+def buildRaster(topoJSONfile, universe, rasterfile, resolution=1.0):
+    '''
+    USAGE:
+    Rasterizes the counties of a TopoJSON file into a county index grid and saves it to disk.
+
+    ARGUMENTS:
+    topoJSONfile - US county TopoJSON file
+    universe - list of county codes (see TweetDF.getCountyUniverse); grid values are positions + 1
+    rasterfile - location of the .npy file to write (its parameters go to a .json file of the same name)
+    resolution - grid cells per TopoJSON pixel (the grid is 600 x 960 cells at resolution 1)
+
+    RETURNS:
+    grid - (rows x columns) uint16 array of county indices
+    '''
+
+    position = {code: i for i, code in enumerate(universe)}
+    size = (round(MAP_SIZE[0] * resolution), round(MAP_SIZE[1] * resolution))
+    image = Image.new('I', size, 0)
+    draw = ImageDraw.Draw(image)
+
+    for code, r in countyRings(topoJSONfile):
+        if code in position:
+            draw.polygon((r * resolution).ravel().tolist(), fill=position[code] + 1)
+
+    grid = np.asarray(image).astype(np.uint16)
+    np.save(rasterfile, grid)
+    with open(paramsFile(rasterfile), 'w') as f:
+        json.dump(rasterParams(universe, resolution), f)
+    return grid
+
+def loadRaster(rasterfile, topoJSONfile, universe, resolution=1.0):
+    '''
+    USAGE:
+    Loads the county raster from "rasterfile", building and saving it first if it does not exist or
+    was built with another resolution or county universe.
+
+    RETURNS: raster - CountyRaster object
+    '''
+
+    saved = None
+    if os.path.exists(rasterfile) and os.path.exists(paramsFile(rasterfile)):
+        with open(paramsFile(rasterfile), 'r') as f:
+            saved = json.load(f)
+
+    if saved != rasterParams(universe, resolution):
+        if saved is not None:
+            print('County raster "%s" was built with other parameters (%s); rebuilding...' % (rasterfile, saved))
+        print('Rasterizing counties to "%s"...' % rasterfile)
+        buildRaster(topoJSONfile, universe, rasterfile, resolution)
+    return CountyRaster(rasterfile, universe)
+
+class CountyRaster():
+    '''
+    Memory-mapped county index grid, with point lookup and frame coloring by array indexing.
+    '''
+
+    def __init__(self, rasterfile, universe):
+        '''
+        Initialize CountyRaster object.
+
+        ARGUMENTS:
+        rasterfile - .npy file written by buildRaster()
+        universe - list of county codes the grid was built with
+        '''
+
+        self.grid = np.load(rasterfile, mmap_mode='r')       # (rows x columns) county indices
+        self.universe = universe                            # County codes, in index order
+        self.resolution = self.grid.shape[1] / MAP_SIZE[0]  # Grid cells per TopoJSON pixel
+
+    def lookup(self, lon, lat):
+        '''
+        USAGE:
+        Maps arrays of longitude/latitude (degrees) to county indices: each point is projected to
+        TopoJSON pixel space (see countyGeometry.albersUsa) and the grid cell under it is read.
+
+        RETURNS:
+        index - array of positions in the county universe (-1 where there is no county)
+        '''
+
+        x, y = countyGeometry.albersUsa(lon, lat)
+        col = np.floor(np.nan_to_num(x, nan=-1) * self.resolution).astype(int)
+        row = np.floor(np.nan_to_num(y, nan=-1) * self.resolution).astype(int)
+        inside = (row >= 0) & (row < self.grid.shape[0]) & (col >= 0) & (col < self.grid.shape[1])
+
+        index = np.full(col.shape, -1)
+        index[inside] = self.grid[row[inside], col[inside]].astype(int) - 1
+        return index
+
+    def countyCodes(self, lon, lat):
+        '''
+        USAGE: Maps arrays of longitude/latitude (degrees) to a list of county codes (None where there is no county).
+        '''
+
+        return [self.universe[i] if i >= 0 else None for i in self.lookup(lon, lat)]
+
+    def colorFrame(self, colors, background=(255, 255, 255)):
+        '''
+        USAGE:
+        Colors the grid by gathering from a per-county color vector.
+
+        ARGUMENTS:
+        colors - (counties x channels) array of colors, in universe order
+        background - color of cells outside every county
+
+        RETURNS:
+        frame - (rows x columns x channels) array
+        '''
+
+        colors = np.asarray(colors)
+        palette = np.concatenate([np.asarray(background, dtype=colors.dtype)[None, :], colors])
+        return palette[self.grid]
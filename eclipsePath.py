@@ -0,0 +1,186 @@
+'''
+Vectorized parsing and time-interpolation of NASA eclipse path tables.
+
+A "path" is a dictionary of equal-length numpy arrays, one entry per row of the NASA table:
+
+    'Time'      - seconds after 00:00 UTC on the day of the eclipse
+    'NLat', 'NLon', 'SLat', 'SLon', 'CLat', 'CLon'
+                - northern limit, southern limit, and central line coordinates (decimal degrees)
+    'Width'     - width of the path of totality (km)
+    'Duration'  - duration of totality on the central line (s)
+
+plus a 'Date' entry (datetime.date or None) which is not an array. Every path produced by
+interpolatePath() has the same layout as one produced by parseNASAPath(), so paths can be
+re-interpolated, stacked, or written out with the same functions.
+'''
+
+import re
+from datetime import date
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+
+COORD_COLUMNS = ['NLat', 'NLon', 'SLat', 'SLon', 'CLat', 'CLon']
+VALUE_COLUMNS = COORD_COLUMNS + ['Width', 'Duration']
+
+# One table row, e.g.
+#  17:18   45 16.2N 123 26.5W  44 21.0N 122 58.9W  44 48.6N 123 12.3W  1.027  40 117  100  02m00.0s
+_crd = r'(\d+) ([\d.]+)([NS]) (\d+) ([\d.]+)([EW])'
+_row = re.compile(r'^\s*(\d+):(\d+)\s+%s\s+%s\s+%s\s+[\d.]+\s+\d+\s+[\d-]+\s+(\d+)\s+(\d+)m([\d.]+)s'
+                  % (_crd, _crd, _crd), re.MULTILINE)
+
+def parseNASAPath(totalityfile, eclipse_date=None):
+    '''
+    USAGE:
+    Parses a raw NASA eclipse path text file into a path dictionary. Rows for which the northern
+    or southern limit is missing (at the very ends of the path) are skipped, as in totalityNASA2JSON.
+
+    ARGUMENTS:
+    totalityfile - text file containing raw data from NASA
+    eclipse_date - optional: datetime.date of the eclipse (by default, read from a "YYYY_MM_DD"
+        prefix in the file name if there is one)
+
+    RETURNS:
+    path - dictionary of path arrays (see module docstring)
+    '''
+
+    with open(totalityfile, 'r', encoding='latin-1') as tf:   # NASA files use a latin-1 degree sign
+        totalitydata = tf.read()
+
+    if eclipse_date is None:
+        match = re.search(r'(\d{4})_(\d\d)_(\d\d)', totalityfile)
+        if match:
+            eclipse_date = date(*[int(x) for x in match.groups()])
+
+    return parseNASAText(totalitydata, eclipse_date)
+
+def parseNASAText(totalitydata, eclipse_date=None):
+    '''
+    USAGE: Parses the text of a NASA eclipse path table into a path dictionary (see parseNASAPath).
+    '''
+
+    rows = np.array(_row.findall(totalitydata))
+    if not len(rows):
+        raise ValueError('No eclipse path rows found in NASA path data.')
+
+    path = {'Date': eclipse_date}
+    path['Time'] = 3600 * rows[:, 0].astype(float) + 60 * rows[:, 1].astype(float)
+
+    # Convert each (degrees, decimal minutes, hemisphere) triple to signed decimal degrees
+    for n, column in enumerate(COORD_COLUMNS):
+        i = 2 + 3 * n
+        degrees = rows[:, i].astype(float) + rows[:, i + 1].astype(float) / 60
+        sign = np.where(np.isin(rows[:, i + 2], ['S', 'W']), -1.0, 1.0)
+        path[column] = sign * degrees
+
+    path['Width'] = rows[:, 20].astype(float)
+    path['Duration'] = 60 * rows[:, 21].astype(float) + rows[:, 22].astype(float)
+
+    return path
+
+def dataframe2path(df, eclipse_date=date(2017, 8, 21)):
+    '''
+    USAGE: Converts a dataframe created by totalityNASA2JSON() into a path dictionary.
+    ARGUMENTS: df - dataframe with "Time" ("HH:MM") and "[Northern|Southern|Central]LonLat" columns
+    RETURNS: path - dictionary of path arrays (without "Width" and "Duration")
+    '''
+
+    hm = np.array([t.split(':') for t in df['Time']], dtype=float)
+    path = {'Date': eclipse_date, 'Time': 3600 * hm[:, 0] + 60 * hm[:, 1]}
+
+    for prefix, column in [('N', 'NorthernLonLat'), ('S', 'SouthernLonLat'), ('C', 'CentralLonLat')]:
+        lonlat = np.array(list(df[column]), dtype=float)
+        path[prefix + 'Lon'] = lonlat[:, 0]
+        path[prefix + 'Lat'] = lonlat[:, 1]
+
+    return path
+
+def interpolatePath(path, step=30, start=None, stop=None):
+    '''
+    USAGE:
+    Linearly interpolates every column of a path at a fixed time step with np.interp. Times outside
+    the tabulated range are not extrapolated.
+
+    ARGUMENTS:
+    path - path dictionary (e.g. from parseNASAPath)
+    step - time step (s) between interpolated points
+    start - optional: first interpolated time (s after 00:00 UTC); default is the first tabulated time
+    stop - optional: last interpolated time; default is the last tabulated time
+
+    RETURNS:
+    interp - path dictionary sampled every "step" seconds
+    '''
+
+    if step <= 0:
+        raise ValueError('Interpolation step must be positive.')
+
+    times = path['Time']
+    start = times[0] if start is None else max(start, times[0])
+    stop = times[-1] if stop is None else min(stop, times[-1])
+
+    # Integer multiples of step avoid the drift of repeatedly adding a fractional step
+    t = start + step * np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1)
+
+    interp = {'Date': path.get('Date'), 'Time': t}
+    for column in VALUE_COLUMNS:
+        if column in path:
+            interp[column] = np.interp(t, times, path[column])
+
+    return interp
+
+def batchInterpolate(paths, step=30):
+    '''
+    USAGE: Interpolates many path tables (e.g. one per eclipse) at the same time step.
+    ARGUMENTS: paths - list of path dictionaries, or of NASA path file names
+    RETURNS: list of interpolated path dictionaries, in the same order
+    '''
+
+    return [interpolatePath(parseNASAPath(p) if isinstance(p, str) else p, step) for p in paths]
+
+def pathDatetimes(path):
+    '''
+    USAGE: Returns the times of a path as a numpy datetime64[ms] array (requires path['Date']).
+    '''
+
+    if path.get('Date') is None:
+        raise ValueError('Path has no eclipse date.')
+    day = np.datetime64(path['Date'].isoformat(), 'ms')
+    return day + np.round(path['Time'] * 1000).astype('timedelta64[ms]')
+
+def timeStrings(path):
+    '''
+    USAGE: Formats the times of a path as "HH:MM:SS" strings (with milliseconds for sub-second times).
+    '''
+
+    ms = np.round(path['Time'] * 1000).astype('int64')
+    stamps = np.datetime64('2000-01-01', 'ms') + ms.astype('timedelta64[ms]')
+    unit = 's' if not np.any(ms % 1000) else 'ms'
+    return [s[11:] for s in np.datetime_as_string(stamps, unit=unit)]
+
+def centerGeoJSON(path):
+    '''
+    USAGE: Creates a GeoJSON FeatureCollection of points along the path's central line.
+    RETURNS: centerJSON - dictionary with one "Point" feature (with a "Time" property) per path row
+    '''
+
+    coords = np.column_stack([path['CLon'], path['CLat']]).tolist()
+    features = [{"type": "Feature",
+                 "geometry": {"type": "Point", "coordinates": c},
+                 "properties": {"Time": t}} for c, t in zip(coords, timeStrings(path))]
+
+    return {"type": "FeatureCollection", "features": features}
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main():
+    import time
+    totalityfile = 'Resources/2017_08_21_NASAEclipsePath.txt'
+    path = parseNASAPath(totalityfile)
+    tic = time.perf_counter()
+    track = interpolatePath(path, step=1)
+    toc = time.perf_counter()
+    print('Interpolated %d NASA path rows to %d points (1 s resolution) in %.2f ms.'
+          % (len(path['Time']), len(track['Time']), 1000 * (toc - tic)))
+
+if __name__ == '__main__':
+    main()
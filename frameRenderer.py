@@ -0,0 +1,212 @@
+'''
+Headless renderer for the county choropleth time-lapse of EclipseChoroplethVideo.html.
+
+A color file written by TweetDF.tally2value() (Resources/Color/*.csv) and the county polygons of
+USTopoJSON.json are read once; every time block is then rasterized to a PNG frame with the same
+color scale as the web page, and frames are farmed out to a pool of worker processes. The frames
+can be assembled into a video with e.g.:
+
+    ffmpeg -framerate 25 -i Frames/frame_%05d.png -pix_fmt yuv420p eclipse_choropleth.mp4
+'''
+
+import os
+import re
+import json
+import time
+from datetime import datetime, timedelta
+from lazyImports import lazyModule
+import countyRaster
+import HistogramAnalysis
+
+np = lazyModule('numpy')
+Image = lazyModule('PIL.Image')
+ImageDraw = lazyModule('PIL.ImageDraw')
+ImageFont = lazyModule('PIL.ImageFont')
+multiprocessing = lazyModule('multiprocessing')
+
+LOW_COLOR = (200, 211, 234)             # color for lowest tweet fraction (as in EclipseChoroplethVideo.html)
+HIGH_COLOR = (8, 48, 107)               # color for highest tweet fraction
+BACKGROUND_COLOR = (255, 255, 255)      # color behind the map
+TEXT_COLOR = (60, 60, 60)               # color of the clock label
+COLOR_DOMAIN = (-2, 2)                  # min and max color mapping value (no. of std devs)
+MAP_SIZE = (960, 600)                   # size of the TopoJSON pixel space
+T0 = datetime(2017, 8, 21, 15, 0, 0)    # start time (UTC) of the first time block
+
+def colorScale(values, low=LOW_COLOR, high=HIGH_COLOR, domain=COLOR_DOMAIN):
+    '''
+    USAGE:
+    Maps color values to RGB like the page's d3.scaleLinear(): linear interpolation between "low"
+    and "high" over "domain", extrapolated beyond it and clamped to valid channel values. Values
+    of 0 or NaN get the low color (the page's "Value ? county_color(Value) : low_color").
+
+    RETURNS:
+    rgb - uint8 array of shape values.shape + (3,)
+    '''
+
+    values = np.asarray(values, dtype=float)
+    frac = (values - domain[0]) / (domain[1] - domain[0])
+    rgb = np.clip(np.rint(np.add(low, frac[..., None] * np.subtract(high, low))), 0, 255)
+    rgb[np.nan_to_num(values) == 0] = low
+    return rgb.astype(np.uint8)
+
+def timeParams(countycolorfile):
+    '''
+    USAGE: Reads the time block increment and block length (minutes) from a color file name.
+    RETURNS: (increment, block_length), or None if the name has no "_d#_delta#" label
+    '''
+
+    match = re.search(r'_d([\d.]+)_delta([\d.]+)', os.path.basename(countycolorfile))
+    return (float(match.group(1)), float(match.group(2))) if match else None
+
+class FrameRenderer():
+    '''
+    Rasterizes the time blocks of one color file to choropleth images.
+    '''
+
+    def __init__(self, countycolorfile, topoJSONfile='Resources/USTopoJSON.json', scale=1.0, t0=T0, raster=None):
+        '''
+        Initialize FrameRenderer object.
+
+        ARGUMENTS:
+        countycolorfile - color file written by TweetDF.tally2value()
+        topoJSONfile - US county TopoJSON file
+        scale - image size relative to the 960 x 600 TopoJSON pixel space
+        t0 - datetime of the start of the first time block (for the clock label)
+        raster - optional: CountyRaster (see countyRaster.py); if given, frames are colored by
+            gathering from its county index grid instead of filling polygons, and "scale" is
+            replaced by the raster resolution
+        '''
+
+        codes, _, value, _ = HistogramAnalysis.loadColor(countycolorfile)
+        row = {code: i for i, code in enumerate(codes)}
+
+        self.colors = colorScale(value)                     # (counties x blocks x 3) fill colors
+        self.colors = np.concatenate([self.colors, colorScale(np.zeros((1, value.shape[1])))])  # last row: counties without data
+        self.raster = raster                                # County raster used for gather rendering
+        if raster is None:
+            self.size = (round(MAP_SIZE[0] * scale), round(MAP_SIZE[1] * scale))
+            self.polygons = self.countyPolygons(topoJSONfile, scale, row)
+        else:
+            scale = raster.resolution
+            self.size = raster.grid.shape[::-1]
+            self.rasterrows = np.array([row.get(code, len(self.colors) - 1) for code in raster.universe])
+        self.font = ImageFont.load_default(size=max(int(24 * scale), 8))
+
+        params = timeParams(countycolorfile)
+        self.times = None                                   # Clock label of each block (end of the block, as on the page)
+        if params:
+            increment, block_length = params
+            self.times = [t0 + timedelta(minutes=block * increment + block_length) for block in range(self.frames())]
+
+    def countyPolygons(self, topoJSONfile, scale, row):
+        '''
+        USAGE: Prepares the county rings for drawing, scaled to the image (see countyRaster.countyRings).
+        RETURNS: polygons - list of (color row, [x0, y0, x1, y1, ...]) pairs
+        '''
+
+        missing = len(self.colors) - 1
+        return [(row.get(code, missing), (r * scale).ravel().tolist()) for code, r in countyRaster.countyRings(topoJSONfile)]
+
+    def frames(self):
+        '''
+        USAGE: Returns the number of time blocks (frames).
+        '''
+
+        return self.colors.shape[1]
+
+    def render(self, block):
+        '''
+        USAGE: Rasterizes one time block.
+        RETURNS: image - PIL RGB image
+        '''
+
+        if self.raster is None:
+            image = Image.new('RGB', self.size, BACKGROUND_COLOR)
+            draw = ImageDraw.Draw(image)
+            fill = [tuple(c) for c in self.colors[:, block].tolist()]
+            for n, coords in self.polygons:
+                draw.polygon(coords, fill=fill[n])
+        else:
+            image = Image.fromarray(self.raster.colorFrame(self.colors[self.rasterrows, block], BACKGROUND_COLOR))
+            draw = ImageDraw.Draw(image)
+
+        if self.times:
+            label = self.times[block].strftime('%H:%M:%S UTC')
+            draw.text((self.size[0] * 0.98, self.size[1] * 0.8), label, fill=TEXT_COLOR, font=self.font, anchor='rb')
+
+        return image
+
+    def save(self, block, outdir):
+        '''
+        USAGE: Renders one time block to "outdir/frame_#####.png".
+        RETURNS: framefile - location of the PNG file
+        '''
+
+        framefile = os.path.join(outdir, 'frame_%05d.png' % block)
+        self.render(block).save(framefile, compress_level=1)
+        return framefile
+
+##### ------------------------------------ PARALLEL ------------------------------------ #####
+
+_renderer = None    # FrameRenderer of a worker process
+
+def _initWorker(renderer):
+    global _renderer
+    _renderer = renderer
+
+def _saveFrame(job):
+    block, outdir = job
+    return _renderer.save(block, outdir)
+
+def renderFrames(countycolorfile, outdir='Frames', blocks=None, processes=None, **kwargs):
+    '''
+    USAGE:
+    Renders the time blocks of a color file to PNG frames in parallel. The files are read once,
+    in this process; each worker receives a copy of the prepared renderer when it starts.
+
+    ARGUMENTS:
+    countycolorfile - color file written by TweetDF.tally2value()
+    outdir - directory in which to save the frames
+    blocks - optional: iterable of time block indices to render (default: all)
+    processes - number of worker processes (default: number of CPUs)
+    kwargs - further FrameRenderer arguments (topoJSONfile, scale, t0, raster)
+
+    RETURNS:
+    framefiles - list of PNG file locations, in block order
+    '''
+
+    renderer = FrameRenderer(countycolorfile, **kwargs)
+    blocks = range(renderer.frames()) if blocks is None else blocks
+    jobs = [(block, outdir) for block in blocks]
+    os.makedirs(outdir, exist_ok=True)
+
+    if processes == 1:
+        return [renderer.save(block, outdir) for block, outdir in jobs]
+
+    with multiprocessing.Pool(processes, initializer=_initWorker, initargs=(renderer,)) as pool:
+        return pool.map(_saveFrame, jobs, chunksize=max(1, len(jobs) // (8 * (processes or os.cpu_count()))))
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Render choropleth video frames from a county color file.')
+    parser.add_argument('countycolorfile')
+    parser.add_argument('outdir', nargs='?', default='Frames')
+    parser.add_argument('--scale', type=float, default=1.0, help='image size relative to 960 x 600')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--raster', metavar='RASTERFILE', help='color frames from a county raster (see countyRaster.py)')
+    args = parser.parse_args(argv)
+
+    raster = None
+    if args.raster:
+        with open('Resources/countyuniverse.json', 'r') as cuf:
+            universe = json.load(cuf)
+        raster = countyRaster.loadRaster(args.raster, 'Resources/USTopoJSON.json', universe, args.scale)
+
+    tic = time.perf_counter()
+    framefiles = renderFrames(args.countycolorfile, args.outdir, processes=args.processes, scale=args.scale, raster=raster)
+    print('%d frames saved to "%s" in %.1f s.' % (len(framefiles), args.outdir, time.perf_counter() - tic))
+
+if __name__ == '__main__':
+    main()
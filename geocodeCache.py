@@ -0,0 +1,157 @@
+'''
+Cache layer in front of a reverse geocoder (e.g. the "Coordinates to Politics" API used by
+TweetDF.revGeocodePOST). Many tweets share a Place bounding box (a city polygon, say), so their
+centroids repeat exactly. Lookups are therefore collapsed to unique locations first, and only
+locations not already cached are sent to the geocoder, in batches.
+
+Locations are keyed on coordinates rounded to "digits" decimals (4 decimals is about 10 m), or on
+any other hashable key given by the caller (e.g. a place id). The cache is a bounded LRU (least
+recently used entries are evicted first) and can be saved to and loaded from a JSON file, so
+repeated runs over the same capture only query new locations.
+'''
+
+import os
+import json
+from collections import OrderedDict
+
+class GeocodeCache():
+    '''
+    Bounded LRU cache of geocoder results per location, with hit statistics.
+    '''
+
+    def __init__(self, maxsize=1000000, digits=4, cachefile=None):
+        '''
+        Initialize GeocodeCache object, loading "cachefile" if it exists.
+
+        ARGUMENTS:
+        maxsize - maximum number of cached locations
+        digits - decimals kept when rounding coordinates into keys
+        cachefile - optional: location of the JSON file the cache is loaded from and saved to
+        '''
+
+        self.maxsize = maxsize          # Maximum number of cached locations
+        self.digits = digits            # Decimals kept in coordinate keys
+        self.cachefile = cachefile      # Location of the cache file
+        self.entries = OrderedDict()    # {key: geocoder result}, least recently used first
+        self.hits = 0                   # Number of lookups answered without the geocoder
+        self.misses = 0                 # Number of locations sent to the geocoder
+        self.evictions = 0              # Number of entries evicted to stay within maxsize
+        self.requests = 0               # Number of geocoder calls (batches)
+
+        if cachefile and os.path.exists(cachefile):
+            self.load()
+
+    def key(self, lat, lon):
+        '''
+        USAGE: Rounds a coordinate pair into a cache key.
+        '''
+
+        return (round(float(lat), self.digits), round(float(lon), self.digits))
+
+    def get(self, key, default=None):
+        '''
+        USAGE: Returns the cached result of a key (marking it as recently used), or "default".
+        '''
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return default
+
+    def put(self, key, value):
+        '''
+        USAGE: Caches the result of a key, evicting the least recently used entries beyond maxsize.
+        '''
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def lookup(self, coords, geocoder, batch=500, keys=None):
+        '''
+        USAGE:
+        Geocodes a list of locations through the cache: each location's key is looked up, the
+        unique keys not in the cache are sent to "geocoder" "batch" locations at a time, and the
+        results are cached and returned in the order of "coords". Repeated locations share one
+        result object.
+
+        ARGUMENTS:
+        coords - list of [lat, lon] pairs (in the order the geocoder expects)
+        geocoder - function taking a list of locations from coords and returning a list of results
+        batch - maximum number of locations per geocoder call
+        keys - optional: list of cache keys, one per location (default: rounded coordinates)
+
+        RETURNS:
+        results - list of geocoder results, one per location
+        '''
+
+        keys = [self.key(*c) for c in coords] if keys is None else keys
+        found = {}      # results of this lookup, kept even if maxsize evicts them from the cache
+        missing = {}    # {key: first location with the key} of keys to send to the geocoder
+
+        for key, c in zip(keys, coords):
+            if key in found or key in missing:
+                self.hits += 1
+                continue
+            if key in self.entries:
+                found[key] = self.get(key)
+                self.hits += 1
+            else:
+                missing[key] = c
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), batch):
+            part = pending[start:start + batch]
+            results = geocoder([c for _, c in part])
+            if len(results) != len(part):
+                raise ValueError('Geocoder returned %d results for %d locations.' % (len(results), len(part)))
+            for (key, _), result in zip(part, results):
+                found[key] = result
+                self.put(key, result)
+            self.requests += 1
+        self.misses += len(pending)
+
+        return [found[key] for key in keys]
+
+    def hitRate(self):
+        '''
+        USAGE: Returns the fraction of lookups answered without the geocoder.
+        '''
+
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def load(self):
+        '''
+        USAGE: Loads the cache file (ignored if it was saved with different rounding).
+        '''
+
+        with open(self.cachefile, 'r') as f:
+            saved = json.load(f)
+        if saved.get('digits') != self.digits:
+            print('Geocode cache "%s" ignored: saved with %s decimals, not %d.' % (self.cachefile, saved.get('digits'), self.digits))
+            return
+        for key, value in saved['entries']:
+            self.put(tuple(key) if isinstance(key, list) else key, value)
+        print('%d cached locations loaded from "%s".' % (len(self.entries), self.cachefile))
+
+    def save(self):
+        '''
+        USAGE: Saves the cache to the cache file, least recently used entries first.
+        '''
+
+        if not self.cachefile:
+            return
+        with open(self.cachefile, 'w') as f:
+            json.dump({'digits': self.digits, 'entries': [[key, value] for key, value in self.entries.items()]}, f)
+        print('%d cached locations saved to "%s".' % (len(self.entries), self.cachefile))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return ('%d lookups, %d hits (%.1f%%), %d locations geocoded in %d requests, %d cached, %d evicted'
+                % (self.hits + self.misses, self.hits, 100 * self.hitRate(), self.misses, self.requests,
+                   len(self.entries), self.evictions))
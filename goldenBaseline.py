@@ -0,0 +1,342 @@
+'''
+Frozen copy of the original countyExtract() and timeTally() of TweetDataFrame.py, as they were
+before the tally engines, state-level spreading, category tallies, and dedupe weights were added.
+
+goldenHarness.py --update runs these on the synthetic capture to write the golden countyExtract
+records and block tallies, so that the harness checks the current pipeline against the original
+behavior rather than against a snapshot of itself. The method bodies are copied unchanged, except
+that tqdm is imported lazily like in TweetDataFrame.py; do not edit them to follow later changes.
+'''
+
+import re
+import os
+import json
+from datetime import datetime, timedelta
+from lazyImports import lazyModule
+import TweetDataFrame
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+tqdm = lazyModule('tqdm')
+
+class BaselineTweetDF(TweetDataFrame.TweetDF):
+    '''
+    TweetDF with the original county extraction and block-by-block time tally.
+    '''
+    
+    def countyExtract(self):
+        '''
+        USAGE:
+        
+        Extracts a list of county codes for each tweet and distributes a single tally proportionally
+        between each associated county. Adds results to a list, which it then saves to a JSON file
+        self.countytallyfile. If no code can be found for a given tweet, the tweet is added to the list
+        with the label {datetime: {'null': 0}}.
+        
+        Usually, for each tweet sent from a county, that county gets one tally. Because of fuzziness 
+        built into the coordinates2politics algorithm (from datasciencetoolkit.org), however, some 
+        tweets are associated with multiple counties. Additionally, some tweets only broadcast
+        their geo-location at the state-level, so there is ambiguity across the entire state as to 
+        which county the tweet was sent from. In these multi-county cases, the tally of each tweet is
+        divided proportionally among all the associated counties according to population (e.g., 
+        if a tweet is associated with 2 counties where County A normaly has a population of 30 and 
+        County B normally has population of 70, County A receives 3/10 of a tally and County B receives 
+        7/10 of a tally.
+        
+        If the tweet location has only state-level precision, codes for every county in the state are 
+        retrieved from "state_file". If the tweet location has point-precision, this method extracts 
+        the corresponding county code from the revgeodata file when possible. If the county code is not 
+        available, the value None is given. If multiple county codes are found in the "revgeodata" file 
+        for a tweet (due to a nearness of the considered coordinate to a county border), all codes are 
+        collected. When finished extracting, county codes are saved to "countytallyfile" along with
+        their share of a tally value and added to the tweet dataframe.
+
+        If the tweet county code file already exists, the extraction process is bypassed and codes are 
+        added directly to the tweet dataframe from the county code file. 
+        '''
+        
+        if 'CountyCode' in self.df.keys():
+            print('No action: County codes already added to dataframe')
+        
+        else:
+            
+            if os.path.exists(self.countytallyfile):
+                print('Loading tweet county codes and tally distributions from "%s"...' % self.countytallyfile)
+                with open(self.countytallyfile, 'r') as cf:
+                    counties = json.load(cf)
+            
+            else:
+                
+                ##### --------------------------------- Helper Function --------------------------------- #####
+                
+                def calculateTallies(codes):
+                    '''
+                    USAGE: Calculate appropriate tally distribution across a list of county codes.
+                    ARGUMENTS: codes - list of 5-digit CountyCode strings "#####"
+                    RETURNS: codetallydict - dictionary of {"code": tally} pairs
+                    '''
+
+                    codetallydict = {}
+
+                    if codes and codes not in [[None],[]]:
+                        if len(codes) == 1:
+                            codetallydict[codes[0]] = 1
+                        else:
+                            df = cd_df[cd_df['fips'].isin(codes)]  # Create a smaller dataframe with just info on codes
+                            pops = pd.to_numeric(df['POP'])        # series of population counts
+                            tot = pops.sum()                       # combined population of all counties in series
+
+                            codetallydict = dict(zip(list(df['fips']), list(pops/tot)))
+
+                    else:
+                        codetallydict = {None: 0}
+
+                    return codetallydict
+                
+                ##### ---------------------------------- Control Flow ---------------------------------- #####
+                
+                if not os.path.exists(self.censusdatafile):
+                    self.getCensusData()
+                
+                # Load census data for county population reference
+                print('Loading "%s"...' % self.censusdatafile)
+                with open(self.censusdatafile, 'r') as cdf:  
+                    censusdata = json.load(cdf)
+                cd_df = pd.DataFrame(censusdata[1:])
+                cd_df.columns = censusdata[0]
+                cd_df['fips'] = cd_df['state'] + cd_df['county']
+                cd_df = cd_df[['POP','state','fips']]
+                
+                # Load reverse geocoding file for county code extraction
+                print('Loading "%s"...' % self.revgeofile)
+                with open(self.revgeofile, 'r') as fp:
+                    revgeodata = fp.read();
+                rgddf = pd.DataFrame(json.loads(revgeodata))
+                del rgddf['location']
+
+                counties = []
+                printer = False # Set to True for feedback on the presence or absence of codes during extraction.
+                
+                if 'State' not in self.df.keys():
+                    self.stateNoState()
+                
+                state = list(self.df['State'])    
+                
+                print('Extracting county codes and calculating tally distributions...')
+                
+                for idx in tqdm.tqdm(range(len(rgddf['politics']))):
+                    
+                    timestamp = str(self.df['Datetime'][idx])
+                    
+                    try:
+
+                        # If better than state-level precision, then...
+                        if not state[idx]: 
+                            codes = list(pd.DataFrame(rgddf['politics'][idx])['code'])
+                            codes = [''.join(code.split('_')) for code in codes if re.match(r'^\d\d_\d\d\d$', code)]
+                            if not codes:
+                                codes = [None]
+
+                        else:
+                            state_code = state[idx]
+                            fips = cd_df[cd_df['state'] == state_code]['fips']
+                            codes = list(fips)
+
+                        codetallydict = calculateTallies(codes)
+                        counties.append({timestamp: codetallydict})
+
+                    except:
+                        if printer:
+                            print('%d - No codes found: "%s"' % (idx, rgddf['politics'][idx]))
+
+                        self.no_code.append(idx)
+                        counties.append({timestamp: {'null':0}})
+                    
+                print('Saving county codes and tally distributions to "%s"...' % self.countytallyfile)
+                
+                with open(self.countytallyfile, 'w') as cf:
+                    json.dump(counties, cf)
+                    
+                print('County codes and tally distributions saved to "%s".' % self.countytallyfile)
+                        
+            self.df['CountyCode'] = counties
+            print('County codes and tally distributions added to tweet dataframe.')
+
+    def timeTally(self, increment, block_length, t0=False):
+        '''
+        USAGE: 
+        Create a dictionary and dataframe of tally counts per county such that tweets tallies
+        are added up within a specified-length block of time, which is shifted in fixed
+        increments forward in time. This generates a time-averaged movie of Twitter activity,
+        where each frame of the movie represents tally data from a single time block.
+        
+        ARGUMENTS:
+        increment - length of time between consecutive time blocks (in minutes)
+        block_length - length (>= dt) of time block (in minutes)
+        t0 - optional: desired datetime-formatted start-time of initial time block
+
+        RETURNS:
+        county_tally - master tally dictionary containing {"CountyCode": 
+            np.array([Tally, ... , Tally])} pairs
+
+        '''
+
+        ##### ---------------------------- Helper Functions ---------------------------- #####
+
+        def str2date(datetime_string):
+            '''
+            USAGE: Turn a specifically formatted string into a datetime object
+            ARGUMENT: datetime_string - (YY-mm-DD HH:MM:SS)-formatted string
+            RETURNS: date - datetime formatted object
+            '''
+            date = datetime.strptime(datetime_string, '%Y-%m-%d %H:%M:%S')
+            return date
+
+        def getBlock(t):
+            '''
+            USAGE: 
+            Create a new dataframe which is a subset spanning a block of time in the original
+            dataframe. Specifically, for a given starting time t, return a dataframe with all 
+            the rows of df which have a datetime value between (t) and a later time
+            (t + deltaT).
+
+            ARGUMENT:
+            t - starting time of block
+
+            RETURNS:
+            timeblock - dataframe of {Datetime: {codetallydict}} pairs spanning a block of time
+            '''
+
+            timeblock = df[(df.Datetime >= t) & (df.Datetime < t + deltaT)]
+            return timeblock 
+
+        def blockTally(timeblock):
+            '''
+            USAGE:
+            For a given list of {Datetime: {codetallydict}} pairs, create a dictionary of
+            {"CountyCode": Tally} pairs by summing over all the tallies in 
+            codetallydict.
+
+            ARGUMENT:
+            timeblock - dataframe of {Datetime: {codetallydict}} pairs spanning a block of time
+
+            RETURNS:
+            block_tally - dictionary of {"CountyCode": Tally} pairs generated from values
+                within the input timeblock dataframe
+            '''
+
+            # Initialize all block county code tallies at 0
+            block_tally = dict.fromkeys(cd_list, 0)
+                        
+            for i in range(len(timeblock)):
+                codetallydict = timeblock.iloc[i].Codes
+                for code in codetallydict:
+                    if code != 'null':
+                        block_tally[code] += codetallydict[code]
+
+            return block_tally
+
+        def blockCombine(block_tally): ##### RESOLVED: PREVIOUS ISSUES APPENDING LISTS IN LOOP.
+            '''
+            USAGE:
+            Append the tally values within a time block to the master tally dictionary
+
+            ARGUMENT:
+            block_tally - dictionary of {"CountyCode": Tally} pairs generated by blockTally()
+            ------------------------
+            IMPORTANT NOTE:
+            I would have liked to implement this procedure by placing either of the two following
+            lines of code within the for-loop:
+
+                1. county_tally[c].append(block_tally[c])
+                2. county_tally[c] += [block_tally[c]]
+
+            For some reason I still cannot figure out, this actually appends the value of EVERY
+            key in the county_tally dictionary on each iteration so that by the end of the loop, 
+            each key in the dictionary has the SAME 3220-item list as its corresponding value...
+
+            The code I have actually written in this method appends each new tally value to the 
+            list of previously calculated tallies for ONLY the appropriate county code key. 
+            '''
+            
+            for c in self.county_tally:
+                self.county_tally[c] = self.county_tally[c] + [block_tally[c]]
+
+
+        ##### ------------------------------ Control Flow ------------------------------ #####
+
+        if not self.tallyframe.empty:
+            print('No action: Tally dataframe already populated.')
+            return
+
+        if 'CountyCode' not in self.df.keys():
+            self.countyExtract()
+        
+        self.time_params = '_d%s_delta%s' % (str(increment), str(block_length))
+        filename = self.timetallyroot.split('.')[0] + self.time_params + '.json'
+        
+        print('Loading tally data from "%s"...' % filename)
+        if os.path.exists(filename): # just load tally data from file
+            with open(filename, 'r') as f:
+                self.county_tally = json.load(f)
+            
+        else: # calculate tally data if there is not already a file
+            
+            if not os.path.exists(self.censusdatafile):
+                self.getCensusData()
+
+            # Load census data to get county code list
+            with open(self.censusdatafile, 'r') as cdf:
+                censusdata = json.load(cdf)
+            cd_df = pd.DataFrame(censusdata[1:])
+            cd_df.columns = censusdata[0]
+            cd_df['fips'] = cd_df['state'] + cd_df['county']
+            cd_list = list(cd_df['fips'])
+
+            # Load all tally data
+            with open(self.countytallyfile) as ccf:
+                codetallydata = json.load(ccf)
+
+            # Load tally data list into dataframe
+            k, v = [], []
+            for x in codetallydata:
+                key = list(x.keys())[0]
+                value = list(x.values())[0]
+                k.append(str2date(key))
+                v.append(value)
+            df = pd.DataFrame(np.array([k,v]).transpose(), columns = ['Datetime', 'Codes'])
+
+            # Initialize all county code tallies at []
+            self.county_tally = dict.fromkeys(cd_list,[])
+
+            # Format dt and deltaT as timedelta objects
+            dt = timedelta(0, increment*60)
+            deltaT = timedelta(0, block_length*60)
+
+            # Get start-time
+            if t0 == False:
+                t = df['Datetime'][0]
+            else:
+                t = t0
+            
+            print("Calculating block tallies...")
+            block_num = 0
+            while t + deltaT < df.Datetime.iloc[-1] or block_num < 1:
+                print(t)
+                timeblock = getBlock(t)
+                block_tally = blockTally(timeblock)
+                blockCombine(block_tally)
+                t += dt
+                block_num += 1
+
+            print("Tallies in all time blocks calculated.")
+
+            print("Writing tally data to file...")
+            with open(filename, 'w') as f:
+                json.dump(self.county_tally, f)
+            print('Tally data written to "%s"' % filename)  
+        
+        # Create tally dataframe from file
+        countytallylist = [[key, tlist] for key, tlist in self.county_tally.items()]
+        self.tallyframe = pd.DataFrame(countytallylist, columns=['CountyCode', 'Tally'])
+        print('Tally dataframe created with "CountyCode" and "Tally" columns.')
@@ -0,0 +1,500 @@
+'''
+Golden-output regression harness for the analysis pipeline of TweetDataFrame.py.
+
+A fixed synthetic capture (seeded random tweets around county centroids, including repeated
+places, state-level places, and country-level places that get thrown out) is run through the
+pipeline stages: loading, reverse geocoding (a synthetic offline geocoder behind the geocode
+cache), countyExtract(), timeTally() with every engine, and tally2value(). Each stage's output is
+compared within float tolerance to the golden artifacts in Resources/Golden/, written with --update.
+
+The golden countyExtract records and block tallies are written by the original implementation (a
+frozen copy of the original countyExtract and block-by-block timeTally, see goldenBaseline.py), so
+every engine is checked for equivalence with the original behavior. The current countyExtract gives
+a state-level tweet one tally under its state code instead of one share per county; its records
+are compared after spreading those over the state's counties (see expandStates). The golden
+tally2value() colors are a snapshot of the current code (engine "loop"); tally2value() is also
+rerun on the stored Resources/Tally/*.json files and compared to the stored Resources/Color/*.csv
+files written by the original code.
+
+Every stage is timed (time.perf_counter) and its peak Python memory is traced (tracemalloc;
+memory-mapped files are not counted), and everything is reported in one table, so the vectorized
+engines are validated and benchmarked against the loop engine in the same run:
+
+    python goldenHarness.py                  # check all engines against the golden artifacts
+    python goldenHarness.py --update         # rewrite the golden artifacts (original code + current colors)
+'''
+
+import os
+import io
+import glob
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import contextlib
+from lazyImports import lazyModule
+import TweetDataFrame
+import geocodeCache
+import HistogramAnalysis
+import tallyEngine
+import goldenBaseline
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+
+GOLDEN_DIR = 'Resources/Golden'         # directory of the golden artifacts
+GOLDEN_FILE = 'golden.npz'              # golden artifact file (see saveGolden)
+ENGINES = ('loop', 'sparse', 'memmap')  # timeTally engines checked
+REFERENCE = 'loop'                      # engine the golden colors are written from and timings are compared to
+PARAMS = {'tweets': 3000, 'places': 400, 'seed': 2017, 'increment': 10, 'block_length': 60}   # synthetic run parameters
+RTOL, ATOL = 1e-9, 1e-12                # float tolerance of all comparisons
+
+##### ------------------------------------ SYNTHETIC DATA ------------------------------------ #####
+
+def countyCentroids(countyarrivalfile):
+    '''
+    USAGE: Loads the county centroids of the county arrival file (see TweetDF.getCountyArrival), skipping counties without geometry.
+    RETURNS: codes - array of county codes; lonlat - (counties x 2) array of centroid coordinates
+    '''
+
+    ca_df = pd.read_csv(countyarrivalfile, dtype={'CountyCode': str}).dropna(subset=['LON', 'LAT'])
+    return ca_df['CountyCode'].values, ca_df[['LON', 'LAT']].values.astype(float)
+
+def syntheticCapture(capturefile, countyarrivalfile, state_file, censusdatafile, tweets=3000, places=400, seed=2017):
+    '''
+    USAGE:
+    Writes a reproducible synthetic capture file in the format of EclipseTracker.ipynb (concatenated
+    JSON records with "USER", "TEXT", "CREATED AT", and "PLACE"), with tweets between 15:00 and
+    20:00 UTC on 2017-08-21. Most tweets come from "places" city bounding boxes around county
+    centroids, drawn with a long-tailed popularity so that many tweets share a place; about 12%
+    only have state-level precision and about 3% only "United States" (which stateNoState()
+    throws out).
+
+    RETURNS: tweets - number of tweets written
+    '''
+
+    rng = np.random.default_rng(seed)
+    codes, lonlat = countyCentroids(countyarrivalfile)
+
+    with open(censusdatafile, 'r') as cdf:
+        censusstates = {row[-2] for row in json.load(cdf)[1:]}
+    state_df = pd.read_csv(state_file)
+    state_df['fips'] = state_df['fips_state'].map(lambda x: '%02d' % x)
+    state_df = state_df[state_df['fips'].isin(censusstates) & state_df['fips'].isin({c[:2] for c in codes})]
+    statecenters = [lonlat[[c[:2] == fips for c in codes]].mean(axis=0) for fips in state_df['fips']]
+    statenames = list(state_df['name'])
+
+    def bbox(lon, lat, half):
+        return [[[lon - half, lat - half], [lon - half, lat + half], [lon + half, lat + half], [lon + half, lat - half]]]
+
+    centers = rng.integers(0, len(codes), places)
+    halves = rng.uniform(0.02, 0.12, places)
+    offsets = rng.uniform(-0.05, 0.05, (places, 2))
+    popularity = 1 / np.arange(1, places + 1)
+
+    seconds = np.sort(rng.integers(0, 5 * 3600, tweets))
+    kind = rng.choice(['city', 'admin', 'country'], tweets, p=[0.85, 0.12, 0.03])
+    picks = rng.choice(places, tweets, p=popularity / popularity.sum())
+    statepicks = rng.integers(0, len(state_df), tweets)
+
+    with open(capturefile, 'w') as f:
+        for i in range(tweets):
+            if kind[i] == 'city':
+                n = picks[i]
+                lon, lat = lonlat[centers[n]] + offsets[n]
+                place = ['city', 'Place %d' % n, 'United States', bbox(lon, lat, halves[n])]
+            elif kind[i] == 'admin':
+                lon, lat = statecenters[statepicks[i]]
+                place = ['admin', '%s, USA' % statenames[statepicks[i]], 'United States', bbox(lon, lat, 1.5)]
+            else:
+                place = ['country', 'United States', 'United States', bbox(-98.5, 39.5, 20)]
+
+            h, m, s = seconds[i] // 3600 + 15, seconds[i] // 60 % 60, seconds[i] % 60
+            f.write(json.dumps({'USER': 'user%d' % rng.integers(0, tweets // 3), 'TEXT': 'eclipse tweet %d' % i,
+                                'CREATED AT': 'Mon Aug 21 %02d:%02d:%02d +0000 2017' % (h, m, s), 'PLACE': place}))
+
+    return tweets
+
+def syntheticGeocoder(countyarrivalfile, border=1.15):
+    '''
+    USAGE:
+    Creates an offline stand-in for the "Coordinates to Politics" API: each [LAT, LON] location is
+    given the county with the nearest centroid, plus the second-nearest county if that one is
+    almost as near (within a factor "border"), like the API does near county borders. A state
+    entry is included too, as in the API's answers.
+
+    RETURNS: geocoder - function taking a list of [LAT, LON] pairs and returning a list of results
+    '''
+
+    codes, lonlat = countyCentroids(countyarrivalfile)
+
+    def geocoder(coords):
+        latlon = np.asarray(coords, dtype=float)
+        dx = (lonlat[None, :, 0] - latlon[:, None, 1]) * np.cos(np.radians(latlon[:, None, 0]))
+        dist = np.hypot(dx, lonlat[None, :, 1] - latlon[:, None, 0])
+        nearest = np.argsort(dist, axis=1)[:, :2]
+
+        results = []
+        for (lat, lon), (a, b), d in zip(coords, nearest, dist[np.arange(len(coords))[:, None], nearest]):
+            near = [a, b] if d[1] < border * d[0] else [a]
+            politics = [{'code': 'us%s' % codes[a][:2], 'type': 'admin4', 'friendly_type': 'state'}]
+            politics += [{'code': '%s_%s' % (codes[c][:2], codes[c][2:]), 'type': 'admin6', 'friendly_type': 'county'}
+                         for c in near]
+            results.append({'location': {'latitude': lat, 'longitude': lon}, 'politics': politics})
+        return results
+
+    return geocoder
+
+##### ------------------------------------- REPORTING ------------------------------------- #####
+
+class StageReport():
+    '''
+    Timing, peak memory, and golden-comparison results of every stage of one harness run.
+    '''
+
+    def __init__(self, memory=True, verbose=False):
+        '''
+        Initialize StageReport object.
+
+        ARGUMENTS:
+        memory - if True, trace the peak Python memory of each stage (slows Python-heavy stages down)
+        verbose - if True, show the pipeline's own output
+        '''
+
+        self.memory = memory        # Whether to trace memory
+        self.verbose = verbose      # Whether to show pipeline output
+        self.rows = []              # One dictionary per stage
+
+    def run(self, stage, function, *args, **kwargs):
+        '''
+        USAGE: Runs one stage, recording its wall-clock time and peak traced memory.
+        RETURNS: the stage function's return value
+        '''
+
+        sink = contextlib.ExitStack()
+        if not self.verbose:
+            sink.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            sink.enter_context(contextlib.redirect_stderr(io.StringIO()))
+        if self.memory:
+            tracemalloc.start()
+
+        tic = time.perf_counter()
+        try:
+            with sink:
+                result = function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - tic
+            peak = tracemalloc.get_traced_memory()[1] / 1e6 if self.memory else None
+            if self.memory:
+                tracemalloc.stop()
+
+        self.rows.append({'stage': stage, 'seconds': seconds, 'peak_mb': peak, 'max_diff': None, 'ok': None})
+        return result
+
+    def check(self, actual, expected):
+        '''
+        USAGE: Compares the last stage's output array to its golden array within tolerance.
+        RETURNS: ok - True if the arrays have the same shape and match
+        '''
+
+        row = self.rows[-1]
+        actual, expected = np.asarray(actual, dtype=float), np.asarray(expected, dtype=float)
+        if actual.shape != expected.shape:
+            row['max_diff'], row['ok'] = float('inf'), False
+        else:
+            row['max_diff'] = float(np.nanmax(np.abs(actual - expected), initial=0))
+            row['ok'] = bool(np.allclose(actual, expected, RTOL, ATOL, equal_nan=True))
+        return row['ok']
+
+    def failed(self):
+        return [row['stage'] for row in self.rows if row['ok'] is False]
+
+    def __str__(self):
+        times = {row['stage']: row['seconds'] for row in self.rows}
+        lines = ['%-38s %9s %9s %8s %10s  %s' % ('stage', 'seconds', 'peak MB', 'vs ' + REFERENCE, 'max diff', 'golden')]
+        for row in self.rows:
+            stage, _, engine = row['stage'].rstrip(']').partition('[')
+            reference = times.get('%s[%s]' % (stage, REFERENCE)) if engine in ENGINES else None
+            lines.append('%-38s %9.3f %9s %8s %10s  %s' % (
+                row['stage'], row['seconds'],
+                '-' if row['peak_mb'] is None else '%.1f' % row['peak_mb'],
+                '%.1fx' % (reference / row['seconds']) if reference and row['seconds'] else '-',
+                '-' if row['max_diff'] is None else '%.1e' % row['max_diff'],
+                {True: 'ok', False: 'FAIL', None: '-'}[row['ok']]))
+        return '\n'.join(lines)
+
+    def save(self, reportfile):
+        with open(reportfile, 'w') as f:
+            json.dump({'params': PARAMS, 'stages': self.rows}, f, indent=1)
+
+##### ------------------------------------- COMPARISON ------------------------------------- #####
+
+def flattenExtract(records):
+    '''
+    USAGE: Flattens countyExtract() records into comparable arrays (same structure -> same keys, in code order).
+    RETURNS: keys - list of "index|timestamp|code" strings; shares - array of tally shares
+    '''
+
+    keys, shares = [], []
+    for i, record in enumerate(json.loads(json.dumps(records))): # as saved to JSON (None -> "null")
+        for stamp, codetallydict in record.items():
+            for code, share in sorted(codetallydict.items()):
+                keys.append('%d|%s|%s' % (i, stamp, code))
+                shares.append(share)
+    return keys, np.array(shares, dtype=float)
+
+def expandStates(records, censusdatafile, universe):
+    '''
+    USAGE:
+    Spreads the state-level entries of countyExtract() records ({"state": 1}) over the state's
+    counties by population (see tallyEngine.stateWeights), as the original countyExtract did.
+    '''
+
+    counties = tallyEngine.stateCounties(*tallyEngine.stateWeights(censusdatafile, universe), universe)
+    expanded = []
+    for record in records:
+        expanded.append({})
+        for stamp, codetallydict in record.items():
+            expanded[-1][stamp] = {}
+            for code, share in codetallydict.items():
+                for county, weight in counties.get(code, {code: 1}).items():
+                    expanded[-1][stamp][county] = share * weight
+    return expanded
+
+def frameArrays(tallyframe, universe):
+    '''
+    USAGE: Extracts the "Tally" and "Value" arrays of a tally dataframe (after tally2value) in universe order.
+    '''
+
+    tf = tallyframe.drop_duplicates('CountyCode').set_index('CountyCode').reindex(universe)
+    return np.array(list(tf['Tally']), dtype=float), np.array(list(tf['Value']), dtype=float)
+
+def loadGolden(goldenfile):
+    '''
+    USAGE: Loads the golden artifacts.
+    RETURNS: golden - dictionary with "params", "records", "universe", "tally", "value", and "mincolor"
+    '''
+
+    with np.load(goldenfile) as npz:
+        golden = {key: npz[key] for key in npz.files}
+    golden['params'] = json.loads(str(golden['params']))
+    golden['records'] = json.loads(str(golden['records']))
+    golden['universe'] = golden['universe'].tolist()
+    return golden
+
+def saveGolden(goldenfile, records, universe, tally, value, mincolor):
+    '''
+    USAGE: Saves the golden artifacts (compressed arrays, with the countyExtract records and run parameters as JSON).
+    '''
+
+    os.makedirs(os.path.dirname(goldenfile), exist_ok=True)
+    np.savez_compressed(goldenfile, params=json.dumps(PARAMS), records=json.dumps(records), universe=np.array(universe),
+                        tally=tally, value=value, mincolor=mincolor)
+
+##### --------------------------------------- STAGES --------------------------------------- #####
+
+def runPipeline(report, workdir, engines=ENGINES, golden=None):
+    '''
+    USAGE:
+    Runs the synthetic capture through every pipeline stage, comparing each output to the golden
+    artifacts when given.
+
+    ARGUMENTS:
+    report - StageReport to record the stages in
+    workdir - directory for the run's files
+    engines - timeTally engines to run
+    golden - optional: golden artifacts (see loadGolden)
+
+    RETURNS:
+    outputs - dictionary with the run's "records", "universe", and per engine {"tally", "value", "mincolor"}
+    '''
+
+    # Import the heavy libraries up front, so that their import time is not charged to the first stage using them
+    for module in (np, pd, tallyEngine.sparse, TweetDataFrame.tqdm):
+        getattr(module, '__name__')
+
+    TDF = TweetDataFrame.TweetDF
+    capturefile = os.path.join(workdir, 'capture.json')
+    report.run('capture', syntheticCapture, capturefile, TDF.countyarrivalfile, TDF.state_file, TDF.censusdatafile,
+               PARAMS['tweets'], PARAMS['places'], PARAMS['seed'])
+
+    t = TDF(capturefile)
+    t.revgeofile = os.path.join(workdir, 'revgeodata.json')
+    t.countytallyfile = os.path.join(workdir, 'countytallydata.json')
+
+    def load():
+        t.tweetfile2df()
+        t.mkDatetime()
+        t.stateNoState()
+        t.avgLONLAT()
+        t.listLATLON()
+    report.run('load', load)
+
+    def geocode():
+        cache = geocodeCache.GeocodeCache()
+        response = cache.lookup(list(t.df['listLATLON']), syntheticGeocoder(TDF.countyarrivalfile), 500)
+        with open(t.revgeofile, 'w') as rf:
+            json.dump(response, rf)
+        print('Geocode cache: %s.' % cache)
+    report.run('geocode', geocode)
+
+    report.run('countyExtract', t.countyExtract)
+    outputs = {'universe': t.getCountyUniverse()}
+    outputs['records'] = expandStates(list(t.df['CountyCode']), TDF.censusdatafile, outputs['universe'])
+    if golden:
+        keys, shares = flattenExtract(outputs['records'])
+        goldkeys, goldshares = flattenExtract(golden['records'])
+        report.check(shares if keys == goldkeys else [], goldshares)
+
+    for engine in engines:
+        t.tallyframe, t.county_tally = pd.DataFrame([]), {}
+        t.timetallyroot = os.path.join(workdir, engine, 'timetallydata.json')
+        t.countycolorroot = os.path.join(workdir, engine, 'countycolordata.csv')
+        os.makedirs(os.path.join(workdir, engine), exist_ok=True)
+
+        report.run('timeTally[%s]' % engine, t.timeTally, PARAMS['increment'], PARAMS['block_length'], engine=engine)
+        tally = np.array(list(t.tallyframe.set_index('CountyCode').reindex(outputs['universe'])['Tally']), dtype=float)
+        if golden:
+            report.check(tally, golden['tally'])
+
+        def color():
+            t.getCountyPop()
+            t.tally2value()
+        report.run('tally2value[%s]' % engine, color)
+        value = frameArrays(t.tallyframe, outputs['universe'])[1]
+        if golden:
+            report.check(np.append(value.ravel(), t.mincolor), np.append(golden['value'].ravel(), golden['mincolor']))
+
+        outputs[engine] = {'tally': tally, 'value': value, 'mincolor': t.mincolor}
+
+    return outputs
+
+def runBaseline(report, workdir, outputs):
+    '''
+    USAGE:
+    Runs the original countyExtract() and block-by-block timeTally() (see goldenBaseline.py) on the
+    capture and geocoding results of runPipeline() in workdir, and compares the pipeline's outputs
+    (records and the tallies of engine REFERENCE) to them.
+
+    RETURNS:
+    baseline - dictionary with the original "records" and "tally" (counties in universe order x blocks)
+    '''
+
+    basedir = os.path.join(workdir, 'baseline')
+    os.makedirs(basedir, exist_ok=True)
+
+    t = goldenBaseline.BaselineTweetDF(os.path.join(workdir, 'capture.json'))
+    t.revgeofile = os.path.join(workdir, 'revgeodata.json')
+    t.countytallyfile = os.path.join(basedir, 'countytallydata.json')
+    t.timetallyroot = os.path.join(basedir, 'timetallydata.json')
+    def load():
+        t.tweetfile2df()
+        t.mkDatetime()
+        t.stateNoState()
+    report.run('load[baseline]', load)
+
+    report.run('countyExtract[baseline]', t.countyExtract)
+    baseline = {'records': json.loads(json.dumps(list(t.df['CountyCode'])))}
+    keys, shares = flattenExtract(outputs['records'])
+    basekeys, baseshares = flattenExtract(baseline['records'])
+    report.check(shares if keys == basekeys else [], baseshares)
+
+    report.run('timeTally[baseline]', t.timeTally, PARAMS['increment'], PARAMS['block_length'])
+    blocks = len(t.tallyframe['Tally'].iloc[0])
+    tally = t.tallyframe.set_index('CountyCode')['Tally'].reindex(outputs['universe'])
+    baseline['tally'] = np.array([tlist if isinstance(tlist, list) else [0] * blocks for tlist in tally], dtype=float)
+    report.check(outputs[REFERENCE]['tally'], baseline['tally'])
+
+    return baseline
+
+def runResources(report, workdir, tallyroot='Resources/Tally/timetallydata.json', colorroot='Resources/Color/countycolordata.csv'):
+    '''
+    USAGE:
+    Reruns tally2value() on every stored tally file that has a stored color file with the same
+    time parameters, and compares the resulting tallies and color values to the stored ones.
+    '''
+
+    tallypattern = os.path.splitext(tallyroot)[0] + '_*.json'
+    for timetallyfile in sorted(glob.glob(tallypattern)):
+        time_params = os.path.splitext(timetallyfile)[0][len(os.path.splitext(tallyroot)[0]):]
+        countycolorfile = os.path.splitext(colorroot)[0] + time_params + '.csv'
+        if not os.path.exists(countycolorfile):
+            continue
+
+        t = TweetDataFrame.TweetDF(None)
+        t.countycolorroot = os.path.join(workdir, 'countycolordata.csv')
+        t.time_params = time_params
+        with open(timetallyfile, 'r') as f:
+            t.county_tally = json.load(f)
+        t.tallyframe = pd.DataFrame(list(t.county_tally.items()), columns=['CountyCode', 'Tally'])
+
+        def color():
+            t.getCountyPop()
+            t.tally2value()
+        report.run('tally2value[Resources%s]' % time_params, color)
+
+        codes, tally, value, _ = HistogramAnalysis.loadColor(countycolorfile)
+        newtally, newvalue = frameArrays(t.tallyframe, codes)
+        report.check(np.concatenate([newtally, newvalue], axis=1), np.concatenate([tally, value], axis=1))
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Check pipeline stages against golden outputs, with timing and memory per stage.')
+    parser.add_argument('--update', action='store_true', help='rewrite the golden artifacts (records and tallies from the original code, colors from the %s engine)' % REFERENCE)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES, help='timeTally engines to run')
+    parser.add_argument('--golden', default=os.path.join(GOLDEN_DIR, GOLDEN_FILE), help='golden artifact file')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace memory (faster)')
+    parser.add_argument('--no-resources', action='store_true', help='skip the check against Resources/Tally and Resources/Color')
+    parser.add_argument('--report', metavar='REPORTFILE', help='also save the report as JSON')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory of the run')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the pipeline stages')
+    args = parser.parse_args(argv)
+
+    golden = None
+    if not args.update:
+        if not os.path.exists(args.golden):
+            print('No golden artifacts in "%s" (create them with --update).' % args.golden)
+            return 1
+        golden = loadGolden(args.golden)
+        if golden['params'] != PARAMS:
+            print('Golden artifacts in "%s" were made with other parameters (%s); rerun with --update.' % (args.golden, golden['params']))
+            return 1
+    elif REFERENCE not in args.engines:
+        args.engines.insert(0, REFERENCE)
+
+    workdir = tempfile.mkdtemp(prefix='golden_')
+    report = StageReport(memory=not args.no_memory, verbose=args.verbose)
+    try:
+        outputs = runPipeline(report, workdir, args.engines, golden)
+        if args.update:
+            baseline = runBaseline(report, workdir, outputs)
+        if not args.no_resources:
+            runResources(report, workdir)
+    finally:
+        if args.keep:
+            print('Working files kept in "%s".' % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(report)
+    if args.report:
+        report.save(args.report)
+        print('Report saved to "%s".' % args.report)
+
+    if args.update:
+        reference = outputs[REFERENCE]
+        saveGolden(args.golden, baseline['records'], outputs['universe'], baseline['tally'], reference['value'], reference['mincolor'])
+        print('Golden artifacts saved to "%s".' % args.golden)
+
+    failed = report.failed()
+    if failed:
+        print('%d stages do not match: %s' % (len(failed), ', '.join(failed)))
+        return 1
+    print('All checked stages match.')
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+'''
+Helpers for deferring the import of heavy libraries (pandas, numpy, matplotlib, requests, ...)
+until they are actually used, and for measuring how long importing a module takes. Short-lived
+worker processes that only run one stage of the pipeline should not pay for libraries that stage
+never touches.
+'''
+
+import importlib    # for importing modules on demand
+import subprocess   # for timing imports in a fresh interpreter
+import sys          # for checking which modules are already imported
+
+class LazyModule():
+    '''
+    Stand-in for a module which is only imported the first time one of its attributes is accessed.
+
+    EXAMPLE:
+    np = LazyModule('numpy')   # nothing is imported yet
+    np.zeros(3)                # numpy is imported here, then np.zeros is looked up
+    '''
+
+    def __init__(self, name):
+        '''
+        Initialize LazyModule object.
+        '''
+
+        self.__dict__['_name'] = name       # Full dotted name of the module to import
+        self.__dict__['_module'] = None     # Imported module (None until first use)
+
+    def _load(self):
+        '''
+        USAGE: Imports the wrapped module if it has not been imported yet, and returns it.
+        '''
+
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not yet loaded'
+        return "<lazy module '%s' (%s)>" % (self._name, state)
+
+def lazyModule(name):
+    '''
+    USAGE: Returns a LazyModule for "name" (or the module itself, if it has already been imported).
+    ARGUMENTS: name - full dotted name of module, e.g. "pandas" or "scipy.spatial"
+    RETURNS: module or LazyModule stand-in
+    '''
+
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+def importTime(module, repeat=5):
+    '''
+    USAGE:
+    Measures the cumulative time (in milliseconds) needed to import "module" in a fresh Python
+    interpreter, using the interpreter's own "-X importtime" instrumentation. Interpreter startup
+    is not included. The best of "repeat" runs is returned, to filter out disk-cache noise.
+
+    ARGUMENTS:
+    module - name of module to import
+    repeat - number of fresh interpreters to time
+
+    RETURNS:
+    best - best cumulative import time (ms)
+    '''
+
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode != 0:
+            raise ImportError('Could not import "%s":\n%s' % (module, proc.stderr))
+
+        # Lines look like "import time:       266 |       6662 |   tqdm" (self, cumulative in us)
+        for line in proc.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1]) / 1000
+                if best is None or cumulative < best:
+                    best = cumulative
+    return best
+
+def heavyModules(module):
+    '''
+    USAGE: Lists which of the pipeline's heavy libraries get imported as a side effect of importing "module".
+    RETURNS: loaded - list of heavy library names pulled in by the import
+    '''
+
+    heavy = ['numpy', 'pandas', 'scipy', 'matplotlib', 'requests', 'tqdm', 'pyarrow', 'PIL']
+    code = 'import sys, %s; print(",".join(m for m in %r if m in sys.modules))' % (module, heavy)
+    proc = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True)
+    return [m for m in proc.stdout.strip().split(',') if m]
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main():
+    modules = sys.argv[1:] or ['TweetDataFrame', 'totalityNASA2JSON', 'HistogramAnalysis']
+    print('%-20s %12s   %s' % ('Module', 'Import (ms)', 'Heavy libraries imported'))
+    for module in modules:
+        print('%-20s %12.1f   %s' % (module, importTime(module), ', '.join(heavyModules(module)) or '-'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+'''
+Bulk distance, inside/outside, and timing features of points relative to the path of totality
+(see eclipsePath.py). Every function here works on whole arrays of points at once, so millions of
+tweets can be processed without any per-tweet Python code.
+'''
+
+from lazyImports import lazyModule
+import eclipsePath
+import countyGeometry
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+mplpath = lazyModule('matplotlib.path')
+
+EARTH_RADIUS = 6371.0       # mean radius of the Earth (km)
+PENUMBRA_FALLOFF = 3200.0   # distance (km) beyond the edge of totality at which obscuration reaches 0
+
+def haversine(lon1, lat1, lon2, lat2):
+    '''
+    USAGE: Great-circle distance (km) between arrays of points given in degrees.
+    '''
+
+    lon1, lat1, lon2, lat2 = [np.radians(x) for x in (lon1, lat1, lon2, lat2)]
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def segmentDistance(lon, lat, alon, alat, blon, blat):
+    '''
+    USAGE:
+    Distance from points to line segments (A, B), measured in a local equirectangular plane around
+    each point. All arguments are broadcastable arrays of degrees.
+
+    RETURNS:
+    distance - approximate distance (km) from each point to its segment
+    frac - position of the foot of the perpendicular along each segment (0 at A, 1 at B)
+    '''
+
+    coslat = np.cos(np.radians(lat))
+    ax, ay = ((alon - lon + 180) % 360 - 180) * coslat, alat - lat     # wrap across the antimeridian
+    dx, dy = ((blon - alon + 180) % 360 - 180) * coslat, blat - alat
+    seglen2 = dx**2 + dy**2
+    frac = np.clip(-(ax * dx + ay * dy) / np.where(seglen2 > 0, seglen2, 1), 0, 1)
+    distance = np.radians(np.hypot(ax + frac * dx, ay + frac * dy)) * EARTH_RADIUS
+    return distance, frac
+
+class PathIndex():
+    '''
+    Spatial index over the central line and region of totality of an eclipse path.
+
+    The central line is a polyline with one segment per row interval of the NASA table (points
+    interpolated in between lie on the same straight segments, so they add no geometry). A uniform
+    lon/lat grid is laid over the map, and for each grid cell the index stores the few segments
+    which can contain the nearest point for some location in that cell. A query then looks up each
+    point's cell and only measures the distance to that cell's candidate segments.
+    '''
+
+    def __init__(self, path, cell=0.5, extent=(-180, 15, -60, 75)):
+        '''
+        Initialize PathIndex object.
+
+        ARGUMENTS:
+        path - path dictionary (see eclipsePath.py) or name of a NASA eclipse path file
+        cell - size of grid cells (degrees)
+        extent - (west, south, east, north) bounds of the grid (degrees); points outside of it are
+            compared against every segment
+        '''
+
+        if isinstance(path, str):
+            path = eclipsePath.parseNASAPath(path)
+
+        self.path = path                                    # Path dictionary as tabulated
+        self.lon = path['CLon']                             # Central line vertex longitudes
+        self.lat = path['CLat']                             # Central line vertex latitudes
+        self.time = path['Time']                            # Central line vertex times (s after 00:00 UTC)
+        self.cell = cell                                    # Grid cell size (degrees)
+        self.extent = extent                                # Grid bounds (degrees)
+        self.shape = (int(np.ceil((extent[3] - extent[1]) / cell)), int(np.ceil((extent[2] - extent[0]) / cell)))
+        self.candidates = self.buildGrid()                  # (cells x K) candidate segments, padded with -1
+
+        # Region of totality: northern limit forward, southern limit back (as in eclipseGeoJSON.json)
+        ring = np.concatenate([np.column_stack([path['NLon'], path['NLat']]),
+                               np.column_stack([path['SLon'], path['SLat']])[::-1],
+                               [[path['NLon'][0], path['NLat'][0]]]])
+        self.polygon = mplpath.Path(ring)
+
+    def buildGrid(self):
+        '''
+        USAGE:
+        For every grid cell, finds the segments that may hold the nearest central line point for some
+        location inside the cell. A segment qualifies if its distance from the cell center is within
+        one cell diagonal of the distance to the closest segment (plus 1% slack for the planar
+        approximation), since no point in the cell is more than half a diagonal from its center.
+
+        RETURNS:
+        candidates - (cells x K) array of segment indices, padded with -1
+        '''
+
+        rows, cols = self.shape
+        clat = self.extent[1] + self.cell * (np.arange(rows) + 0.5)
+        clon = self.extent[0] + self.cell * (np.arange(cols) + 0.5)
+        clon, clat = [x.ravel()[:, None] for x in np.meshgrid(clon, clat)]
+
+        dist, _ = segmentDistance(clon, clat, self.lon[:-1], self.lat[:-1], self.lon[1:], self.lat[1:])
+        diagonal = np.radians(self.cell * np.sqrt(2)) * EARTH_RADIUS
+        keep = dist <= dist.min(axis=1, keepdims=True) * 1.01 + diagonal
+
+        # Pack each row's qualifying segments to the left, padded with -1
+        K = keep.sum(axis=1).max()
+        order = np.argsort(~keep, axis=1, kind='stable')[:, :K]
+        return np.where(np.take_along_axis(keep, order, axis=1), order, -1)
+
+    def nearest(self, lon, lat, chunk=100000):
+        '''
+        USAGE:
+        Finds the nearest point on the central line for each of a set of points.
+
+        ARGUMENTS:
+        lon, lat - arrays of point coordinates (degrees)
+        chunk - number of points processed per pass (bounds temporary memory)
+
+        RETURNS:
+        distance - array of great-circle distances (km) to the central line
+        time - array of times (s after 00:00 UTC) at which the shadow axis passes the nearest point
+        '''
+
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        distance = np.empty(len(lon))
+        time = np.empty(len(lon))
+
+        row = np.floor((lat - self.extent[1]) / self.cell).astype(int)
+        col = np.floor((lon - self.extent[0]) / self.cell).astype(int)
+        ingrid = (row >= 0) & (row < self.shape[0]) & (col >= 0) & (col < self.shape[1])
+        cellid = np.where(ingrid, row * self.shape[1] + col, -1)
+
+        # Points off the grid are compared against every segment
+        everything = np.arange(len(self.lon) - 1)
+        for idx in [np.flatnonzero(ingrid), np.flatnonzero(~ingrid)]:
+            for start in range(0, len(idx), chunk):
+                sub = idx[start:start + chunk]
+                if ingrid[sub[0]]:
+                    seg = self.candidates[cellid[sub]]
+                else:
+                    seg = np.broadcast_to(everything, (len(sub), len(everything)))
+                distance[sub], time[sub] = self.nearestAmong(lon[sub], lat[sub], seg)
+
+        return distance, time
+
+    def nearestAmong(self, lon, lat, seg):
+        '''
+        USAGE: Finds the nearest point on a given set of candidate segments for each point.
+        ARGUMENTS: lon, lat - arrays of n point coordinates; seg - (n x K) segment indices, padded with -1
+        RETURNS: distance, time - as in nearest()
+        '''
+
+        valid = seg >= 0
+        a = np.where(valid, seg, 0)
+        dist, frac = segmentDistance(lon[:, None], lat[:, None], self.lon[a], self.lat[a],
+                                     self.lon[a + 1], self.lat[a + 1])
+        best = np.argmin(np.where(valid, dist, np.inf), axis=1)[:, None]
+        a = np.take_along_axis(a, best, axis=1)[:, 0]
+        frac = np.take_along_axis(frac, best, axis=1)[:, 0]
+
+        plon = self.lon[a] + frac * (self.lon[a + 1] - self.lon[a])
+        plat = self.lat[a] + frac * (self.lat[a + 1] - self.lat[a])
+        return haversine(lon, lat, plon, plat), self.time[a] + frac * (self.time[a + 1] - self.time[a])
+
+    def obscuration(self, distance, time):
+        '''
+        USAGE:
+        Approximates the maximum fraction of the Sun's disk covered by the Moon at points a given
+        distance from the central line. The NASA path table only describes the umbra, so outside
+        the path of totality the obscuration is taken to fall off linearly with distance beyond the
+        path edge, reaching 0 at PENUMBRA_FALLOFF km (this matches the published 2017 maxima to a
+        few percent across the contiguous US, e.g. ~92% in Seattle and ~71% in New York City).
+
+        ARGUMENTS:
+        distance - array of distances (km) from the central line (see nearest)
+        time - array of times (s after 00:00 UTC) of closest approach (see nearest)
+
+        RETURNS:
+        obscuration - array of fractions between 0 and 1 (1 inside the path of totality)
+        '''
+
+        halfwidth = np.interp(time, self.time, self.path['Width']) / 2 if 'Width' in self.path else 0
+        return np.clip(1 - (distance - halfwidth) / PENUMBRA_FALLOFF, 0, 1)
+
+    def inside(self, lon, lat):
+        '''
+        USAGE: Returns a boolean array: True for each point inside the region of totality.
+        '''
+
+        points = np.column_stack([np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)])
+        return self.polygon.contains_points(points)
+
+    def features(self, lon, lat, times=None):
+        '''
+        USAGE:
+        Computes all path features for a set of points.
+
+        ARGUMENTS:
+        lon, lat - arrays of point coordinates (degrees)
+        times - optional: array of datetime64 values (UTC) at which each point was observed
+
+        RETURNS:
+        features - dictionary of arrays "PathDistance" (km), "InTotality" (bool), "TotalityTime"
+            (datetime64, when the shadow axis passes), and, if times are given, "TotalityOffset"
+            (s from local totality to the observation; negative before totality)
+        '''
+
+        distance, time = self.nearest(lon, lat)
+        features = {'PathDistance': distance, 'InTotality': self.inside(lon, lat)}
+        features['TotalityTime'] = eclipsePath.pathDatetimes({'Date': self.path['Date'], 'Time': time})
+
+        if times is not None:
+            offset = np.asarray(times, dtype='datetime64[ms]') - features['TotalityTime']
+            features['TotalityOffset'] = offset.astype('int64') / 1000
+
+        return features
+
+def countyArrival(topoJSONfile, totalityfile, universe=None):
+    '''
+    USAGE:
+    Builds a table of local eclipse circumstances for every county in a TopoJSON file, evaluated
+    at each county's centroid.
+
+    ARGUMENTS:
+    topoJSONfile - US county TopoJSON file (see countyGeometry.py)
+    totalityfile - NASA eclipse path file (see eclipsePath.py)
+    universe - optional: list of county codes to build the table over (see TweetDF.getCountyUniverse);
+        counties without geometry (e.g. those of Puerto Rico) get NaN and NaT values
+
+    RETURNS:
+    arrival - dataframe with columns "CountyCode", "LON", "LAT", "PathDistance" (km), "InTotality",
+        "Obscuration" (approximate maximum eclipse fraction), and "MaxEclipse" (UTC datetime at
+        which the shadow axis passes closest, i.e. approximately the time of maximum eclipse)
+    '''
+
+    ids, lon, lat = countyGeometry.countyCentroids(topoJSONfile)
+    index = PathIndex(totalityfile)
+    distance, time = index.nearest(lon, lat)
+
+    arrival = pd.DataFrame({'CountyCode': ids, 'LON': lon, 'LAT': lat, 'PathDistance': distance})
+    arrival['InTotality'] = index.inside(lon, lat)
+    arrival['Obscuration'] = np.where(arrival['InTotality'], 1.0, index.obscuration(distance, time))
+    arrival['MaxEclipse'] = eclipsePath.pathDatetimes({'Date': index.path['Date'], 'Time': time})
+    if universe is not None:
+        arrival = arrivalUniverse(arrival, universe)
+    return arrival
+
+def arrivalUniverse(arrival, universe):
+    '''
+    USAGE: Reindexes a county arrival table to a list of county codes (missing counties get NaN and NaT values).
+    '''
+
+    return arrival.drop_duplicates('CountyCode').set_index('CountyCode').reindex(universe).rename_axis('CountyCode').reset_index()
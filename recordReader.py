@@ -0,0 +1,124 @@
+'''
+Incremental reader for files of concatenated JSON records, like the tweet capture files written by
+EclipseTracker.ipynb (one json.dump() per tweet, with no separator) or newline-delimited JSON.
+
+The file is read in fixed-size chunks into a sliding text buffer, and each record is decoded in
+place with json.JSONDecoder.raw_decode(), so memory use is bounded by the chunk size plus the
+largest record rather than by the file size. A record that fails to decode is counted and skipped
+by resuming at the start of the next record.
+'''
+
+import codecs
+import json
+import time
+
+class RecordStats():
+    '''
+    Counters describing one pass of iterRecords() over a file.
+    '''
+
+    def __init__(self):
+        '''
+        Initialize RecordStats object.
+        '''
+
+        self.records = 0        # Number of records decoded
+        self.corrupt = 0        # Number of records skipped because they could not be decoded
+        self.bytes = 0          # Number of bytes read from disk
+        self.seconds = 0.0      # Wall-clock time spent reading and decoding
+
+    def throughput(self):
+        '''
+        USAGE: Returns the read throughput in MB/s.
+        '''
+
+        return self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return ('%d records decoded, %d corrupt records skipped, %.1f MB in %.2f s (%.1f MB/s)'
+                % (self.records, self.corrupt, self.bytes / 1e6, self.seconds, self.throughput()))
+
+def iterRecords(filepath, marker='{"USER"', chunksize=1 << 22, maxrecord=1 << 24, stats=None):
+    '''
+    USAGE:
+    Generator yielding each JSON object in a file of concatenated (or newline-delimited) records.
+
+    Records are located by "marker", the text each record starts with. json.dumps() escapes quotes
+    inside strings, so the marker cannot occur inside a valid record; a record is therefore known
+    to be complete (or corrupt) once the next marker is in the buffer, or at the end of the file.
+
+    ARGUMENTS:
+    filepath - location of the record file
+    marker - text at the start of every record (use '{' for arbitrary JSON objects)
+    chunksize - number of bytes read from disk at a time
+    maxrecord - records longer than this (in characters) are skipped as corrupt
+    stats - optional: RecordStats object to update with counts and throughput
+
+    YIELDS:
+    record - decoded JSON object (dict)
+    '''
+
+    stats = RecordStats() if stats is None else stats
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')(errors='replace')   # handles characters split across chunks
+    tic = time.perf_counter()
+
+    try:
+        with open(filepath, 'rb') as f:
+            buf = ''
+            pos = 0
+            eof = False
+
+            while True:
+                start = buf.find(marker, pos)
+                nxt = buf.find(marker, start + 1) if start >= 0 else -1
+
+                # Read more text until the current record is known to be complete
+                if not eof and (start < 0 or nxt < 0):
+                    if start < 0:
+                        buf = buf[max(len(buf) - len(marker), pos):]    # keep a possible partial marker
+                    elif len(buf) - start > maxrecord:
+                        stats.corrupt += 1                          # overlong record: drop it
+                        buf = buf[len(buf) - len(marker):]
+                    else:
+                        buf = buf[start:]
+                    pos = 0
+
+                    chunk = f.read(chunksize)
+                    stats.bytes += len(chunk)
+                    eof = not chunk
+                    buf += utf8.decode(chunk, final=eof)
+                    continue
+
+                if start < 0:       # end of file, and no further records
+                    break
+
+                try:
+                    record, end = decoder.raw_decode(buf, start)
+                    if not isinstance(record, dict) or (nxt >= 0 and end > nxt):
+                        raise ValueError('record overlaps the next record')
+
+                except ValueError:  # json.JSONDecodeError is a subclass of ValueError
+                    stats.corrupt += 1
+                    pos = nxt if nxt >= 0 else len(buf)
+                    continue
+
+                stats.records += 1
+                pos = end
+                yield record
+
+    finally:
+        stats.seconds += time.perf_counter() - tic
+
+##### ------------------------------------- MAIN ------------------------------------- #####
+
+def main():
+    import sys
+    for filepath in sys.argv[1:]:
+        stats = RecordStats()
+        for _ in iterRecords(filepath, stats=stats):
+            pass
+        print('%s: %s' % (filepath, stats))
+
+if __name__ == '__main__':
+    main()
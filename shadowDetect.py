@@ -0,0 +1,174 @@
+'''
+Anomaly detection over the (counties x blocks) tally matrix written by TweetDF.timeTally(), to
+find the "Twitter shadow": the wave of unusual tweet activity following the Moon's shadow.
+
+Each county's tallies are first turned into its share of all tweets in each time block, which
+removes the nationwide rise and fall of activity over the day. Every county is then compared
+with its own baseline share: shares are smoothed with a rolling window and converted into
+z-scores against the county's baseline mean and standard deviation. The block in which each
+county's z-score peaks estimates its peak-activity time, and the counties that are anomalous
+(or peak) in each block trace the shadow front across the map.
+
+All steps work on the whole matrix at once (cumulative sums for the rolling window, one argmax
+for the peaks, one matrix product for the front), so detection can be rerun cheaply for every
+tally configuration. Counties without known centroid coordinates (NaN) are never counted as
+detected, so they do not enter the shadow front.
+'''
+
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+
+def blockShares(tally):
+    '''
+    USAGE: Divides each block's tallies by the block's total, giving each county's share of the block.
+    RETURNS: shares - (counties x blocks) array (0 in blocks without tallies)
+    '''
+
+    total = tally.sum(axis=0, keepdims=True)
+    return np.divide(tally, total, out=np.zeros_like(tally, dtype=float), where=total > 0)
+
+def rollingMean(x, window):
+    '''
+    USAGE:
+    Centered moving average along the block axis, computed with one cumulative sum. Near the ends
+    of the series the window is truncated to the available blocks.
+
+    ARGUMENTS:
+    x - (counties x blocks) array
+    window - window length (blocks)
+
+    RETURNS:
+    smooth - (counties x blocks) array
+    '''
+
+    if window <= 1:
+        return x
+    blocks = x.shape[1]
+    csum = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(x, axis=1)], axis=1)
+    lo = np.clip(np.arange(blocks) - window // 2, 0, blocks)
+    hi = np.clip(lo + window, 0, blocks)
+    return (csum[:, hi] - csum[:, lo]) / (hi - lo)
+
+def countyBaselines(shares, baseline=None):
+    '''
+    USAGE: Calculates each county's baseline mean and standard deviation of its block shares.
+
+    ARGUMENTS:
+    shares - (counties x blocks) array (see blockShares)
+    baseline - optional: slice or boolean mask of the blocks to use as baseline (default: all)
+
+    RETURNS:
+    mu, sigma - arrays of per-county baseline mean and standard deviation
+    '''
+
+    base = shares if baseline is None else shares[:, baseline]
+    return base.mean(axis=1), base.std(axis=1)
+
+def zScores(tally, window=3, baseline=None):
+    '''
+    USAGE:
+    Calculates rolling z-scores of each county's block shares against its own baseline. The
+    standard deviation of a "window"-block mean is taken as sigma / sqrt(window). Counties
+    without variation in their baseline get a z-score of 0.
+
+    RETURNS:
+    z - (counties x blocks) array of z-scores
+    '''
+
+    shares = blockShares(np.asarray(tally, dtype=float))
+    mu, sigma = countyBaselines(shares, baseline)
+    sigma = sigma[:, None] / np.sqrt(max(window, 1))
+    return np.divide(rollingMean(shares, window) - mu[:, None], sigma,
+                     out=np.zeros(shares.shape), where=sigma > 0)
+
+def peakBlocks(z):
+    '''
+    USAGE:
+    Finds the block in which each county's z-score peaks, refined to a fraction of a block by
+    fitting a parabola through the peak and its two neighbours.
+
+    RETURNS:
+    peak - array of (fractional) peak block indices
+    zmax - array of peak z-scores
+    '''
+
+    rows = np.arange(z.shape[0])
+    best = np.argmax(z, axis=1)
+    zmax = z[rows, best]
+
+    left = z[rows, np.maximum(best - 1, 0)]
+    right = z[rows, np.minimum(best + 1, z.shape[1] - 1)]
+    curve = left - 2 * zmax + right
+    edge = (best == 0) | (best == z.shape[1] - 1)
+    shift = np.divide(left - right, 2 * curve, out=np.zeros(len(rows)), where=(curve < 0) & ~edge)
+    return best + np.clip(shift, -0.5, 0.5), zmax
+
+def shadowFront(z, peak, lon, lat, threshold=3.0, detected=None):
+    '''
+    USAGE:
+    Traces the Twitter shadow across the map, block by block.
+
+    ARGUMENTS:
+    z - (counties x blocks) array of z-scores (see zScores)
+    peak - array of peak block indices (see peakBlocks)
+    lon, lat - arrays of county centroid coordinates (degrees)
+    threshold - z-score above which a county is anomalous
+    detected - optional: boolean array of counties to consider (default: all with known coordinates)
+
+    RETURNS:
+    front - dataframe with one row per block: "Anomalous" (no. of counties with z >= threshold),
+        "LON"/"LAT" (z-weighted centroid of the anomalous counties), "Peaking" (no. of counties
+        whose activity peaks in the block), and "PeakLON"/"PeakLAT" (centroid of those counties)
+    '''
+
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    located = np.isfinite(lon) & np.isfinite(lat)
+    detected = located if detected is None else detected & located
+    lon, lat = lon[detected], lat[detected]
+
+    weight = np.where(z[detected] >= threshold, z[detected], 0)
+    wsum = weight.sum(axis=0)
+    front = pd.DataFrame({'Block': np.arange(z.shape[1]),
+                          'Anomalous': (weight > 0).sum(axis=0),
+                          'LON': np.divide(lon @ weight, wsum, out=np.full(len(wsum), np.nan), where=wsum > 0),
+                          'LAT': np.divide(lat @ weight, wsum, out=np.full(len(wsum), np.nan), where=wsum > 0)})
+
+    block = np.rint(peak[detected]).astype(int)
+    count = np.bincount(block, minlength=z.shape[1])
+    front['Peaking'] = count
+    front['PeakLON'] = np.divide(np.bincount(block, lon, z.shape[1]), count, out=np.full(len(count), np.nan), where=count > 0)
+    front['PeakLAT'] = np.divide(np.bincount(block, lat, z.shape[1]), count, out=np.full(len(count), np.nan), where=count > 0)
+    return front
+
+def detect(tally, lon, lat, window=3, baseline=None, threshold=3.0, mintally=10.0):
+    '''
+    USAGE:
+    Runs the full detection over a tally matrix.
+
+    ARGUMENTS:
+    tally - (counties x blocks) array of tallies
+    lon, lat - arrays of county centroid coordinates (degrees), in tally row order
+    window - rolling window length (blocks)
+    baseline - optional: slice or boolean mask of baseline blocks (default: all)
+    threshold - z-score above which a county is anomalous
+    mintally - minimum total tally for a county's peak to be counted as detected
+
+    RETURNS:
+    peaks - dataframe with one row per county: "PeakBlock" (fractional block index), "PeakZ",
+        "Total" (total tally), and "Detected" (known coordinates, enough tallies, PeakZ >= threshold,
+        and the peak not in the first or last block, where it may only be the edge of a trend)
+    front - dataframe with one row per block (see shadowFront), over the detected counties
+    '''
+
+    tally = np.asarray(tally, dtype=float)
+    z = zScores(tally, window, baseline)
+    peak, zmax = peakBlocks(z)
+    total = tally.sum(axis=1)
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    detected = (np.isfinite(lon) & np.isfinite(lat) & (total >= mintally) & (zmax >= threshold)
+                & (peak > 0) & (peak < tally.shape[1] - 1))
+
+    peaks = pd.DataFrame({'PeakBlock': peak, 'PeakZ': zmax, 'Total': total, 'Detected': detected})
+    return peaks, shadowFront(z, peak, lon, lat, threshold, detected)
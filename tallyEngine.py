@@ -0,0 +1,347 @@
+'''
+Vectorized tally engine: builds the (counties x blocks) tally matrix of TweetDF.timeTally() from
+the county tally records ({timestamp: {code: share}}, see TweetDF.countyExtract) in a few array
+passes, instead of slicing the tweets once per time block.
+
+Keys of the tally dictionaries are either 5-digit county codes or 2-digit state codes. A state
+code stands for one tally spread over every county of the state in proportion to population;
+these are accumulated per (state, block) and spread with a single sparse (states x counties)
+weight matrix product, rather than being expanded into one entry per county for every tweet.
+
+Every tweet contributes to a contiguous run of blocks (all blocks whose time window contains
+it), so tallies are added with difference arrays: +share at the first block of the run, -share
+after the last, followed by one cumulative sum along the block axis.
+
+For captures too large for memory, tallyMemmap() streams the records from disk in chunks (see
+iterTallyRecords) and adds each chunk's tallies into a memory-mapped matrix on disk.
+'''
+
+import json
+import codecs
+import itertools
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+sparse = lazyModule('scipy.sparse')
+
+def stateWeights(censusdatafile, universe):
+    '''
+    USAGE:
+    Builds the population weight matrix spreading one state-level tally over the state's counties,
+    using the same population shares as TweetDF.countyExtract().
+
+    ARGUMENTS:
+    censusdatafile - census data file written by TweetDF.getCensusData()
+    universe - list of county codes (columns of the matrix)
+
+    RETURNS:
+    states - sorted list of 2-digit state codes (rows of the matrix)
+    weights - (states x counties) scipy.sparse CSR matrix; each row sums to 1
+    '''
+
+    with open(censusdatafile, 'r') as cdf:
+        censusdata = json.load(cdf)
+    cd_df = pd.DataFrame(censusdata[1:], columns=censusdata[0])
+    cd_df['fips'] = cd_df['state'] + cd_df['county']
+    cd_df['POP'] = pd.to_numeric(cd_df['POP'])
+
+    position = {code: i for i, code in enumerate(universe)}
+    cd_df = cd_df[cd_df['fips'].isin(position)]
+    states = sorted(cd_df['state'].unique())
+    row = cd_df['state'].map({s: i for i, s in enumerate(states)}).values
+    share = (cd_df['POP'] / cd_df.groupby('state')['POP'].transform('sum')).values
+
+    weights = sparse.csr_matrix((share, (row, cd_df['fips'].map(position).values)), shape=(len(states), len(universe)))
+    return states, weights
+
+def stateCounties(states, weights, universe):
+    '''
+    USAGE: Expands a state weight matrix into {"state": {"CountyCode": share}} dictionaries.
+    '''
+
+    weights = weights.tocsr()
+    return {s: {universe[j]: w for j, w in zip(weights.indices[weights.indptr[i]:weights.indptr[i + 1]],
+                                                weights.data[weights.indptr[i]:weights.indptr[i + 1]])}
+            for i, s in enumerate(states)}
+
+def flattenRecords(records, universe, states):
+    '''
+    USAGE:
+    Flattens county tally records into parallel arrays, one entry per (tweet, code) pair.
+
+    ARGUMENTS:
+    records - list of {timestamp: {code: share}} dictionaries (see TweetDF.countyExtract)
+    universe - list of county codes
+    states - list of state codes
+
+    RETURNS:
+    times - array of tweet times (datetime64[ns]), one per record
+    tweet - array of record indices
+    row - array of rows: county positions in universe, or len(universe) + state position
+    share - array of tally shares
+    '''
+
+    position = {code: i for i, code in enumerate(universe)}
+    position.update({code: len(universe) + i for i, code in enumerate(states)})
+
+    stamps, tweet, row, share = [], [], [], []
+    for i, record in enumerate(records):
+        for stamp, codetallydict in record.items():
+            stamps.append(stamp)
+            for code, value in codetallydict.items():
+                if code in position and value:
+                    tweet.append(i)
+                    row.append(position[code])
+                    share.append(value)
+
+    times = pd.to_datetime(pd.Series(stamps), format='%Y-%m-%d %H:%M:%S').values.astype('datetime64[ns]')
+    return times, np.array(tweet, dtype=int), np.array(row, dtype=int), np.array(share, dtype=float)
+
+def blockCount(start, last, increment, block_length):
+    '''
+    USAGE:
+    Counts the time blocks TweetDF.timeTally() generates: blocks start every "increment" from
+    "start" for as long as the block ends before the last tweet, and there is always at least one.
+
+    ARGUMENTS:
+    start, last - datetime64 start of the first block and time of the last tweet
+    increment, block_length - block spacing and length (in minutes)
+    '''
+
+    dt = np.timedelta64(int(round(increment * 60e9)), 'ns')
+    span = (np.datetime64(last, 'ns') - np.datetime64(start, 'ns')) - np.timedelta64(int(round(block_length * 60e9)), 'ns')
+    return max(int(-(-span // dt)) if span > np.timedelta64(0, 'ns') else 0, 1)
+
+def blockRanges(times, start, increment, block_length, blocks):
+    '''
+    USAGE:
+    Finds the run of blocks containing each time: block k spans [start + k*increment,
+    start + k*increment + block_length), so a time t lies in blocks floor((t - start - block_length)
+    / increment) + 1 through floor((t - start) / increment). Integer nanoseconds keep the block
+    edges exact.
+
+    RETURNS:
+    lo, hi - arrays of first and last block indices (clipped to the blocks; lo > hi if none)
+    '''
+
+    dt = int(round(increment * 60e9))
+    deltaT = int(round(block_length * 60e9))
+    offset = (times.astype('datetime64[ns]') - np.datetime64(start, 'ns')).astype('int64')
+    hi = np.minimum(offset // dt, blocks - 1)
+    lo = np.maximum((offset - deltaT) // dt + 1, 0)
+    return lo, hi
+
+def tallyMatrix(records, universe, states, weights, increment, block_length, t0=None, tweetweights=None):
+    '''
+    USAGE:
+    Builds the tally matrix of TweetDF.timeTally() from county tally records.
+
+    ARGUMENTS:
+    records - list of {timestamp: {code: share}} dictionaries (see TweetDF.countyExtract)
+    universe - list of county codes (rows of the matrix)
+    states, weights - state codes and (states x counties) weight matrix (see stateWeights)
+    increment - length of time between consecutive time blocks (in minutes)
+    block_length - length of time block (in minutes)
+    t0 - optional: datetime-formatted start of the first block (default: time of the first record)
+    tweetweights - optional: array of per-record tally weights (default: 1)
+
+    RETURNS:
+    tally - (counties x blocks) array of tallies
+    '''
+
+    times, tweet, row, share = flattenRecords(records, universe, states)
+    start = times[0] if t0 is None or t0 is False else np.datetime64(pd.Timestamp(t0), 'ns')
+    blocks = blockCount(start, times[-1], increment, block_length)
+
+    if tweetweights is not None:
+        share = share * np.asarray(tweetweights, dtype=float)[tweet]
+
+    lo, hi = blockRanges(times[tweet], start, increment, block_length, blocks)
+    keep = lo <= hi
+    row, share, lo, hi = row[keep], share[keep], lo[keep], hi[keep]
+
+    # Difference arrays over (counties + states) x (blocks + 1), then one cumulative sum. The
+    # running count of contributing tweets is kept too, to zero out rounding residue exactly
+    # where no tweet contributes (tally2value() treats any nonzero tally as present).
+    nrows = len(universe) + len(states)
+    first, after = row * (blocks + 1) + lo, row * (blocks + 1) + hi + 1
+    diff = np.bincount(first, share, nrows * (blocks + 1)) - np.bincount(after, share, nrows * (blocks + 1))
+    count = np.bincount(first, minlength=nrows * (blocks + 1)) - np.bincount(after, minlength=nrows * (blocks + 1))
+    total = np.cumsum(diff.reshape(nrows, blocks + 1)[:, :blocks], axis=1)
+    total[np.cumsum(count.reshape(nrows, blocks + 1)[:, :blocks], axis=1) == 0] = 0
+
+    counties, bystate = total[:len(universe)], total[len(universe):]
+    if len(states):
+        counties = counties + weights.T @ bystate
+    return np.asarray(counties)
+
+def iterTallyRecords(countytallyfile, chunksize=1 << 22):
+    '''
+    USAGE:
+    Generator yielding the county tally records of "countytallyfile" (a JSON list, as written by
+    TweetDF.countyExtract, or concatenated records) one at a time. The file is read in chunks
+    and each record is decoded in place, so memory use does not grow with the file size.
+
+    ARGUMENTS:
+    countytallyfile - location of the county tally file
+    chunksize - number of bytes read from disk at a time
+
+    YIELDS:
+    record - {timestamp: {code: share}} dictionary
+    '''
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    separators = ' \t\r\n,['
+
+    with open(countytallyfile, 'rb') as f:
+        buf, pos, eof = '', 0, False
+        while True:
+            while pos < len(buf) and buf[pos] in separators:
+                pos += 1
+            if pos < len(buf) and buf[pos] == ']':
+                return
+
+            try:
+                if pos == len(buf):
+                    raise ValueError('buffer exhausted')
+                record, end = decoder.raw_decode(buf, pos)
+            except ValueError:      # incomplete record: read more text
+                if eof:
+                    if buf[pos:].strip():
+                        raise ValueError('Truncated or corrupt record in "%s".' % countytallyfile)
+                    return
+                chunk = f.read(chunksize)
+                eof = not chunk
+                buf, pos = buf[pos:] + utf8.decode(chunk, final=eof), 0
+                continue
+
+            pos = end
+            yield record
+
+def resizeMemmap(tallyfile, counties, blocks):
+    '''
+    USAGE:
+    Resizes the raw tally file to (counties x blocks) float64 values and maps it. The matrix is
+    stored column-major, so every block is contiguous on disk and blocks can be added (or cut off)
+    at the end of the file; new blocks are zero-filled.
+
+    RETURNS: tally - (counties x blocks) np.memmap
+    '''
+
+    with open(tallyfile, 'r+b') as f:
+        f.truncate(counties * blocks * 8)
+    return np.memmap(tallyfile, dtype=np.float64, mode='r+', shape=(counties, blocks), order='F')
+
+def tallyMemmap(records, universe, states, weights, increment, block_length, tallyfile, t0=None,
+                tweetweights=None, chunk=100000, maxcells=1 << 23):
+    '''
+    USAGE:
+    Out-of-core version of tallyMatrix(): records are flattened "chunk" at a time, and each chunk's
+    tallies are added into a memory-mapped (counties x blocks) matrix in "tallyfile", which is
+    flushed after every chunk. A chunk only touches the blocks its tweets fall in; these are
+    tallied in windows of at most "maxcells" (rows x blocks) values, so memory use is bounded by
+    the chunk and window sizes, not by the number of tweets or blocks. Records should be in time
+    order (as TweetDF.countyExtract writes them); otherwise chunks touch more blocks, but the
+    result is the same.
+
+    ARGUMENTS:
+    records - iterable of {timestamp: {code: share}} dictionaries (e.g. iterTallyRecords())
+    universe, states, weights, increment, block_length, t0 - see tallyMatrix()
+    tallyfile - location of the raw float64 file holding the matrix (column-major, see resizeMemmap)
+    tweetweights - optional: array of per-record tally weights (default: 1)
+    chunk - number of records flattened at a time
+    maxcells - maximum size of the dense window a chunk is tallied in
+
+    RETURNS:
+    tally - (counties x blocks) np.memmap of tallies, read-only
+    '''
+
+    if tweetweights is not None:
+        tweetweights = np.asarray(tweetweights, dtype=float)
+    records = iter(records)
+    nrows = len(universe) + len(states)
+    start, last, capacity, offset = None, None, 0, 0
+    tally = None
+    open(tallyfile, 'wb').close()
+
+    while True:
+        batch = list(itertools.islice(records, chunk))
+        if not batch:
+            break
+
+        times, tweet, row, share = flattenRecords(batch, universe, states)
+        if start is None:
+            start = times[0] if t0 is None or t0 is False else np.datetime64(pd.Timestamp(t0), 'ns')
+        last = times[-1]
+        if tweetweights is not None:
+            if offset + len(batch) > len(tweetweights):
+                raise ValueError('More tally records than tweet weights (%d).' % len(tweetweights))
+            share = share * tweetweights[offset + tweet]
+        offset += len(batch)
+
+        # Blocks are not capped until the last record is known (see blockCount)
+        lo, hi = blockRanges(times[tweet], start, increment, block_length, np.iinfo(np.int64).max)
+        keep = lo <= hi
+        row, share, lo, hi = row[keep], share[keep], lo[keep], hi[keep]
+        if not len(row):
+            continue
+
+        if hi.max() + 1 > capacity:     # grow the file (geometrically, to limit remapping)
+            if tally is not None:
+                tally.flush()
+            capacity = max(int(hi.max()) + 1, 2 * capacity)
+            tally = resizeMemmap(tallyfile, len(universe), capacity)
+
+        # Dense difference arrays over one window of blocks at a time (see tallyMatrix)
+        width = max(maxcells // nrows, 1)
+        for b0 in range(int(lo.min()), int(hi.max()) + 1, width):
+            b1 = min(b0 + width, int(hi.max()) + 1)
+            inside = (lo < b1) & (hi >= b0)
+            if not inside.any():
+                continue
+            r, w = row[inside], share[inside]
+            l, h = np.maximum(lo[inside], b0) - b0, np.minimum(hi[inside], b1 - 1) - b0
+            n = b1 - b0
+
+            first, after = r * (n + 1) + l, r * (n + 1) + h + 1
+            diff = np.bincount(first, w, nrows * (n + 1)) - np.bincount(after, w, nrows * (n + 1))
+            count = np.bincount(first, minlength=nrows * (n + 1)) - np.bincount(after, minlength=nrows * (n + 1))
+            total = np.cumsum(diff.reshape(nrows, n + 1)[:, :n], axis=1)
+            total[np.cumsum(count.reshape(nrows, n + 1)[:, :n], axis=1) == 0] = 0
+
+            counties = total[:len(universe)]
+            if len(states):
+                counties = counties + weights.T @ total[len(universe):]
+            tally[:, b0:b1] += np.asarray(counties)
+
+        tally.flush()
+
+    if start is None:
+        raise ValueError('No tally records to tally.')
+    if tweetweights is not None and offset != len(tweetweights):
+        raise ValueError('%d tally records for %d tweet weights.' % (offset, len(tweetweights)))
+
+    # Cut the matrix to the blocks tallyMatrix() would generate
+    blocks = blockCount(start, last, increment, block_length)
+    if tally is not None:
+        tally.flush()
+        del tally
+    resizeMemmap(tallyfile, len(universe), blocks)
+    return np.memmap(tallyfile, dtype=np.float64, mode='r', shape=(len(universe), blocks), order='F')
+
+def saveTally(filename, universe, tally, rows=256):
+    '''
+    USAGE:
+    Writes a tally matrix to a tally file in the format of TweetDF.timeTally() ({"CountyCode":
+    [Tally, ...]}), "rows" counties at a time, so a memory-mapped matrix is never loaded whole.
+    '''
+
+    with open(filename, 'w') as f:
+        f.write('{')
+        for i in range(0, len(universe), rows):
+            items = ['%s: %s' % (json.dumps(code), json.dumps(values))
+                     for code, values in zip(universe[i:i + rows], np.asarray(tally[i:i + rows]).tolist())]
+            f.write((', ' if i else '') + ', '.join(items))
+        f.write('}')
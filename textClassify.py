@@ -0,0 +1,74 @@
+'''
+Keyword classification of tweet text into categories (e.g. "totality", "partial",
+"glasses/weather"), so that each category can be tallied separately (see TweetDF.timeTally).
+
+All keyword patterns of all categories are compiled into one regular expression, with one named
+group per category, which is applied to all tweets at once with pandas' vectorized string methods
+(Series.str.extract). Each category's group sits in its own lookahead, so the group of every
+category the tweet mentions is filled, wherever the keyword appears; when a tweet matches several
+categories, the category listed first wins.
+'''
+
+import re
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+
+# Categories in order of priority, each with its keyword patterns (lowercase regular expressions,
+# matched against whole words of the lowercased text)
+CATEGORIES = [
+    ('totality', [r'totality', r'total (solar )?eclipse', r'diamond ring', r'corona', r"baily'?s beads",
+                  r'100 ?%', r'100 percent']),
+    ('partial', [r'partial', r'\d{1,2}(\.\d+)? ?%', r'\d{1,2}(\.\d+)? percent', r'crescent']),
+    ('glasses/weather', [r'(eclipse |solar )?glasses', r'pinhole', r'solar (filter|viewer)s?', r'welding',
+                         r'cloud(s|y)?', r'rain(s|ing|y)?', r'weather', r'overcast', r'fog(gy)?', r'storm(s|y)?']),
+]
+OTHER = 'other'     # Category of tweets matching no keyword
+
+def compileMatcher(categories=CATEGORIES):
+    '''
+    USAGE:
+    Compiles the keyword patterns of all categories into a single regular expression, anchored at
+    the start of the text, with one optional lookahead per category.
+
+    RETURNS: pattern - compiled regex with one named group ("c0", "c1", ...) per category, holding
+        the first keyword of the category in the text (or nothing)
+    '''
+
+    # Matching lowercased text is faster than re.IGNORECASE, and the (?=\w) lookahead quickly
+    # rejects word boundaries at the end of words before any alternative is tried
+    groups = [r'(?=(?:.*?\b(?=\w)(?P<c%d>%s)(?!\w))?)' % (i, '|'.join('(?:%s)' % k for k in keywords))
+              for i, (_, keywords) in enumerate(categories)]
+    return re.compile(r'(?s)^' + ''.join(groups))
+
+def classify(texts, categories=CATEGORIES, other=OTHER):
+    '''
+    USAGE:
+    Assigns each text the highest-priority category whose keywords it contains.
+
+    ARGUMENTS:
+    texts - iterable of tweet texts (non-string entries get the "other" category)
+    categories - list of (category, [keyword pattern, ...]) pairs, in order of priority
+    other - category of texts which match no keyword
+
+    RETURNS:
+    labels - list of category names, one per text
+    '''
+
+    pattern = compileMatcher(categories)
+    names = np.array([name for name, _ in categories] + [other], dtype=object)
+    texts = texts if isinstance(texts, pd.Series) else pd.Series(list(texts), dtype=object)
+
+    # Non-string texts become NaN when lowercased, and NaN texts match no group; the columns of the
+    # category groups are picked by name, since keyword patterns may hold groups of their own
+    found = texts.str.lower().str.extract(pattern)[['c%d' % i for i in range(len(categories))]].notna().values
+    best = np.where(found.any(axis=1), found.argmax(axis=1), len(categories))
+    return names[best].tolist()
+
+def categoryLabel(category):
+    '''
+    USAGE: Turns a category name into a label safe for use in file names ("glasses/weather" -> "glasses-weather").
+    '''
+
+    return re.sub(r'[^\w]+', '-', category).strip('-')
@@ -1,8 +1,9 @@
 import re
 import json
-import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
+import eclipsePath
+from lazyImports import lazyModule
+
+pd = lazyModule('pandas')
 
 def totalityNASA2JSON(totalityfile, outputGeoJSON):
     '''
@@ -19,7 +20,7 @@ def totalityNASA2JSON(totalityfile, outputGeoJSON):
     df - dataframe of eclipse path data extracted from "totalityfile"
     '''
     
-    with open(totalityfile, 'r') as tf:
+    with open(totalityfile, 'r', encoding='latin-1') as tf:   # NASA files use a latin-1 degree sign
         totalitydata = tf.read()
     
     tim = r'(\d+:\d+)'
@@ -83,61 +84,22 @@ def totalityNASA2JSON(totalityfile, outputGeoJSON):
     
     return df
 
-def centerEclipseJSON(df, outputCenterJSON):
+def centerEclipseJSON(df, outputCenterJSON, step=30):
     '''
     USAGE:
-    Interpolate NASA coordinates to get centerline coordinates every 30s.
+    Interpolate NASA coordinates to get centerline coordinates every "step" seconds.
     Outputs a new GeoJSON with just points along the totality centerline.
     
     ARGUMENTS:
     df - dataframe created from totalityNASA2JSON
     outputCenterJSON - output location for generated GeoJSON
+    step - time between interpolated points (in seconds)
     '''    
     
-    df['CentralLonLat']
-    coordlist = list(df['CentralLonLat'])
-    interp = []
-    
     print('Interpolating coordinates...')
-    for idx, val in enumerate(coordlist):
-        A = np.array(val)
-        interp.append(list(A))
-        if idx < len(df) - 1:
-            B = np.array(coordlist[idx + 1])
-            diff = B - A
-            for i in [1, 2, 3]:
-                v = A + i/4*diff
-                interp.append(list(v))
-
-    t0 = datetime(2017, 8, 21, 16, 50, 0) # first time in data collection
-    timelist = []
-    for i in range(len(interp)):
-        t = timedelta(seconds = i * 30) + t0
-        timelist.append(str(t.time()))
-
-    timeseries = pd.Series(timelist)
-    interpseries = pd.Series(interp)
-    inter_df = pd.DataFrame(timeseries, columns = ['Time'])
-    inter_df['CentralLonLat'] = interpseries
-    inter_df
-
-    features = []
-    for i in range(len(inter_df)):
-        point = {"type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": inter_df.iloc[i]['CentralLonLat']
-            },
-            "properties": {
-                "Time" : inter_df.iloc[i]['Time'] 
-            }
-        }
-        features.append(point)
-
-    centerJSON = {
-        "type": "FeatureCollection",
-        "features": features
-    }
+    path = eclipsePath.dataframe2path(df)
+    interp = eclipsePath.interpolatePath(path, step)
+    centerJSON = eclipsePath.centerGeoJSON(interp)
 
     with open(outputCenterJSON, 'w') as f:
         json.dump(centerJSON, f)
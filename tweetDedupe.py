@@ -0,0 +1,153 @@
+'''
+Streaming suppression of retweets and near-duplicate tweets.
+
+Each tweet is reduced to 64-bit fingerprints of its normalized text, and of (user, normalized
+text); normalization strips retweet prefixes, links, case, and punctuation, so retweets and
+trivially edited copies share fingerprints. A retweet ("RT @user: ...") repeats any earlier tweet
+with the same text, whoever posted it, so cascades of retweets by different users count once. Any
+other tweet only repeats an earlier tweet of the same user with the same text (different users
+independently posting the same short text are not repeats).
+
+Fingerprints are kept per time bucket, and a tweet repeats an earlier one if the fingerprint was
+seen in its own or the previous bucket. Buckets older than that are forgotten (by bucket time, so
+tweets arriving somewhat out of order are handled), so memory is bounded by the number of tweets
+in two buckets (and by "maxsize"), and tweets can be checked one at a time as they arrive.
+'''
+
+import re
+import hashlib
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+
+RETWEET = re.compile(r'^(rt\s+@\w+:?\s*)+')     # "RT @user: " prefixes
+LINK = re.compile(r'https?://\S+')              # links (shortened links differ between copies)
+NONWORD = re.compile(r'[\W_]+')                 # punctuation, emoji, and whitespace runs
+
+def isRetweet(text):
+    '''
+    USAGE: Checks whether tweet text starts with a retweet prefix.
+    '''
+
+    return bool(RETWEET.match(text.lower().strip()))
+
+def normalizeText(text):
+    '''
+    USAGE: Normalizes tweet text for duplicate detection (see module docstring).
+    '''
+
+    text = LINK.sub(' ', RETWEET.sub('', text.lower().strip()))
+    return NONWORD.sub(' ', text).strip()
+
+def fingerprint(*parts):
+    '''
+    USAGE: Hashes normalized text, optionally preceded by a user, into a 64-bit integer fingerprint.
+    '''
+
+    key = '\x00'.join(str(part) for part in parts).encode('utf-8', 'replace')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+class Deduplicator():
+    '''
+    Bounded-memory set of recent tweet fingerprints, grouped by time bucket.
+    '''
+
+    def __init__(self, bucket_minutes=10, maxsize=1000000):
+        '''
+        Initialize Deduplicator object.
+
+        ARGUMENTS:
+        bucket_minutes - length of time buckets (a repeat must follow within 1-2 buckets)
+        maxsize - maximum number of fingerprints kept (oldest buckets are dropped first)
+        '''
+
+        self.bucket_seconds = bucket_minutes * 60       # Length of time buckets (s)
+        self.maxsize = maxsize                          # Maximum number of fingerprints kept
+        self.buckets = {}                               # {bucket: {fingerprint: count}}
+        self.size = 0                                   # Number of fingerprints kept
+        self.checked = 0                                # Number of tweets checked
+        self.repeats = 0                                # Number of tweets found to be repeats
+
+    def check(self, user, text, timestamp):
+        '''
+        USAGE:
+        Records a tweet and returns how many earlier copies it has within the current and previous
+        time bucket: tweets with the same (normalized) text for a retweet, or tweets of the same
+        user with the same text otherwise.
+
+        ARGUMENTS:
+        user - user name or id
+        text - tweet text
+        timestamp - tweet time (datetime-like or seconds since epoch)
+
+        RETURNS:
+        repeat - number of earlier copies (0 for an original tweet)
+        '''
+
+        seconds = timestamp if isinstance(timestamp, (int, float)) else pd.Timestamp(timestamp).timestamp()
+        bucket = int(seconds // self.bucket_seconds)
+        text = text if isinstance(text, str) else ''
+        normal = normalizeText(text)
+        textprint, userprint = fingerprint(normal), fingerprint(user, normal)
+
+        # Forget buckets which can no longer hold repeats, and the oldest ones beyond maxsize
+        while self.buckets:
+            oldest = min(self.buckets)
+            if oldest >= bucket - 1 and self.size < self.maxsize:
+                break
+            self.size -= len(self.buckets.pop(oldest))
+
+        previous = self.buckets.get(bucket - 1, {})
+        current = self.buckets.setdefault(bucket, {})
+        fp = textprint if isRetweet(text) else userprint
+        repeat = previous.get(fp, 0) + current.get(fp, 0)
+
+        for fp in (textprint, userprint):
+            if fp not in current:
+                self.size += 1
+            current[fp] = current.get(fp, 0) + 1
+        self.checked += 1
+        self.repeats += repeat > 0
+        return repeat
+
+    def __str__(self):
+        return '%d tweets checked, %d repeats found, %d fingerprints kept' % (self.checked, self.repeats, self.size)
+
+def repeatWeights(repeats, mode='weight'):
+    '''
+    USAGE:
+    Converts repeat counts into tally weights: with mode "drop", repeats get weight 0; with mode
+    "weight", the k-th repeat gets weight 1/(k + 1). Original tweets always get weight 1.
+
+    RETURNS: weights - array of tally weights
+    '''
+
+    repeats = np.asarray(repeats, dtype=float)
+    if mode == 'drop':
+        return np.where(repeats > 0, 0.0, 1.0)
+    if mode == 'weight':
+        return 1 / (repeats + 1)
+    raise ValueError('Unknown deduplication mode "%s" (use "drop" or "weight").' % mode)
+
+def dedupeFrame(df, mode='weight', bucket_minutes=10, maxsize=1000000):
+    '''
+    USAGE:
+    Streams the tweets of a dataframe (columns "User", "Text", "Datetime") through a Deduplicator
+    in time order.
+
+    RETURNS:
+    weights - array of tally weights in dataframe row order (see repeatWeights)
+    dedupe - the Deduplicator, with its counts
+    '''
+
+    dedupe = Deduplicator(bucket_minutes, maxsize)
+    seconds = pd.to_datetime(df['Datetime']).values.astype('datetime64[s]').astype('int64')
+    order = np.argsort(seconds, kind='stable')
+    users, texts = df['User'].values, df['Text'].values
+
+    repeats = np.zeros(len(df))
+    for i in order:
+        repeats[i] = dedupe.check(users[i], texts[i], int(seconds[i]))
+
+    return repeatWeights(repeats, mode), dedupe
@@ -0,0 +1,234 @@
+'''
+Query index over a processed tweet dataframe (TweetDF.df), answering "tweets between t1 and t2
+inside this bounding box or county" without scanning every row.
+
+Three structures are built over the row positions of the dataframe:
+    - a time index: all rows sorted by "Datetime", searched with binary search;
+    - a spatial grid: a uniform LON/LAT grid, with the rows of each cell stored contiguously and
+      sorted by time under one (cell, time rank) integer key, so a bounding box binary-searches
+      the time range of all its overlapping cells in one vectorized searchsorted call;
+    - a county index: for each code in the "CountyCode" tally dictionaries (5-digit county codes,
+      and 2-digit state codes for tweets with only state-level precision), the rows listed under
+      that code sorted by time (built the first time a county is queried). A county query also
+      returns the state-level tweets of its state, since their tallies are spread over every
+      county of the state (see TweetDF.timeTally).
+'''
+
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+
+def tweetCoordinates(df):
+    '''
+    USAGE: Extracts longitude/latitude arrays from the "listLATLON" (or "LON" and "LAT") columns.
+    RETURNS: lon, lat - arrays of tweet coordinates (degrees; NaN where unknown)
+    '''
+
+    if 'listLATLON' in df.keys():
+        latlon = np.array(list(df['listLATLON']), dtype=float).reshape(-1, 2)
+        return latlon[:,1], latlon[:,0]
+    return df['LON'].values.astype(float), df['LAT'].values.astype(float)
+
+def timeValue(t):
+    '''
+    USAGE: Converts a datetime-formatted value or string to the integer (ns) keys of the time index.
+    '''
+
+    return pd.Timestamp(t).to_datetime64().astype('datetime64[ns]').view('int64')
+
+class TweetIndex():
+    '''
+    Time, spatial, and county index over the rows of a tweet dataframe.
+    '''
+
+    def __init__(self, df, cell=0.5):
+        '''
+        Initialize TweetIndex object.
+
+        ARGUMENTS:
+        df - processed tweet dataframe with a "Datetime" column and tweet coordinates
+        cell - size of spatial grid cells (degrees)
+        '''
+
+        self.df = df                                        # Indexed tweet dataframe
+        self.cell = cell                                    # Grid cell size (degrees)
+        self.times = pd.to_datetime(df['Datetime']).values.astype('datetime64[ns]').view('int64')
+        self.lon, self.lat = tweetCoordinates(df)           # Tweet coordinates (degrees)
+
+        # Time index: row positions in time order
+        self.order = np.argsort(self.times, kind='stable')
+        self.sortedtimes = self.times[self.order]
+
+        # Spatial grid: rows sorted by (cell, time); rows without coordinates go in a last, unused cell
+        located = np.isfinite(self.lon) & np.isfinite(self.lat)
+        if located.any():
+            self.west = np.floor(self.lon[located].min() / cell) * cell
+            self.south = np.floor(self.lat[located].min() / cell) * cell
+            self.shape = (int((self.lat[located].max() - self.south) // cell) + 1,
+                          int((self.lon[located].max() - self.west) // cell) + 1)
+        else:
+            self.west, self.south, self.shape = 0.0, 0.0, (0, 0)
+        ncells = self.shape[0] * self.shape[1]
+
+        cellid = np.full(len(df), ncells)
+        row = ((self.lat[located] - self.south) // cell).astype(int)
+        col = ((self.lon[located] - self.west) // cell).astype(int)
+        cellid[located] = row * self.shape[1] + col
+
+        # Grid key: cell * (rows + 1) + time rank, where a row's time rank is the number of rows
+        # before it in time (ties share a rank), so a time range is a key range in every cell
+        self.gridorder = np.lexsort((self.times, cellid))
+        rank = np.searchsorted(self.sortedtimes, self.times[self.gridorder], side='left')
+        self.gridkeys = cellid[self.gridorder].astype(np.int64) * (len(df) + 1) + rank
+
+        self.counties = None                                # County code -> position in county index
+        self.countyorder = None                             # Row positions sorted by (county, time)
+        self.countytimes = None                             # Times of countyorder rows
+        self.countystart = None                             # Start of each county's rows in countyorder
+
+    def buildCountyIndex(self):
+        '''
+        USAGE:
+        Builds the county index from the "CountyCode" column ({timestamp: {code: share}} dicts).
+        Every row is listed under every code (county, or state for state-level tweets) it gives a 
+        nonzero share of its tally to.
+        '''
+
+        codes, rows = [], []
+        for i, entry in enumerate(self.df['CountyCode']):
+            for codetallydict in entry.values():
+                for code, share in codetallydict.items():
+                    if code not in (None, 'null') and share:
+                        codes.append(code)
+                        rows.append(i)
+
+        self.counties = {code: n for n, code in enumerate(sorted(set(codes)))}
+        county = np.array([self.counties[code] for code in codes], dtype=int)
+        rows = np.array(rows, dtype=int)
+
+        order = np.lexsort((self.times[rows], county))
+        self.countyorder = rows[order]
+        self.countytimes = self.times[self.countyorder]
+        self.countystart = np.searchsorted(county[order], np.arange(len(self.counties) + 1))
+
+    def timeRange(self, times, lo, hi, start, end):
+        '''
+        USAGE: Binary-searches the [start, end) range inside the sorted slice times[lo:hi].
+        RETURNS: lo, hi - bounds of the matching slice
+        '''
+
+        if start is not None:
+            lo = lo + np.searchsorted(times[lo:hi], timeValue(start), side='left')
+        if end is not None:
+            hi = lo + np.searchsorted(times[lo:hi], timeValue(end), side='left')
+        return lo, max(lo, hi)
+
+    def bboxPositions(self, bbox, start, end):
+        '''
+        USAGE:
+        Finds the rows inside a bounding box and time range. The time range of every overlapping
+        cell is found in one vectorized binary search over the grid keys, and the matching slices
+        are gathered at once. Cells entirely inside the box only need their time range; rows in
+        cells cut by the edge of the box are also checked individually.
+
+        RETURNS: positions - unsorted array of row positions
+        '''
+
+        west, south, east, north = bbox
+        rows, cols = self.shape
+        r0, r1 = max(int((south - self.south) // self.cell), 0), min(int((north - self.south) // self.cell), rows - 1)
+        c0, c1 = max(int((west - self.west) // self.cell), 0), min(int((east - self.west) // self.cell), cols - 1)
+        if r0 > r1 or c0 > c1:
+            return np.array([], dtype=int)
+
+        r, c = np.meshgrid(np.arange(r0, r1 + 1), np.arange(c0, c1 + 1), indexing='ij')
+        r, c = r.ravel(), c.ravel()
+        n = len(self.times) + 1
+        first = 0 if start is None else np.searchsorted(self.sortedtimes, timeValue(start), side='left')
+        last = n - 1 if end is None else np.searchsorted(self.sortedtimes, timeValue(end), side='left')
+        base = (r * cols + c).astype(np.int64) * n
+        lo = np.searchsorted(self.gridkeys, base + first, side='left')
+        hi = np.maximum(np.searchsorted(self.gridkeys, base + last, side='left'), lo)
+
+        # Concatenated ranges lo[i]:hi[i], and whether each found row lies in a cell cut by the box
+        length = hi - lo
+        total = int(length.sum())
+        offset = np.repeat(lo - np.cumsum(length) + length, length)
+        found = self.gridorder[offset + np.arange(total)]
+        cw, cs = self.west + c * self.cell, self.south + r * self.cell
+        cut = np.repeat(~((west <= cw) & (cw + self.cell <= east) & (south <= cs) & (cs + self.cell <= north)), length)
+
+        lon, lat = self.lon[found[cut]], self.lat[found[cut]]
+        keep = ~cut
+        keep[cut] = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+        return found[keep]
+
+    def countyPositions(self, county, start, end):
+        '''
+        USAGE:
+        Finds the rows tallied to a county (or list of counties) inside a time range, including the
+        state-level tweets of each county's state.
+
+        RETURNS: positions - unsorted array of row positions
+        '''
+
+        if self.counties is None:
+            self.buildCountyIndex()
+
+        codes = [county] if isinstance(county, str) else list(county)
+        codes = set(codes) | {code[:2] for code in codes if len(code) == 5}
+        found = []
+        for code in codes:
+            if code in self.counties:
+                n = self.counties[code]
+                lo, hi = self.timeRange(self.countytimes, self.countystart[n], self.countystart[n + 1], start, end)
+                found.append(self.countyorder[lo:hi])
+
+        return np.unique(np.concatenate(found)) if found else np.array([], dtype=int)
+
+    def positions(self, start=None, end=None, bbox=None, county=None):
+        '''
+        USAGE:
+        Finds the row positions of all tweets matching a query, in time order.
+
+        ARGUMENTS:
+        start - optional: datetime-formatted start of time range (inclusive)
+        end - optional: datetime-formatted end of time range (exclusive)
+        bbox - optional: (west, south, east, north) bounding box (degrees, inclusive)
+        county - optional: 5-digit county code string, or list of codes
+
+        RETURNS:
+        positions - array of row positions (for df.iloc), sorted by time
+        '''
+
+        if bbox is None and county is None:
+            lo, hi = self.timeRange(self.sortedtimes, 0, len(self.sortedtimes), start, end)
+            return self.order[lo:hi]
+
+        if bbox is not None and county is not None:
+            found = np.intersect1d(self.bboxPositions(bbox, start, end), self.countyPositions(county, start, end))
+        elif bbox is not None:
+            found = self.bboxPositions(bbox, start, end)
+        else:
+            found = self.countyPositions(county, start, end)
+
+        return found[np.argsort(self.times[found], kind='stable')]
+
+    def query(self, start=None, end=None, bbox=None, county=None, chunk=10000):
+        '''
+        USAGE:
+        Generator yielding the tweets matching a query (see positions) as consecutive dataframe
+        slices of at most "chunk" rows, in time order.
+        '''
+
+        found = self.positions(start, end, bbox, county)
+        for i in range(0, len(found), chunk):
+            yield self.df.iloc[found[i:i + chunk]]
+
+    def count(self, start=None, end=None, bbox=None, county=None):
+        '''
+        USAGE: Returns the number of tweets matching a query (see positions).
+        '''
+
+        return len(self.positions(start, end, bbox, county))
@@ -0,0 +1,124 @@
+'''
+Columnar (Parquet) persistence for the processed tweet dataframe of a TweetDF.
+
+Tweets are written in their original row order (which the revgeofile and countytallyfile records
+are aligned with), together with a "_row" column of row positions that becomes the index of a loaded
+dataframe, so a partial read still knows which rows it holds. The capture is written roughly in
+time order, so the min/max "Datetime" statistics Parquet keeps for every row group still let a
+time-range read skip most row groups outside the range (predicate pushdown), and only the requested
+columns are decoded (column projection). The raw capture a file was made from is kept in its
+metadata (see frameInfo()).
+
+Columns holding nested Python objects with no fixed type ("Place" lists, "CountyCode"
+dictionaries) are stored as JSON text and decoded on load. The "State" column, which holds either
+a state code string or False, is stored as a nullable string.
+'''
+
+import json
+from lazyImports import lazyModule
+
+np = lazyModule('numpy')
+pd = lazyModule('pandas')
+pa = lazyModule('pyarrow')
+pq = lazyModule('pyarrow.parquet')
+
+JSON_COLUMNS = ['Place', 'CountyCode']      # Columns stored as JSON text
+METADATA_KEY = b'tweetdf.json_columns'      # Parquet metadata key listing the JSON text columns
+SOURCE_KEY = b'tweetdf.source'              # Parquet metadata key holding the raw capture the file was made from
+ROW_COLUMN = '_row'                         # Column holding the row position of every tweet
+
+def saveFrame(df, filepath, row_group_size=100000, source=None):
+    '''
+    USAGE: Writes a processed tweet dataframe to a Parquet file, keeping its row order.
+
+    ARGUMENTS:
+    df - processed tweet dataframe (TweetDF.df)
+    filepath - location of Parquet file
+    row_group_size - number of tweets per row group (the unit of skipping for time-range reads)
+    source - optional: location of the raw capture the dataframe was made from
+    '''
+
+    out = pd.DataFrame({ROW_COLUMN: np.arange(len(df), dtype='int64')}, index=df.index)
+    json_columns = []
+
+    for column in df.keys():
+        if column in JSON_COLUMNS:
+            out[column] = [json.dumps(x) for x in df[column]]
+            json_columns.append(column)
+        elif column == 'State':
+            out[column] = [x if isinstance(x, str) else None for x in df[column]]
+        elif column == 'listLATLON':
+            out[column] = [list(x) for x in df[column]]
+        else:
+            out[column] = df[column]
+
+    table = pa.Table.from_pandas(out.reset_index(drop=True), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps(json_columns).encode()
+    if source is not None:
+        metadata[SOURCE_KEY] = str(source).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), filepath, row_group_size=row_group_size)
+
+def loadFrame(filepath, columns=None, start=None, end=None):
+    '''
+    USAGE: Reads a processed tweet dataframe from a Parquet file written by saveFrame().
+
+    ARGUMENTS:
+    filepath - location of Parquet file
+    columns - optional: list of columns to read (default: all)
+    start - optional: only read tweets with Datetime >= start
+    end - optional: only read tweets with Datetime < end
+
+    RETURNS:
+    df - tweet dataframe, in the same layout as TweetDF.df (indexed by the row positions of the saved dataframe)
+    '''
+
+    filters = []
+    if start is not None:
+        filters.append(('Datetime', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('Datetime', '<', pd.Timestamp(end)))
+
+    if columns is not None and ROW_COLUMN not in columns:
+        columns = [ROW_COLUMN] + list(columns)
+    table = pq.read_table(filepath, columns=columns, filters=filters or None)
+    metadata = table.schema.metadata or {}
+    json_columns = json.loads(metadata.get(METADATA_KEY, b'[]'))
+    df = table.to_pandas()
+    if ROW_COLUMN in df.keys():
+        df = df.set_index(ROW_COLUMN).rename_axis(None)
+
+    for column in df.keys():
+        if column in json_columns:
+            df[column] = [json.loads(x) for x in df[column]]
+        elif column == 'State':
+            df[column] = pd.Series([x if isinstance(x, str) else False for x in df[column]], index=df.index, dtype=object)
+        elif column == 'listLATLON':
+            df[column] = [list(x) for x in df[column]]
+
+    return df
+
+def frameInfo(filepath):
+    '''
+    USAGE: Summarizes a Parquet file written by saveFrame() without reading its data.
+    RETURNS: info - dictionary of "rows", "row_groups", "columns", "start" and "end" (Datetime range), and
+    "source" (raw capture the file was made from, or None)
+    '''
+
+    pf = pq.ParquetFile(filepath)
+    meta = pf.metadata
+    source = (pf.schema_arrow.metadata or {}).get(SOURCE_KEY)
+    info = {'rows': meta.num_rows, 'row_groups': meta.num_row_groups,
+            'columns': [c for c in pf.schema_arrow.names if c != ROW_COLUMN], 'start': None, 'end': None,
+            'source': source.decode() if source is not None else None}
+
+    leaves = [meta.schema.column(i).path for i in range(meta.num_columns)]
+    if 'Datetime' in leaves:
+        i = leaves.index('Datetime')
+        stats = [meta.row_group(g).column(i).statistics for g in range(meta.num_row_groups)]
+        stats = [s for s in stats if s is not None and s.has_min_max]
+        if stats:
+            info['start'] = min(s.min for s in stats)
+            info['end'] = max(s.max for s in stats)
+
+    return info